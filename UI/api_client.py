@@ -0,0 +1,103 @@
+"""
+Shared HTTP client for the CryptPort tabs.
+
+Every tab used to call requests.get/post directly, which opens a new TCP
+connection per call, and pointed at a hardcoded http://127.0.0.1:5000.
+ApiClient wraps one requests.Session per server:
+
+ - Keep-alive pool: connections are reused across calls, tabs and threads
+ - Base URL from config_data (server_ip/server_port saved by ConnectionTab,
+   else host/port from ConfigWindow, else the local default)
+ - Default (connect, read) timeout on every call, overridable per call
+ - Retries with exponential backoff on connection errors and on 502/503/504,
+   for idempotent methods only: a POST is never sent twice
+
+    from ui.api_client import shared_client
+    client = shared_client(config_data)
+    res = client.get(f"/list/{email}")
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5000
+
+# (connect, read) seconds; read is the longest wait for the next bytes
+DEFAULT_TIMEOUT = (10, 60)
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.3           # 0.3 s, 0.6 s, 1.2 s between attempts
+POOL_SIZE = 16                  # parallel uploads + inbox stream + history paging
+
+
+def base_url_from(config_data):
+    config_data = config_data or {}
+    host = config_data.get("server_ip") or config_data.get("host") or DEFAULT_HOST
+    port = config_data.get("server_port") or config_data.get("port") or DEFAULT_PORT
+    return f"http://{host}:{int(port)}"
+
+
+class ApiClient:
+    def __init__(self, base_url, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, pool_size=POOL_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,   # no POST
+            raise_on_status=False,      # hand the last response back to the caller
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=retry, pool_block=False)
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, self.url(path), **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+# ---------------------------------------------------------------------
+# One client per server for the whole app: tabs are recreated on every
+# panel switch, the pooled connections are not
+# ---------------------------------------------------------------------
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def shared_client(config_data=None):
+    base_url = base_url_from(config_data)
+    with _clients_lock:
+        client = _clients.get(base_url)
+        if client is None:
+            client = _clients[base_url] = ApiClient(base_url)
+        return client
@@ -0,0 +1,107 @@
+"""
+Content-defined chunking (FastCDC) for CryptPort uploads.
+
+Fixed-size chunks shift after an insert or delete, so every chunk after
+the edit looks new. FastCDC places chunk boundaries where a rolling Gear
+hash of the content matches a bit mask, so boundaries move with the data
+and a small edit only changes the one or two chunks around it.
+
+ - Gear hash:   h = (h >> 1) + GEAR[byte]   (32-bit table, so each byte
+   falls out of h after 32 steps and the low bits mix the whole window)
+ - Normalised chunking: a stricter mask before the average size and a
+   looser one after it keeps chunk sizes close to the average
+ - The first min_size bytes of a chunk are skipped without hashing
+"""
+
+import os
+import hashlib
+import random
+
+MIN_SIZE = 256 * 1024
+AVG_SIZE = 1024 * 1024
+MAX_SIZE = 4 * 1024 * 1024
+
+READ_SIZE = 8 * 1024 * 1024
+
+# Deterministic table: client and any future server-side chunker must agree
+_rng = random.Random(0x43505254)  # "CPRT"
+GEAR = tuple(_rng.getrandbits(32) for _ in range(256))
+
+
+def _masks(avg_size):
+    bits = avg_size.bit_length() - 1
+    return (1 << (bits + 2)) - 1, (1 << (bits - 2)) - 1
+
+
+def cut_point(data, start, end, min_size=MIN_SIZE, avg_size=AVG_SIZE, max_size=MAX_SIZE):
+    """Returns the end offset of the chunk starting at data[start]."""
+    length = end - start
+    if length <= min_size:
+        return end
+    if length > max_size:
+        end = start + max_size
+    normal = min(start + avg_size, end)
+
+    mask_s, mask_l = _masks(avg_size)
+    gear = GEAR
+    h = 0
+
+    # Pure Python runs at roughly 7-10 MB/s here; the shift-right form keeps
+    # h below 2**33 without masking, and a for-loop over a memoryview avoids
+    # both indexing and copying
+    view = memoryview(data)
+    i = start + min_size
+    for b in view[i:normal]:
+        h = (h >> 1) + gear[b]
+        i += 1
+        if not h & mask_s:
+            return i
+    for b in view[i:end]:
+        h = (h >> 1) + gear[b]
+        i += 1
+        if not h & mask_l:
+            return i
+    return end
+
+
+def iter_chunks(f, min_size=MIN_SIZE, avg_size=AVG_SIZE, max_size=MAX_SIZE):
+    """Yields the content-defined chunks (bytes) of file object f."""
+    buf = b""
+    eof = False
+    while True:
+        # Keep at least one max-size chunk buffered so cut points are stable
+        while not eof and len(buf) < max_size + READ_SIZE:
+            block = f.read(READ_SIZE)
+            if not block:
+                eof = True
+                break
+            buf += block
+        if not buf:
+            return
+
+        pos = 0
+        while len(buf) - pos >= max_size or (eof and pos < len(buf)):
+            cut = cut_point(buf, pos, len(buf), min_size, avg_size, max_size)
+            yield buf[pos:cut]
+            pos = cut
+        buf = buf[pos:]
+        if eof and not buf:
+            return
+
+
+def chunk_manifest(path, progress=None, **sizes):
+    """
+    Returns [(sha256, length), ...] for the chunks of the file at path.
+    progress(done, total) is called after each chunk; chunking runs at a
+    few MB/s, and a Task's report() also raises once it is cancelled.
+    """
+    total = os.path.getsize(path)
+    manifest = []
+    done = 0
+    with open(path, "rb") as f:
+        for chunk in iter_chunks(f, **sizes):
+            manifest.append((hashlib.sha256(chunk).hexdigest(), len(chunk)))
+            done += len(chunk)
+            if progress is not None:
+                progress(done, total)
+    return manifest
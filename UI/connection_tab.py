@@ -15,14 +15,19 @@ from PyQt5.QtWidgets import (
     QWidget, QVBoxLayout, QLabel, QLineEdit, QPushButton,
     QMessageBox, QHBoxLayout
 )
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtGui import QFont, QColor, QPalette
 
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives import serialization
 
+from ui.workers import Task
+
 
 class ConnectionTab(QWidget):
+    # Emitted once a connection test succeeds and server_ip/port are saved
+    connected = pyqtSignal()
+
     def __init__(self, config_data):
         super().__init__()
         self.config_data = config_data  
@@ -30,6 +35,7 @@ class ConnectionTab(QWidget):
 
         self.server_ip = ""
         self.server_port = ""
+        self.connect_task = None
 
         self.init_ui()
         self.load_saved_config()
@@ -215,21 +221,43 @@ class ConnectionTab(QWidget):
         if not ip or not port:
             self.alert("Missing Data", "Enter server IP and port.")
             return
+        if self.connect_task is not None:
+            return
 
+        # The connect can block for up to 3 s: keep it off the GUI thread
+        self.connect_btn.setEnabled(False)
+        self.connect_btn.setText("Connecting…")
+        self.connect_task = Task(self.probe_server, ip, port)
+        self.connect_task.signals.result.connect(self.on_connection_ok)
+        self.connect_task.signals.error.connect(self.on_connection_error)
+        self.connect_task.signals.finished.connect(self.on_connection_finished)
+        self.connect_task.start()
+
+    def probe_server(self, task, ip, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             sock.settimeout(3)
             sock.connect((ip, int(port)))
+        finally:
             sock.close()
+        return ip, int(port)
 
-            self.config_data["server_ip"] = ip
-            self.config_data["server_port"] = int(port)
+    def on_connection_ok(self, address):
+        ip, port = address
+        self.config_data["server_ip"] = ip
+        self.config_data["server_port"] = port
+
+        self.save_config()
+        self.alert("Connection Success", "Connected to the server!")
+        self.connected.emit()
 
-            self.save_config()
-            self.alert("Connection Success", "Connected to the server!")
+    def on_connection_error(self, error):
+        self.alert("Connection Error", str(error))
 
-        except Exception as e:
-            self.alert("Connection Error", str(e))
+    def on_connection_finished(self):
+        self.connect_task = None
+        self.connect_btn.setEnabled(True)
+        self.connect_btn.setText("Test Connection")
 
     # ---------------------------------------------------------
     # RSA KEYS
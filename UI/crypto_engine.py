@@ -0,0 +1,454 @@
+"""
+Crypto engine for CryptPort
+Handles:
+ - Hybrid envelope encryption (AES-256-GCM data, RSA-OAEP wrapped session key)
+ - Multi-recipient containers: data encrypted once, session key wrapped per key
+ - Constant-memory streaming in fixed-size frames (read → seal → write pipeline)
+ - Optional multi-core frame sealing through a thread or process pool
+ - Versioned .enc container with header, frame index and random-access reads
+ - Legacy raw RSA-OAEP chunk format (214-byte plaintext / 256-byte blocks)
+ - Format detection so old .enc files keep decrypting
+"""
+
+import os
+import struct
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from Crypto.Cipher import AES, PKCS1_OAEP
+from Crypto.Random import get_random_bytes
+
+
+# ----------------------------------------------------------
+# FORMAT CONSTANTS
+# ----------------------------------------------------------
+MAGIC = b"CPENC"
+INDEX_MAGIC = b"CPIDX"
+VERSION_CONTAINER = 3      # header + frames + frame index (seekable)
+
+ALGORITHM_AES_256_GCM = 1
+ALGORITHM_NAMES = {ALGORITHM_AES_256_GCM: "AES-256-GCM"}
+
+SESSION_KEY_SIZE = 32      # AES-256
+NONCE_PREFIX_SIZE = 8      # frame nonce = prefix (8) + frame index (4)
+TAG_SIZE = 16
+FINGERPRINT_SIZE = 32      # SHA-256 of the recipient public key (DER)
+MAX_RECIPIENTS = 0xFFFF    # recipient count is a 2-byte header field
+
+DEFAULT_FRAME_SIZE = 1024 * 1024
+
+LEGACY_PLAIN_CHUNK = 214   # max OAEP(SHA-1) payload for a 2048-bit key
+LEGACY_CIPHER_CHUNK = 256  # one RSA-2048 block
+
+TRAILER = struct.Struct(">Q5s")        # index offset | INDEX_MAGIC
+INDEX_ENTRY = struct.Struct(">QI")     # frame offset | plaintext length
+
+
+# ----------------------------------------------------------
+# KEY WRAPPING
+# ----------------------------------------------------------
+def wrap_session_key(session_key, public_key):
+    return PKCS1_OAEP.new(public_key).encrypt(session_key)
+
+
+def unwrap_session_key(wrapped_key, private_key):
+    return PKCS1_OAEP.new(private_key).decrypt(wrapped_key)
+
+
+def key_fingerprint(key):
+    """SHA-256 of the DER public key; accepts a public or private RSA key."""
+    public_key = key.publickey() if key.has_private() else key
+    return hashlib.sha256(public_key.export_key(format="DER")).digest()
+
+
+def wrap_for_recipients(session_key, public_keys):
+    """
+    Returns [(fingerprint, wrapped_key), ...] for one key or a list of keys.
+    Duplicate keys are wrapped once. Only this step grows with the number of
+    recipients; the file itself is still encrypted a single time.
+    """
+    if not isinstance(public_keys, (list, tuple)):
+        public_keys = [public_keys]
+
+    recipients = {}
+    for public_key in public_keys:
+        fingerprint = key_fingerprint(public_key)
+        if fingerprint not in recipients:
+            recipients[fingerprint] = wrap_session_key(session_key, public_key)
+
+    if not recipients:
+        raise ValueError("At least one recipient public key is required")
+    if len(recipients) > MAX_RECIPIENTS:
+        raise ValueError(f"Too many recipients (max {MAX_RECIPIENTS})")
+    return list(recipients.items())
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("Encrypted file is truncated")
+    return data
+
+
+# ----------------------------------------------------------
+# FRAME PIPELINE
+#   read_frames → seal_frames / open_frames → write_chunks
+# Every stage is a generator, so at most one frame is held in memory.
+# ----------------------------------------------------------
+def read_frames(f, frame_size):
+    """Yields (index, data, is_final); looks one frame ahead to flag the last."""
+    index = 0
+    current = f.read(frame_size)
+    while True:
+        following = f.read(frame_size) if current else b""
+        is_final = not following
+        yield index, current, is_final
+        if is_final:
+            return
+        current = following
+        index += 1
+
+
+def frame_nonce(nonce_prefix, index):
+    return nonce_prefix + struct.pack(">I", index)
+
+
+def frame_aad(index, is_final, context=b""):
+    # Binding the index and the final flag rejects reordered or truncated files;
+    # context carries the container header digest so the header can't be swapped
+    return context + struct.pack(">IB", index, 1 if is_final else 0)
+
+
+def seal_frame(session_key, nonce_prefix, index, data, is_final, context=b""):
+    """Returns ciphertext + tag for one frame."""
+    cipher = AES.new(session_key, AES.MODE_GCM, nonce=frame_nonce(nonce_prefix, index))
+    cipher.update(frame_aad(index, is_final, context))
+    ciphertext, tag = cipher.encrypt_and_digest(data)
+    return ciphertext + tag
+
+
+def open_frame(session_key, nonce_prefix, index, ciphertext, tag, is_final, context=b""):
+    cipher = AES.new(session_key, AES.MODE_GCM, nonce=frame_nonce(nonce_prefix, index))
+    cipher.update(frame_aad(index, is_final, context))
+    return cipher.decrypt_and_verify(ciphertext, tag)
+
+
+def seal_frames(frames, session_key, nonce_prefix, context=b""):
+    for index, data, is_final in frames:
+        yield seal_frame(session_key, nonce_prefix, index, data, is_final, context)
+
+
+def open_frames(sealed, session_key, nonce_prefix, context=b""):
+    saw_final = False
+    for index, ciphertext, tag, is_final in sealed:
+        yield open_frame(session_key, nonce_prefix, index, ciphertext, tag, is_final, context)
+        saw_final = is_final
+    if not saw_final:
+        raise ValueError("Encrypted file is truncated")
+
+
+def map_ordered(func, items, workers, max_in_flight=None, use_processes=False):
+    """
+    Runs func(*item) on a pool and yields results in submission order.
+    At most max_in_flight items are queued, which keeps memory bounded.
+    """
+    max_in_flight = max_in_flight or workers * 2
+    executor_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+
+    with executor_cls(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func, *item))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def seal_frames_parallel(frames, session_key, nonce_prefix, workers, max_in_flight=None,
+                         use_processes=False, context=b""):
+    jobs = ((session_key, nonce_prefix, index, data, is_final, context) for index, data, is_final in frames)
+    return map_ordered(seal_frame, jobs, workers, max_in_flight, use_processes)
+
+
+def open_frames_parallel(sealed, session_key, nonce_prefix, workers, max_in_flight=None,
+                         use_processes=False, context=b""):
+    saw_final = False
+
+    def jobs():
+        nonlocal saw_final
+        for index, ciphertext, tag, is_final in sealed:
+            saw_final = is_final
+            yield session_key, nonce_prefix, index, ciphertext, tag, is_final, context
+
+    yield from map_ordered(open_frame, jobs(), workers, max_in_flight, use_processes)
+    if not saw_final:
+        raise ValueError("Encrypted file is truncated")
+
+
+def write_chunks(chunks, out):
+    for chunk in chunks:
+        out.write(chunk)
+
+
+# ----------------------------------------------------------
+# CONTAINER FORMAT (v3)
+#   MAGIC | version (1) | header length (4) | header
+#     header: algorithm (1) | frame size (4) | nonce prefix (8)
+#             | recipient count (2) | [fingerprint (32) | wrapped len (2) | wrapped key] ...
+#   frames: [ciphertext | tag (16)] ...
+#   index:  frame count (4) | plaintext size (8) | [offset (8) | plaintext length (4)] ...
+#   trailer: index offset (8) | INDEX_MAGIC
+#
+# Every frame except the last holds exactly frame_size plaintext bytes, so
+# byte ranges map straight to frame numbers and the index gives their offsets.
+# ----------------------------------------------------------
+def build_header(frame_size, nonce_prefix, recipients):
+    """recipients: list of (fingerprint, wrapped_key)."""
+    body = struct.pack(">BI8sH", ALGORITHM_AES_256_GCM, frame_size, nonce_prefix, len(recipients))
+    for fingerprint, wrapped_key in recipients:
+        body += fingerprint + struct.pack(">H", len(wrapped_key)) + wrapped_key
+    return MAGIC + struct.pack(">BI", VERSION_CONTAINER, len(body)) + body
+
+
+def parse_header(body):
+    algorithm, frame_size, nonce_prefix, count = struct.unpack_from(">BI8sH", body, 0)
+    pos = struct.calcsize(">BI8sH")
+    recipients = []
+    for _ in range(count):
+        fingerprint = body[pos:pos + FINGERPRINT_SIZE]
+        pos += FINGERPRINT_SIZE
+        (wrapped_len,) = struct.unpack_from(">H", body, pos)
+        pos += 2
+        recipients.append((fingerprint, body[pos:pos + wrapped_len]))
+        pos += wrapped_len
+    return {
+        "algorithm": algorithm,
+        "frame_size": frame_size,
+        "nonce_prefix": nonce_prefix,
+        "recipients": recipients,
+    }
+
+
+class ContainerReader:
+    """
+    Random-access reader for v3 containers.
+    Only the header, the index and the frames covering a request are read.
+    """
+
+    def __init__(self, f, private_key=None):
+        self.f = f
+
+        f.seek(0)
+        prefix = _read_exact(f, len(MAGIC) + 5)
+        if prefix[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a CryptPort container")
+        self.version, header_len = struct.unpack_from(">BI", prefix, len(MAGIC))
+        if self.version != VERSION_CONTAINER:
+            raise ValueError(f"Unsupported container version: {self.version}")
+
+        header_body = _read_exact(f, header_len)
+        header = parse_header(header_body)
+        if header["algorithm"] not in ALGORITHM_NAMES:
+            raise ValueError(f"Unsupported algorithm id: {header['algorithm']}")
+
+        self.algorithm = header["algorithm"]
+        self.frame_size = header["frame_size"]
+        self.nonce_prefix = header["nonce_prefix"]
+        self.recipients = header["recipients"]
+        self.context = hashlib.sha256(prefix + header_body).digest()
+
+        self._load_index()
+
+        self.session_key = None
+        if private_key is not None:
+            self.session_key = self._unwrap(private_key)
+
+    def _load_index(self):
+        self.f.seek(-TRAILER.size, os.SEEK_END)
+        index_offset, end_magic = TRAILER.unpack(_read_exact(self.f, TRAILER.size))
+        if end_magic != INDEX_MAGIC:
+            raise ValueError("Container index missing (file truncated?)")
+
+        self.f.seek(index_offset)
+        frame_count, self.plaintext_size = struct.unpack(">IQ", _read_exact(self.f, 12))
+        raw = _read_exact(self.f, frame_count * INDEX_ENTRY.size)
+        self.index = list(INDEX_ENTRY.iter_unpack(raw))
+
+    def _unwrap(self, private_key):
+        fingerprint = key_fingerprint(private_key)
+        for candidate, wrapped_key in self.recipients:
+            if candidate == fingerprint:
+                return unwrap_session_key(wrapped_key, private_key)
+        raise ValueError("File was not encrypted for this key")
+
+    def info(self):
+        return {
+            "version": self.version,
+            "algorithm": ALGORITHM_NAMES[self.algorithm],
+            "frame_size": self.frame_size,
+            "frames": len(self.index),
+            "plaintext_size": self.plaintext_size,
+            "recipients": [fingerprint.hex() for fingerprint, _ in self.recipients],
+        }
+
+    def sealed_frames(self, first=0, last=None):
+        """Yields (index, ciphertext, tag, is_final) for frames first..last."""
+        last = len(self.index) - 1 if last is None else last
+        for i in range(first, last + 1):
+            offset, plain_len = self.index[i]
+            self.f.seek(offset)
+            ciphertext = _read_exact(self.f, plain_len)
+            tag = _read_exact(self.f, TAG_SIZE)
+            yield i, ciphertext, tag, i == len(self.index) - 1
+
+    def iter_plaintext(self, workers=1, max_in_flight=None, use_processes=False):
+        sealed = self.sealed_frames()
+        if workers > 1:
+            return open_frames_parallel(sealed, self.session_key, self.nonce_prefix, workers,
+                                        max_in_flight, use_processes, self.context)
+        return open_frames(sealed, self.session_key, self.nonce_prefix, self.context)
+
+    def read_range(self, start, length):
+        """Decrypts plaintext bytes [start, start + length) touching only their frames."""
+        if self.session_key is None:
+            raise ValueError("A private key is required to decrypt")
+        end = min(start + length, self.plaintext_size)
+        if start >= end:
+            return b""
+
+        first = start // self.frame_size
+        last = (end - 1) // self.frame_size
+        plain = b"".join(open_frame(self.session_key, self.nonce_prefix, i, ct, tag, final, self.context)
+                         for i, ct, tag, final in self.sealed_frames(first, last))
+
+        skip = start - first * self.frame_size
+        return plain[skip:skip + (end - start)]
+
+
+# ----------------------------------------------------------
+# FORMAT DETECTION
+#   CPENC containers start with MAGIC; anything else is the legacy
+#   raw RSA-OAEP chunk format
+# ----------------------------------------------------------
+def is_envelope(data):
+    return data[:len(MAGIC)] == MAGIC
+
+
+def _decrypt_legacy_stream(src, dst, private_key):
+    cipher = PKCS1_OAEP.new(private_key)
+    block_size = LEGACY_CIPHER_CHUNK * 1024
+    for block in iter(lambda: src.read(block_size), b""):
+        dst.write(b"".join(
+            cipher.decrypt(block[i:i + LEGACY_CIPHER_CHUNK])
+            for i in range(0, len(block), LEGACY_CIPHER_CHUNK)
+        ))
+
+
+# ----------------------------------------------------------
+# STREAMING ENCRYPT / DECRYPT
+# ----------------------------------------------------------
+def encrypt_stream(src, dst, public_keys, frame_size=DEFAULT_FRAME_SIZE,
+                   workers=1, max_in_flight=None, use_processes=False):
+    """public_keys: one RSA public key, or a list to encrypt for several recipients."""
+    session_key = get_random_bytes(SESSION_KEY_SIZE)
+    nonce_prefix = get_random_bytes(NONCE_PREFIX_SIZE)
+    recipients = wrap_for_recipients(session_key, public_keys)
+
+    header = build_header(frame_size, nonce_prefix, recipients)
+    context = hashlib.sha256(header).digest()
+    dst.write(header)
+
+    frames = read_frames(src, frame_size)
+    if workers > 1:
+        sealed = seal_frames_parallel(frames, session_key, nonce_prefix, workers,
+                                      max_in_flight, use_processes, context)
+    else:
+        sealed = seal_frames(frames, session_key, nonce_prefix, context)
+
+    # Frame index: 12 bytes per frame, written after the last frame
+    index = []
+    offset = len(header)
+    plaintext_size = 0
+    for chunk in sealed:
+        plain_len = len(chunk) - TAG_SIZE
+        index.append(INDEX_ENTRY.pack(offset, plain_len))
+        dst.write(chunk)
+        offset += len(chunk)
+        plaintext_size += plain_len
+
+    dst.write(struct.pack(">IQ", len(index), plaintext_size))
+    dst.write(b"".join(index))
+    dst.write(TRAILER.pack(offset, INDEX_MAGIC))
+
+
+def decrypt_stream(src, dst, private_key, workers=1, max_in_flight=None, use_processes=False):
+    """Decrypts any supported format from file object src into dst."""
+    if not is_envelope(src.read(len(MAGIC))):
+        src.seek(0)
+        _decrypt_legacy_stream(src, dst, private_key)
+        return
+
+    reader = ContainerReader(src, private_key)
+    write_chunks(reader.iter_plaintext(workers, max_in_flight, use_processes), dst)
+
+
+# ----------------------------------------------------------
+# FILE HELPERS
+# ----------------------------------------------------------
+class ProgressReader:
+    """
+    Wraps a source file and calls progress(bytes_read, total) after each read.
+    The callback may raise to abort the operation (e.g. a cancelled task).
+    """
+
+    def __init__(self, f, total, progress):
+        self._f = f
+        self.total = total
+        self.done = 0
+        self._progress = progress
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        # Container index reads count too; cap so progress never passes 100 %
+        self.done = min(self.done + len(data), self.total)
+        self._progress(self.done, self.total)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+def _run_to_file(func, src_path, dst_path, *args, progress=None, **kwargs):
+    # Never leave a half-written or unauthenticated output behind
+    try:
+        with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+            if progress is not None:
+                src = ProgressReader(src, os.path.getsize(src_path), progress)
+            func(src, dst, *args, **kwargs)
+    except Exception:
+        if os.path.exists(dst_path):
+            os.remove(dst_path)
+        raise
+
+
+def encrypt_file(src_path, dst_path, public_keys, frame_size=DEFAULT_FRAME_SIZE, progress=None, **parallel):
+    _run_to_file(encrypt_stream, src_path, dst_path, public_keys, frame_size=frame_size,
+                 progress=progress, **parallel)
+
+
+def decrypt_file(src_path, dst_path, private_key, progress=None, **parallel):
+    _run_to_file(decrypt_stream, src_path, dst_path, private_key, progress=progress, **parallel)
+
+
+def container_info(path):
+    """Header and index summary of a v3 container; no key needed."""
+    with open(path, "rb") as f:
+        return ContainerReader(f).info()
+
+
+def decrypt_range(path, private_key, start, length):
+    """Decrypts an arbitrary plaintext byte range, e.g. for previews or resumes."""
+    with open(path, "rb") as f:
+        return ContainerReader(f, private_key).read_range(start, length)
@@ -0,0 +1,452 @@
+"""
+Parallel, resumable downloads for CryptPort.
+
+GET /download/<receiver>/<stored_as> answers Range requests (206) and
+sends a strong ETag, so a received file doesn't have to come down one
+TCP stream at a time. SegmentedDownload fetches it in several byte
+ranges at once:
+
+ - The file is split into up to `segments` ranges, each fetched on its
+   own pooled connection; on a high-latency link each stream is limited
+   by its window, not by the bandwidth, so N streams get close to N times
+   the throughput
+ - Segments are written with positional writes (os.pwrite) into a
+   <dest>.part file preallocated to the full size, so no segment is
+   buffered in memory or copied into place afterwards
+ - A <dest>.part.json sidecar records how far each segment has got; a
+   download that was cancelled, failed or killed resumes from there
+ - Every range request carries If-Range with the ETag: if the file on the
+   server changed since the sidecar was written the server sends the whole
+   new file (200) instead, and the download starts over
+ - A dropped connection retries only that segment, from where it stopped
+ - Blob-backed files use their sha256 as ETag; the assembled file is
+   checked against it before it is moved into place
+
+DownloadManager runs SegmentedDownloads on its own thread pool and emits
+item_added / item_changed / item_finished for the status display.
+"""
+
+import hashlib
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from functools import partial
+
+import requests
+from PyQt5.QtCore import QObject, QThreadPool, pyqtSignal
+
+from ui.upload_stream import RateMeter
+from ui.workers import Task
+
+QUEUED = "Queued"
+RUNNING = "Downloading"
+DONE = "Done"
+FAILED = "Failed"
+CANCELLED = "Cancelled"
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+DEFAULT_SEGMENTS = 4
+DEFAULT_CONCURRENCY = 2         # files at once; each uses up to DEFAULT_SEGMENTS connections
+MIN_SEGMENT_SIZE = 2 * 1024 * 1024
+BLOCK_SIZE = 256 * 1024
+SEGMENT_ATTEMPTS = 4            # failures in a row, without progress, before giving up
+SEGMENT_BACKOFF = 0.5           # seconds, doubled after each failed attempt
+STATE_INTERVAL = 1.0            # seconds between sidecar saves
+
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".part.json"
+
+_SHA256_ETAG = re.compile(r'^"([0-9a-f]{64})"$')
+
+
+class DownloadError(Exception):
+    pass
+
+
+class ResourceChanged(DownloadError):
+    """The file on the server is no longer the one the .part file holds."""
+
+
+# ----------------------------------------------------
+# PART FILE
+# ----------------------------------------------------
+class PartFile:
+    """The preallocated <dest>.part file, written at absolute offsets from several threads."""
+
+    def __init__(self, path, size=None):
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        self.fd = os.open(path, flags, 0o644)
+        self._lock = threading.Lock()       # only for the lseek+write fallback
+        if size is not None:
+            self.preallocate(size)
+
+    def preallocate(self, size):
+        os.ftruncate(self.fd, 0)
+        if size and hasattr(os, "posix_fallocate"):
+            try:
+                # Reserves the blocks: a full disk fails here, not halfway through
+                os.posix_fallocate(self.fd, 0, size)
+                return
+            except OSError:
+                pass                        # not supported by this filesystem
+        os.ftruncate(self.fd, size)
+
+    def write_at(self, data, offset):
+        view = memoryview(data)
+        if hasattr(os, "pwrite"):
+            while view:
+                written = os.pwrite(self.fd, view, offset)
+                view, offset = view[written:], offset + written
+            return
+        # Windows has no pwrite: a shared file position needs the lock
+        with self._lock:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            while view:
+                view = view[os.write(self.fd, view):]
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Segment:
+    def __init__(self, start, end, done=0):
+        self.start = start
+        self.end = end                      # inclusive, as in a Range header
+        self.done = done
+
+    @property
+    def remaining(self):
+        return self.end - self.start + 1 - self.done
+
+    @property
+    def position(self):
+        return self.start + self.done
+
+
+def plan_segments(size, count):
+    count = max(1, min(count, size // MIN_SEGMENT_SIZE))
+    step = max(1, -(-size // count))
+    return [Segment(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+
+# ----------------------------------------------------
+# ONE FILE
+# ----------------------------------------------------
+class SegmentedDownload:
+    """
+    Fetches client path into dest; fetch(task) runs on a worker thread.
+    Cancelling or failing leaves the .part and .part.json files in place,
+    so the next fetch of the same dest resumes.
+    """
+
+    def __init__(self, client, path, dest, segments=DEFAULT_SEGMENTS):
+        self.client = client
+        self.path = path
+        self.dest = dest
+        self.part_path = dest + PART_SUFFIX
+        self.state_path = dest + STATE_SUFFIX
+        self.max_segments = segments
+
+        self.size = None
+        self.etag = None
+        self.resumable = False
+        self.segments = []
+        self.done = 0
+        self.resumed_from = 0
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._meter = None
+        self._last_save = 0.0
+
+    def fetch(self, task):
+        try:
+            return self._fetch(task)
+        except ResourceChanged:
+            # Changed on the server since the .part file was started: once more, from scratch
+            self.discard()
+            return self._fetch(task)
+
+    def _fetch(self, task):
+        res = self.client.request("HEAD", self.path)
+        if res.status_code == 404:
+            raise DownloadError("File no longer exists on the server")
+        if res.status_code != 200:
+            raise DownloadError(f"HTTP {res.status_code}")
+
+        self.size = int(res.headers["Content-Length"])
+        self.etag = res.headers.get("ETag")
+        self.resumable = res.headers.get("Accept-Ranges") == "bytes" and self.etag is not None
+
+        part = self._open_part()
+        try:
+            self._run_segments(task, part)
+        finally:
+            part.close()
+            if self.done < self.size:
+                self._save_state()
+
+        self._verify(task)
+        os.replace(self.part_path, self.dest)
+        self._remove(self.state_path)
+        return self.dest
+
+    # ----------------------------------------------------
+    # RESUME STATE
+    # ----------------------------------------------------
+    def _open_part(self):
+        state = self._load_state() if self.resumable else None
+        if state is not None:
+            self.segments = [Segment(*seg) for seg in state["segments"]]
+            part = PartFile(self.part_path)
+        else:
+            self._remove(self.state_path)
+            # Without ranges the body only comes whole: one segment, no resume
+            self.segments = plan_segments(self.size, self.max_segments if self.resumable else 1)
+            part = PartFile(self.part_path, self.size)
+
+        self.done = self.resumed_from = sum(seg.done for seg in self.segments)
+        self._meter = RateMeter()
+        self._last_save = time.monotonic()
+        self._save_state()
+        return part
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            part_size = os.path.getsize(self.part_path)
+        except (OSError, ValueError):
+            return None
+        if (state.get("path") != self.path or state.get("etag") != self.etag
+                or state.get("size") != self.size or part_size != self.size):
+            return None
+        return state
+
+    def _save_state(self):
+        if not self.resumable:
+            return
+        # Only bytes already written are counted in seg.done, so the sidecar
+        # never claims data the .part file doesn't hold
+        state = {
+            "path": self.path,
+            "etag": self.etag,
+            "size": self.size,
+            "segments": [[seg.start, seg.end, seg.done] for seg in self.segments],
+        }
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def discard(self):
+        self._remove(self.part_path)
+        self._remove(self.state_path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    # ----------------------------------------------------
+    # SEGMENTS
+    # ----------------------------------------------------
+    def _run_segments(self, task, part):
+        pending = [seg for seg in self.segments if seg.remaining]
+        if not pending:
+            task.report(self.done, self.size)
+            return
+
+        self._stop.clear()
+        with ThreadPoolExecutor(max_workers=len(pending), thread_name_prefix="download") as pool:
+            futures = [pool.submit(self._fetch_segment, task, part, seg) for seg in pending]
+            wait(futures, return_when=FIRST_EXCEPTION)
+            # One segment failed (or the task was cancelled): stop the others
+            # at their next block, so the sidecar records where each stopped
+            self._stop.set()
+        for future in futures:
+            future.result()
+
+    def _fetch_segment(self, task, part, seg):
+        failures = 0
+        while seg.remaining and not self._stop.is_set():
+            task.check()
+            before = seg.done
+            try:
+                self._read_range(task, part, seg)
+                if seg.remaining and not self._stop.is_set():
+                    raise requests.ConnectionError("Connection closed before the end of the range")
+            except requests.RequestException:
+                failures = 0 if seg.done > before else failures + 1
+                if failures >= SEGMENT_ATTEMPTS:
+                    raise
+                if failures:
+                    time.sleep(SEGMENT_BACKOFF * 2 ** (failures - 1))
+
+    def _read_range(self, task, part, seg):
+        whole_file = seg.position == 0 and seg.end == self.size - 1
+        headers = {}
+        if not whole_file or self.etag:
+            headers["Range"] = f"bytes={seg.position}-{seg.end}"
+            if self.etag:
+                headers["If-Range"] = self.etag
+
+        with self.client.get(self.path, headers=headers, stream=True) as res:
+            # If-Range didn't match: the server sent the whole, changed file
+            if res.status_code == 200 and (not whole_file or res.headers.get("ETag") != self.etag):
+                raise ResourceChanged("The file changed on the server")
+            if res.status_code == 404:
+                raise DownloadError("File no longer exists on the server")
+            if res.status_code not in (200, 206):
+                raise DownloadError(f"HTTP {res.status_code}")
+
+            for block in res.iter_content(BLOCK_SIZE):
+                if self._stop.is_set():
+                    return
+                block = block[:seg.remaining]
+                part.write_at(block, seg.position)
+                self._advance(task, seg, len(block))
+                if not seg.remaining:
+                    return
+
+    def _advance(self, task, seg, count):
+        with self._lock:
+            seg.done += count
+            self.done += count
+            rate = self._meter.update(self.done - self.resumed_from)
+            now = time.monotonic()
+            if now - self._last_save >= STATE_INTERVAL:
+                self._last_save = now
+                self._save_state()
+            task.report(self.done, self.size, rate)
+
+    # ----------------------------------------------------
+    # INTEGRITY
+    # ----------------------------------------------------
+    def _verify(self, task):
+        match = _SHA256_ETAG.match(self.etag or "")
+        if not match:
+            return
+
+        digest = hashlib.sha256()
+        with open(self.part_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                task.check()
+                digest.update(block)
+        if digest.hexdigest() != match.group(1):
+            self.discard()
+            raise DownloadError("Downloaded file does not match its checksum")
+
+
+# ----------------------------------------------------
+# DOWNLOAD QUEUE
+# ----------------------------------------------------
+class DownloadItem:
+    def __init__(self, item_id, path, filename, dest, size=None):
+        self.id = item_id
+        self.path = path
+        self.filename = filename
+        self.dest = dest
+        self.size = size
+
+        self.status = QUEUED
+        self.done = 0
+        self.total = size
+        self.rate = 0.0
+        self.error = ""
+        self.task = None
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+
+class DownloadManager(QObject):
+    item_added = pyqtSignal(object)
+    item_changed = pyqtSignal(object)
+    item_finished = pyqtSignal(object)
+
+    def __init__(self, client, max_concurrent=DEFAULT_CONCURRENCY, segments=DEFAULT_SEGMENTS):
+        super().__init__()
+        self.client = client
+        self.segments = segments
+
+        self.items = []
+        self._seq = itertools.count()
+
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max_concurrent)
+
+    def add(self, path, filename, dest, size=None):
+        item = DownloadItem(next(self._seq), path, filename, dest, size)
+        self.items.append(item)
+        self.item_added.emit(item)
+        self._start(item)
+        return item
+
+    def cancel(self, item):
+        if item.task is not None:
+            item.task.cancel()
+
+    def cancel_all(self):
+        for item in self.items:
+            self.cancel(item)
+
+    def retry(self, item):
+        """Starts a failed or cancelled download again; it resumes from its .part file."""
+        if item.status in (FAILED, CANCELLED):
+            self._start(item)
+
+    def clear_finished(self):
+        self.items = [item for item in self.items if not item.finished]
+
+    def active(self):
+        return [item for item in self.items if not item.finished]
+
+    def _start(self, item):
+        item.status = QUEUED
+        item.error = ""
+        item.rate = 0.0
+
+        download = SegmentedDownload(self.client, item.path, item.dest, self.segments)
+        task = item.task = Task(download.fetch)
+        task.signals.progress.connect(partial(self._on_progress, item))
+        task.signals.rate.connect(partial(self._on_rate, item))
+        task.signals.result.connect(partial(self._on_result, item))
+        task.signals.error.connect(partial(self._on_error, item))
+        task.signals.cancelled.connect(partial(self._finish, item, CANCELLED))
+        task.signals.finished.connect(partial(self._on_task_finished, item))
+        self.item_changed.emit(item)
+        task.start(self.pool)
+
+    def _on_progress(self, item, done, total):
+        item.status = RUNNING
+        item.done, item.total = done, total
+        self.item_changed.emit(item)
+
+    def _on_rate(self, item, rate):
+        item.rate = rate
+
+    def _on_result(self, item, dest):
+        item.dest = dest
+        self._finish(item, DONE)
+
+    def _on_error(self, item, error):
+        self._finish(item, FAILED, str(error) or type(error).__name__)
+
+    def _on_task_finished(self, item):
+        item.task = None
+
+    def _finish(self, item, status, error=""):
+        item.status = status
+        item.error = error
+        item.rate = 0.0
+        self.item_changed.emit(item)
+        self.item_finished.emit(item)
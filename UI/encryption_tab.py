@@ -1,29 +1,44 @@
 import os
 from PyQt5.QtWidgets import (
     QWidget, QVBoxLayout, QPushButton, QLabel, QFileDialog,
-    QMessageBox, QFrame
+    QMessageBox, QFrame, QProgressDialog
 )
 from PyQt5.QtGui import QFont
 from PyQt5.QtCore import Qt, pyqtSignal
 
 from Crypto.PublicKey import RSA
-from Crypto.Cipher import PKCS1_OAEP
+
+from ui import crypto_engine
+from ui.workers import Task
 
 
 class EncryptionTab(QWidget):
 
     back_requested = pyqtSignal()
 
-    def __init__(self, user_email="", parent=None):
+    # Files smaller than this many frames are not worth a worker pool
+    PARALLEL_MIN_FRAMES = 8
+
+    def __init__(self, user_email="", parent=None, workers=None, max_in_flight=None, use_processes=False):
         super().__init__(parent)
 
         self.user_email = user_email
+
+        # Parallel frame encryption settings
+        self.workers = workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or self.workers * 2
+        self.use_processes = use_processes
         self.keys_dir = "keys"
         os.makedirs(self.keys_dir, exist_ok=True)
 
         self.private_key_path = os.path.join(self.keys_dir, f"{self.user_email}_private.pem")
         self.public_key_path = os.path.join(self.keys_dir, f"{self.user_email}_public.pem")
 
+        # Encrypt / decrypt run one at a time in the background
+        self.crypto_task = None
+        self.crypto_dialog = None
+        self.crypto_action = None
+
         # ----------------------------------------------------------
         self.setStyleSheet("background-color: #d6eaff;")
 
@@ -128,8 +143,16 @@ class EncryptionTab(QWidget):
     def open_key_folder(self):
         os.startfile(self.keys_dir)
 
+    # ----------------------------------------------------------
+    # Key generation takes a second or two: done in the background
     # ----------------------------------------------------------
     def ensure_keys_exist(self):
+        self.keys_task = Task(self.check_or_generate_keys)
+        self.keys_task.signals.error.connect(self.on_keys_error)
+        self.keys_task.signals.finished.connect(self.on_keys_ready)
+        self.keys_task.start()
+
+    def check_or_generate_keys(self, task):
         def generate():
             key = RSA.generate(2048)
             with open(self.private_key_path, "wb") as f:
@@ -147,36 +170,64 @@ class EncryptionTab(QWidget):
         except:
             generate()
 
+    def on_keys_error(self, error):
+        QMessageBox.critical(self, "Key Generation Failed", f"Could not create keys in {self.keys_dir}:\n{error}")
+
+    def on_keys_ready(self):
+        self.keys_task = None
+
+    # ----------------------------------------------------------
+    def parallel_options(self, path):
+        frames = os.path.getsize(path) // crypto_engine.DEFAULT_FRAME_SIZE
+        if self.workers <= 1 or frames < self.PARALLEL_MIN_FRAMES:
+            return {}
+        return {
+            "workers": self.workers,
+            "max_in_flight": self.max_in_flight,
+            "use_processes": self.use_processes,
+        }
+
     # ----------------------------------------------------------
     def encrypt_file(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Select File to Encrypt")
         if not file_path:
             return
 
-        receiver_key_path, _ = QFileDialog.getOpenFileName(self, "Select Receiver PUBLIC Key (.pem)")
-        if not receiver_key_path:
+        # Several keys may be selected: one .enc file that every receiver can open
+        receiver_key_paths, _ = QFileDialog.getOpenFileNames(
+            self, "Select Receiver PUBLIC Key(s) (.pem)", "", "PEM keys (*.pem);;All files (*)"
+        )
+        if not receiver_key_paths:
             QMessageBox.warning(self, "Error", "Receiver public key required.")
             return
 
-        try:
-            receiver_public_key = RSA.import_key(open(receiver_key_path, "rb").read())
-        except:
-            QMessageBox.critical(self, "Invalid Key", "Selected key is not a valid RSA public key.")
-            return
-
-        cipher = PKCS1_OAEP.new(receiver_public_key)
-        data = open(file_path, "rb").read()
-
-        chunk_size = 214
-        encrypted = b""
-
-        for i in range(0, len(data), chunk_size):
-            encrypted += cipher.encrypt(data[i:i + chunk_size])
-
+        receiver_public_keys = []
+        for key_path in receiver_key_paths:
+            try:
+                receiver_public_keys.append(RSA.import_key(open(key_path, "rb").read()))
+            except:
+                QMessageBox.critical(
+                    self, "Invalid Key",
+                    f"{os.path.basename(key_path)} is not a valid RSA public key."
+                )
+                return
+
+        # Hybrid envelope: AES-256-GCM for the data, RSA-OAEP only for the key.
+        # Streamed frame by frame, so memory stays flat for multi-GB files.
+        # The data is encrypted once however many receivers there are.
         out_path = file_path + ".enc"
-        open(out_path, "wb").write(encrypted)
+        recipients = len(receiver_public_keys)
+        message = (f"Encrypted file saved:\n{out_path}"
+                   + (f"\n\nReadable by {recipients} receivers." if recipients > 1 else ""))
+
+        def encrypt(task):
+            crypto_engine.encrypt_file(
+                file_path, out_path, receiver_public_keys, progress=task.report,
+                **self.parallel_options(file_path)
+            )
+            return message
 
-        QMessageBox.information(self, "Success", f"Encrypted file saved:\n{out_path}")
+        self.start_crypto_task("encrypt", f"Encrypting {os.path.basename(file_path)}…", encrypt)
 
     # ----------------------------------------------------------
     def decrypt_file(self):
@@ -184,17 +235,58 @@ class EncryptionTab(QWidget):
         if not enc_path:
             return
 
+        if self.keys_task is not None:
+            QMessageBox.information(self, "Please Wait", "Your keys are still being generated.")
+            return
         private_key = RSA.import_key(open(self.private_key_path, "rb").read())
-        cipher = PKCS1_OAEP.new(private_key)
 
-        data = open(enc_path, "rb").read()
-        decrypted = b""
+        # Accepts both the envelope format and legacy 256-byte RSA blocks
+        out = enc_path.replace(".enc", "_DECRYPTED")
 
-        chunk_size = 256
-        for i in range(0, len(data), chunk_size):
-            decrypted += cipher.decrypt(data[i:i + chunk_size])
+        def decrypt(task):
+            crypto_engine.decrypt_file(enc_path, out, private_key, progress=task.report,
+                                       **self.parallel_options(enc_path))
+            return f"Decrypted file saved:\n{out}"
 
-        out = enc_path.replace(".enc", "_DECRYPTED")
-        open(out, "wb").write(decrypted)
+        self.start_crypto_task("decrypt", f"Decrypting {os.path.basename(enc_path)}…", decrypt)
 
-        QMessageBox.information(self, "Success", f"Decrypted file saved:\n{out}")
\ No newline at end of file
+    # ----------------------------------------------------------
+    # Background encrypt / decrypt with a cancellable progress dialog
+    # ----------------------------------------------------------
+    def start_crypto_task(self, action, label, fn):
+        self.crypto_action = action
+        self.crypto_dialog = QProgressDialog(label, "Cancel", 0, 100, self)
+        self.crypto_dialog.setWindowTitle("CryptPort")
+        self.crypto_dialog.setWindowModality(Qt.WindowModal)
+        self.crypto_dialog.setAutoClose(False)
+        self.crypto_dialog.setAutoReset(False)
+        self.crypto_dialog.setMinimumDuration(300)
+        self.crypto_dialog.setValue(0)
+
+        self.crypto_task = Task(fn)
+        self.crypto_dialog.canceled.connect(self.crypto_task.cancel)
+        self.crypto_task.signals.progress.connect(self.on_crypto_progress)
+        self.crypto_task.signals.result.connect(self.on_crypto_done)
+        self.crypto_task.signals.error.connect(self.on_crypto_error)
+        self.crypto_task.signals.finished.connect(self.on_crypto_finished)
+        self.crypto_task.start()
+
+    def on_crypto_progress(self, done, total):
+        if self.crypto_dialog is not None and total:
+            self.crypto_dialog.setValue(int(done * 100 / total))
+
+    def on_crypto_done(self, message):
+        QMessageBox.information(self, "Success", message)
+
+    def on_crypto_error(self, error):
+        if self.crypto_action == "decrypt" and isinstance(error, ValueError):
+            QMessageBox.critical(self, "Decryption Failed", "File is corrupted or not encrypted for this key.")
+        else:
+            QMessageBox.critical(self, "Error", str(error))
+
+    def on_crypto_finished(self):
+        # Cancelled: the partial output file has already been removed
+        if self.crypto_dialog is not None:
+            self.crypto_dialog.close()
+        self.crypto_dialog = None
+        self.crypto_task = None
\ No newline at end of file
@@ -1,11 +1,44 @@
 import os
+import json
+import time
+import hashlib
 import requests
 from PyQt5.QtWidgets import (
     QWidget, QVBoxLayout, QPushButton, QLabel, QLineEdit,
-    QFileDialog, QMessageBox, QListWidget, QFrame, QHBoxLayout
+    QFileDialog, QMessageBox, QListWidget, QListWidgetItem, QFrame, QHBoxLayout,
+    QTableWidget, QTableWidgetItem, QHeaderView, QSpinBox
 )
 from PyQt5.QtGui import QFont
-from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtCore import Qt, pyqtSignal, QThread
+
+from ui import chunking
+from ui import crypto_engine
+from ui import download_manager
+from ui import transfer_manager
+from ui.api_client import shared_client
+from ui.workers import Task
+from ui.upload_stream import MultipartFileStream, RateMeter
+
+# Files at least this big go through chunk-level dedup: only the
+# content-defined chunks the server lacks are uploaded. Not .enc
+# containers: each is sealed under a fresh session key, so no chunk of
+# one ever matches another and chunking would only cost CPU
+CHUNKED_UPLOAD_MIN_SIZE = 8 * 1024 * 1024
+
+# The server assembles a manifest in the background; poll until it's done
+MANIFEST_POLL_INTERVAL = 0.5
+MANIFEST_POLL_MAX_INTERVAL = 5.0
+MANIFEST_WAIT = 30 * 60
+
+# Inbox push channel (GET /events/<receiver>): the server sends a keepalive
+# every 15 s, so a read that waits longer than this means a dead connection
+EVENTS_READ_TIMEOUT = 45
+EVENTS_RETRY_MAX = 30
+
+# Full inbox reloads page through /list (the server caps a page at 1000),
+# and start over if the inbox changed between pages
+LIST_PAGE_SIZE = 1000
+LIST_ATTEMPTS = 3
 
 
 class FileTab(QWidget):
@@ -17,14 +50,27 @@ class FileTab(QWidget):
     # NEW SIGNAL → send (filename, receiver) to HistoryTab
     file_uploaded = pyqtSignal(str, str)
 
-    def __init__(self, user_email="", private_key="", parent=None):
+    def __init__(self, user_email="", private_key="", parent=None, client=None):
         super().__init__(parent)
 
         self.user_email = user_email
         self.private_key = private_key
-        self.server_url = "http://127.0.0.1:5000"
-
-        self.selected_file = None
+        self.client = client or shared_client()
+        self.server_url = self.client.base_url
+
+        self.selected_files = []
+        self.inbox_keys = set()         # stored_as of every row in history_list
+        self.inbox = inbox_cache(self.server_url, self.user_email)
+
+        # Uploads go through the shared transfer queue; inbox syncs run in
+        # the background, one at a time
+        self.transfers = transfer_queue(self.client, self.user_email)
+        self.transfer_rows = {}         # transfer item id → table row
+        self.downloads = download_queue(self.client, self.user_email)
+        self.download_message = ""
+        self.sync_task = None
+        self.sync_again = False
+        self.sync_pushed = []           # pushed while a sync was in flight
 
         # UI SETUP ----------------------------------------------------
         self.setStyleSheet("background-color: #d6eaff;")
@@ -50,11 +96,12 @@ class FileTab(QWidget):
         """)
         ip_layout = QVBoxLayout()
 
-        lbl_ip = QLabel("Receiver Email:")
+        lbl_ip = QLabel("Receiver Email(s):")
         lbl_ip.setFont(QFont("Segoe UI", 12))
 
         self.receiver_box = QLineEdit()
-        self.receiver_box.setPlaceholderText("example@gmail.com")
+        # Several receivers, comma-separated, get one upload between them
+        self.receiver_box.setPlaceholderText("example@gmail.com, other@gmail.com")
         self.receiver_box.setFont(QFont("Segoe UI", 12))
         self.receiver_box.setStyleSheet(
             "padding: 8px; border-radius: 10px; border: 1px solid gray;"
@@ -77,7 +124,7 @@ class FileTab(QWidget):
         """)
         send_layout = QVBoxLayout()
 
-        self.choose_file_btn = QPushButton("📂 Choose File")
+        self.choose_file_btn = QPushButton("📂 Choose Files")
         self.choose_file_btn.setFont(QFont("Segoe UI", 14))
         self.choose_file_btn.setStyleSheet(
             "background-color: #2196F3; color: white; padding: 10px; border-radius: 10px;"
@@ -89,17 +136,54 @@ class FileTab(QWidget):
         self.selected_file_label.setFont(QFont("Segoe UI", 12))
         send_layout.addWidget(self.selected_file_label)
 
-        send_btn = QPushButton("📤 Upload File")
-        send_btn.setFont(QFont("Segoe UI", 14))
-        send_btn.setStyleSheet(
+        self.send_btn = QPushButton("📤 Upload")
+        self.send_btn.setFont(QFont("Segoe UI", 14))
+        self.send_btn.setStyleSheet(
             "background-color: #4CAF50; color: white; padding: 10px; border-radius: 10px;"
         )
-        send_btn.clicked.connect(self.upload_file)
-        send_layout.addWidget(send_btn)
+        self.send_btn.clicked.connect(self.upload_file)
+        send_layout.addWidget(self.send_btn)
 
         send_frame.setLayout(send_layout)
         layout.addWidget(send_frame)
 
+        # -------------------------------
+        # Transfer queue
+        # -------------------------------
+        self.transfer_table = QTableWidget(0, 6)
+        self.transfer_table.setHorizontalHeaderLabels(["File", "To", "Size", "Status", "Progress", "Speed"])
+        self.transfer_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.transfer_table.verticalHeader().setVisible(False)
+        self.transfer_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.transfer_table.setStyleSheet("background: white; border-radius: 8px;")
+        layout.addWidget(self.transfer_table)
+
+        queue_row = QHBoxLayout()
+        self.transfer_summary = QLabel("No transfers")
+        self.transfer_summary.setFont(QFont("Segoe UI", 11))
+        queue_row.addWidget(self.transfer_summary, 1)
+
+        queue_row.addWidget(QLabel("Parallel:"))
+        self.concurrency_box = QSpinBox()
+        self.concurrency_box.setRange(1, 8)
+        self.concurrency_box.setValue(self.transfers.max_concurrent)
+        self.concurrency_box.valueChanged.connect(self.transfers.set_concurrency)
+        queue_row.addWidget(self.concurrency_box)
+
+        for text, slot in (("↻ Retry Failed", self.retry_failed_transfers),
+                           ("✖ Cancel All", self.transfers.cancel_all),
+                           ("🧹 Clear Finished", self.clear_finished_transfers)):
+            btn = QPushButton(text)
+            btn.setFont(QFont("Segoe UI", 11))
+            btn.clicked.connect(slot)
+            queue_row.addWidget(btn)
+        layout.addLayout(queue_row)
+
+        self.transfers.item_added.connect(self.add_transfer_row)
+        self.transfers.item_changed.connect(self.update_transfer_row)
+        self.transfers.item_finished.connect(self.on_transfer_finished)
+        self.rebuild_transfer_table()
+
         # -------------------------------
         # File History List
         # -------------------------------
@@ -109,8 +193,34 @@ class FileTab(QWidget):
 
         self.history_list = QListWidget()
         self.history_list.setStyleSheet("padding: 10px; border-radius: 8px;")
+        self.history_list.setToolTip("Double-click a file to download it")
+        self.history_list.itemDoubleClicked.connect(self.download_inbox_item)
         layout.addWidget(self.history_list)
 
+        download_row = QHBoxLayout()
+        self.download_status = QLabel()
+        self.download_status.setFont(QFont("Segoe UI", 11))
+        download_row.addWidget(self.download_status, 1)
+
+        btn_cancel_downloads = QPushButton("✖ Cancel Downloads")
+        btn_cancel_downloads.setFont(QFont("Segoe UI", 11))
+        btn_cancel_downloads.clicked.connect(self.downloads.cancel_all)
+        download_row.addWidget(btn_cancel_downloads)
+        layout.addLayout(download_row)
+
+        self.downloads.item_changed.connect(self.update_download_status)
+        self.downloads.item_finished.connect(self.on_download_finished)
+        self.update_download_status()
+
+        # Subscribe before the first load so nothing lands in between;
+        # rows already listed are skipped by stored_as
+        self.subscriber = InboxSubscriber(self.client, self.user_email)
+        self.subscriber.file_received.connect(self.on_file_received)
+        # (Re)connected: catch up on anything missed, deletions included
+        self.subscriber.connected.connect(self.sync_inbox)
+        self.destroyed.connect(lambda *_, subscriber=self.subscriber: subscriber.stop())
+        self.subscriber.start()
+
         # Load history
         self.load_history()
 
@@ -137,60 +247,585 @@ class FileTab(QWidget):
         self.setLayout(layout)
 
     # ---------------------------------------------------------------------
-    # Select a file
+    # Select files
     # ---------------------------------------------------------------------
     def select_file(self):
-        file_path, _ = QFileDialog.getOpenFileName(self, "Select File")
-        if file_path:
-            self.selected_file = file_path
-            self.selected_file_label.setText(os.path.basename(file_path))
+        file_paths, _ = QFileDialog.getOpenFileNames(self, "Select Files")
+        if file_paths:
+            self.selected_files = file_paths
+            self.selected_file_label.setText(
+                os.path.basename(file_paths[0]) if len(file_paths) == 1
+                else f"{len(file_paths)} files selected"
+            )
 
     # ---------------------------------------------------------------------
-    # Upload file → Flask server
+    # Upload files → Flask server: queued on the transfer manager, which
+    # sends several at once in the background
     # ---------------------------------------------------------------------
     def upload_file(self):
-        if not self.selected_file:
+        if not self.selected_files:
             QMessageBox.warning(self, "Error", "Please select a file first.")
             return
 
-        receiver = self.receiver_box.text().strip()
-        if receiver == "":
+        receivers = [r.strip() for r in self.receiver_box.text().split(",") if r.strip()]
+        if not receivers:
             QMessageBox.warning(self, "Error", "Receiver email is required.")
             return
+        receiver = ", ".join(receivers)
 
-        try:
-            files = {"file": open(self.selected_file, "rb")}
-            data = {"receiver": receiver, "sender": self.user_email}
+        self.transfers.add_many(self.selected_files, receiver)
+        self.selected_files = []
+        self.selected_file_label.setText("No file selected")
 
-            res = requests.post(f"{self.server_url}/upload", files=files, data=data)
+    # ---------------------------------------------------------------------
+    # Transfer table: one row per queued file
+    # ---------------------------------------------------------------------
+    def add_transfer_row(self, item):
+        row = self.transfer_table.rowCount()
+        self.transfer_table.insertRow(row)
+        self.transfer_rows[item.id] = row
+        self.update_transfer_row(item)
+
+    def update_transfer_row(self, item):
+        row = self.transfer_rows.get(item.id)
+        if row is None:
+            return
 
-            if res.status_code == 200:
-                QMessageBox.information(self, "Success", "File uploaded successfully!")
+        if item.status == transfer_manager.RUNNING and item.total:
+            progress = f"{item.sent * 100 // item.total} %"
+        elif item.status == transfer_manager.DONE:
+            progress = "100 %"
+        else:
+            progress = ""
+        cells = (
+            item.filename,
+            item.receiver,
+            format_size(item.size),
+            item.status + (f" ({item.attempts})" if item.attempts > 1 else ""),
+            progress,
+            f"{format_size(item.rate)}/s" if item.status == transfer_manager.RUNNING and item.rate else "",
+        )
+        for column, text in enumerate(cells):
+            cell = self.transfer_table.item(row, column)
+            if cell is None:
+                cell = QTableWidgetItem()
+                self.transfer_table.setItem(row, column, cell)
+            cell.setText(text)
+        self.transfer_table.item(row, 3).setToolTip(item.error)
+        self.update_transfer_summary()
+
+    def rebuild_transfer_table(self):
+        self.transfer_table.setRowCount(0)
+        self.transfer_rows = {}
+        for item in self.transfers.items:
+            self.add_transfer_row(item)
+        self.update_transfer_summary()
+
+    def update_transfer_summary(self):
+        counts = self.transfers.counts()
+        parts = [f"{counts[status]} {status.lower()}" for status in (
+            transfer_manager.RUNNING, transfer_manager.QUEUED, transfer_manager.RETRYING,
+            transfer_manager.DONE, transfer_manager.FAILED, transfer_manager.CANCELLED,
+        ) if counts.get(status)]
+        self.transfer_summary.setText("  •  ".join(parts) or "No transfers")
+
+    def on_transfer_finished(self, item):
+        if item.status == transfer_manager.DONE:
+            # NEW — Notify HistoryTab
+            self.file_uploaded.emit(item.filename, item.receiver)
+            # Our own inbox (if we were a receiver) updates via the push channel
+
+    def retry_failed_transfers(self):
+        for item in self.transfers.items:
+            self.transfers.retry(item)
+
+    def clear_finished_transfers(self):
+        self.transfers.clear_finished()
+        self.rebuild_transfer_table()
 
-                # NEW — Notify HistoryTab
-                filename = os.path.basename(self.selected_file)
-                self.file_uploaded.emit(filename, receiver)
+    # ---------------------------------------------------------------------
+    # Download a received file: fetched in parallel byte ranges in the
+    # background; an interrupted download to the same place resumes
+    # ---------------------------------------------------------------------
+    def download_inbox_item(self, list_item):
+        f = self.inbox.files.get(list_item.data(Qt.UserRole))
+        if f is None:
+            return
 
-                self.load_history()
-            else:
-                QMessageBox.critical(self, "Upload Failed", res.text)
+        dest, _ = QFileDialog.getSaveFileName(
+            self, "Save File", os.path.join(os.path.expanduser("~"), f["filename"])
+        )
+        if not dest:
+            return
+        if any(item.dest == dest for item in self.downloads.active()):
+            QMessageBox.warning(self, "Error", "That file is already being downloaded.")
+            return
+
+        self.downloads.add(f"/download/{self.user_email}/{f['stored_as']}", f["filename"], dest, f.get("size"))
+
+    def update_download_status(self, *_):
+        active = self.downloads.active()
+        if not active:
+            self.download_status.setText(self.download_message or "No downloads")
+            return
 
-        except Exception as e:
-            QMessageBox.critical(self, "Error", str(e))
+        done = sum(item.done for item in active)
+        total = sum(item.total or 0 for item in active)
+        rate = sum(item.rate for item in active)
+        text = f"⬇ {len(active)} downloading"
+        if total:
+            text += f"  •  {done * 100 // total} %"
+        if rate:
+            text += f"  •  {format_size(rate)}/s"
+        self.download_status.setText(text)
+
+    def on_download_finished(self, item):
+        if item.status == download_manager.DONE:
+            self.download_message = f"✅ Saved {item.filename} to {item.dest}"
+        elif item.status == download_manager.CANCELLED:
+            self.download_message = f"Download of {item.filename} cancelled"
+        else:
+            self.download_message = f"❌ Download of {item.filename} failed"
+            QMessageBox.warning(
+                self, "Download Failed",
+                f"{item.filename}: {item.error}\n\nDouble-click the file again to resume."
+            )
+        self.update_download_status()
 
     # ---------------------------------------------------------------------
-    # Load history (received files)
+    # Load history (received files) — kept in sync through /changes: only
+    # additions and deletions since the last known sequence are fetched
     # ---------------------------------------------------------------------
     def load_history(self):
         self.history_list.clear()
+        self.inbox_keys.clear()
+        for f in self.inbox.newest_first():
+            self.add_inbox_item(f)
+        self.sync_inbox()
+
+    def sync_inbox(self):
+        # Fetched in the background, applied here when it arrives
+        if self.sync_task is not None:
+            self.sync_again = True
+            return
+        self.sync_task = Task(self.fetch_inbox_sync, self.inbox.seq)
+        self.sync_task.signals.result.connect(self.apply_inbox_sync)
+        self.sync_task.signals.finished.connect(self.on_sync_finished)
+        self.sync_task.start()
+
+    def on_sync_finished(self):
+        # Failures are ignored: the next (re)connect of the push channel syncs again
+        self.sync_task = None
+        self.sync_pushed = []
+        if self.sync_again:
+            self.sync_again = False
+            self.sync_inbox()
+
+    def fetch_inbox_sync(self, task, seq):
+        """
+        Runs on a worker thread. Returns ("changes", pages) with every /changes
+        page since seq, ("list", payload) when a full reload is needed, or None.
+        """
+        if seq is not None:
+            pages = self.fetch_changes(seq)
+            if pages is not None:
+                return "changes", pages
+
+        # First sync, or the change feed was reset (seq too old): full reload
+        payload = self.fetch_inbox_list()
+        return None if payload is None else ("list", payload)
+
+    def fetch_inbox_list(self):
+        """
+        Every /list page merged into one payload carrying the first page's
+        seq, so changes that land while paging are replayed by the next sync.
+        A delete between pages shifts later entries past the offset, and the
+        feed can't replay an entry that was skipped, so a listing whose seq
+        moved is fetched again (kept after LIST_ATTEMPTS). None on failure.
+        """
+        for _ in range(LIST_ATTEMPTS):
+            files = {}
+            payload = page = None
+            offset = 0
+            while True:
+                res = self.client.get(f"/list/{self.user_email}",
+                                      params={"limit": LIST_PAGE_SIZE, "offset": offset})
+                if res.status_code != 200:
+                    return None
+                page = res.json()
+                if payload is None:
+                    payload = page
+                for f in page.get("files", []):
+                    files.setdefault(f["stored_as"], f)
+                offset += len(page.get("files", []))
+                # Older servers send the whole inbox without "total"
+                if "total" not in page or not page.get("files") or offset >= page["total"]:
+                    break
+            payload["files"] = list(files.values())
+            if page.get("seq") == payload.get("seq"):
+                break
+        return payload
+
+    def fetch_changes(self, seq):
+        """/changes pages since seq; None if a full reload is needed."""
+        pages = []
+        while True:
+            res = self.client.get(f"/changes/{self.user_email}", params={"since": seq})
+            if res.status_code != 200:
+                return None
+            payload = res.json()
+            if payload["reset"]:
+                return None
+
+            pages.append(payload)
+            seq = payload["seq"]
+            if not payload["has_more"]:
+                return pages
+
+    def apply_inbox_sync(self, result):
+        if result is None:
+            return
+        kind, payload = result
+        if kind == "list":
+            self.reload_inbox(payload)
+        else:
+            self.apply_changes(payload)
+
+    def reload_inbox(self, payload):
+        # Servers without a change feed send no "seq": every sync reloads
+        self.inbox.replace(payload.get("files", []), payload.get("seq"))
+        # The listing may predate files pushed while it was being fetched
+        for f in self.sync_pushed:
+            self.inbox.add(f)
+        self.history_list.clear()
+        self.inbox_keys.clear()
+        for f in self.inbox.newest_first():
+            self.add_inbox_item(f)
+
+    def apply_changes(self, pages):
+        for payload in pages:
+            for change in payload["changes"]:
+                if change["op"] == "add":
+                    self.on_file_received(change["file"])
+                else:
+                    self.inbox.remove(change["stored_as"])
+                    self.remove_inbox_item(change["stored_as"])
+            self.inbox.seq = payload["seq"]
+
+    def on_file_received(self, f):
+        """Pushed by InboxSubscriber (or replayed from /changes): newest files go on top."""
+        if self.sync_task is not None:
+            self.sync_pushed.append(f)
+        self.inbox.add(f)
+        self.add_inbox_item(f, row=0)
+
+    def add_inbox_item(self, f, row=None):
+        if f["stored_as"] in self.inbox_keys:
+            return None
+        self.inbox_keys.add(f["stored_as"])
+
+        text = f"{f['filename']}  •  {format_size(f['size'])}  •  {f['received_at']}"
+        if f.get("sender"):
+            text += f"  •  from {f['sender']}"
+
+        item = QListWidgetItem(text)
+        item.setData(Qt.UserRole, f["stored_as"])
+        if row is None:
+            self.history_list.addItem(item)
+        else:
+            self.history_list.insertItem(row, item)
+        return item
+
+    def remove_inbox_item(self, stored_as):
+        if stored_as not in self.inbox_keys:
+            return
+        self.inbox_keys.discard(stored_as)
+        for row in range(self.history_list.count()):
+            if self.history_list.item(row).data(Qt.UserRole) == stored_as:
+                self.history_list.takeItem(row)
+                return
+
+
+# ---------------------------------------------------------------------
+# Upload pipeline for one file: runs on a transfer worker thread, so it
+# holds no widgets, only the HTTP client and the sender's address
+# ---------------------------------------------------------------------
+class Uploader:
+    def __init__(self, client, user_email):
+        self.client = client
+        self.user_email = user_email
 
-        try:
-            res = requests.get(f"{self.server_url}/list/{self.user_email}")
+    def send_file(self, task, path, receiver):
+        """One attempt; returns the final HTTP response."""
+        # Hash first: if the server already has this content, only a
+        # small reference request is sent instead of the whole file
+        res = self.send_reference(path, receiver, task)
+        if res is None and self.worth_chunking(path):
+            res = self.send_chunks(path, receiver, task)
+        if res is None:
+            # Streamed from disk a block at a time: memory stays flat for any size
+            fields = {"receiver": receiver, "sender": self.user_email}
+            with MultipartFileStream(path, fields, progress=task.report) as body:
+                res = self.client.post("/upload", data=body,
+                                       headers={"Content-Type": body.content_type})
+        return res
+
+    @staticmethod
+    def worth_chunking(path):
+        if os.path.getsize(path) < CHUNKED_UPLOAD_MIN_SIZE:
+            return False
+        with open(path, "rb") as f:
+            return not crypto_engine.is_envelope(f.read(len(crypto_engine.MAGIC)))
 
-            if res.status_code == 200:
-                files = res.json().get("files", [])
-                for f in files:
-                    self.history_list.addItem(f)
+    # ---------------------------------------------------------------------
+    # Dedup pre-check: reference existing server content by hash
+    # ---------------------------------------------------------------------
+    def send_reference(self, path, receiver, task):
+        """Returns the /upload/ref response, or None if the file must be uploaded."""
+        sha256 = sha256_of(path, progress=task.report)
+
+        res = self.client.get(f"/blobs/{sha256}")
+        if res.status_code != 200:
+            return None
+
+        res = self.client.post("/upload/ref", json={
+            "sha256": sha256,
+            "receiver": receiver,
+            "sender": self.user_email,
+            "filename": os.path.basename(path),
+        })
+        # The blob may have been garbage-collected in between; fall back
+        return res if res.status_code == 200 else None
 
-        except:
-            pass
\ No newline at end of file
+    # ---------------------------------------------------------------------
+    # Chunk-level dedup: upload only the chunks the server doesn't have
+    # ---------------------------------------------------------------------
+    def send_chunks(self, path, receiver, task, attempts=2):
+        """Returns the /upload/manifest response, or None to fall back to /upload."""
+        file_sha256 = sha256_of(path, progress=task.report)
+        manifest = chunking.chunk_manifest(path, progress=task.report)
+        hashes = [sha256 for sha256, _ in manifest]
+        offsets = {}
+        offset = 0
+        for sha256, length in manifest:
+            offsets.setdefault(sha256, (offset, length))
+            offset += length
+
+        res = self.client.post("/chunks/missing", json={"chunks": hashes})
+        if res.status_code != 200:
+            return None
+        missing = res.json()["missing"]
+
+        for _ in range(attempts):
+            total = sum(offsets[sha256][1] for sha256 in missing)
+            sent = 0
+            meter = RateMeter()
+            with open(path, "rb") as f:
+                for sha256 in missing:
+                    task.report(sent, total, meter.update(sent))
+                    start, length = offsets[sha256]
+                    f.seek(start)
+                    res = self.client.put(f"/chunks/{sha256}", data=f.read(length))
+                    if res.status_code not in (200, 201):
+                        return None
+                    sent += length
+
+            res = self.client.post("/upload/manifest", json={
+                "receiver": receiver,
+                "sender": self.user_email,
+                "filename": os.path.basename(path),
+                "chunks": hashes,
+                "sha256": file_sha256,
+            })
+            if res.status_code == 202:
+                res = self.wait_for_assembly(res.json()["job"], task)
+                if res is None:
+                    return None
+            # 409: chunks were swept since the check; send those and retry
+            if res.status_code != 409:
+                return res if res.status_code == 200 else None
+            missing = res.json().get("missing", [])
+        return None
+
+    def wait_for_assembly(self, job_id, task):
+        """Polls a manifest job; returns its final response, or None if it never finishes."""
+        interval = MANIFEST_POLL_INTERVAL
+        deadline = time.monotonic() + MANIFEST_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(interval)
+            task.check()
+            res = self.client.get(f"/upload/manifest/{job_id}")
+            if res.status_code != 202:
+                return res
+            interval = min(interval * 2, MANIFEST_POLL_MAX_INTERVAL)
+        return None
+
+
+# ---------------------------------------------------------------------
+# Transfer and download queues, one per (server, user): like the inbox
+# cache they outlive FileTab, so switching panels doesn't stop or forget
+# transfers
+# ---------------------------------------------------------------------
+_transfer_managers = {}
+
+
+def transfer_queue(client, user_email):
+    key = (client.base_url, user_email)
+    if key not in _transfer_managers:
+        uploader = Uploader(client, user_email)
+        _transfer_managers[key] = transfer_manager.TransferManager(uploader.send_file)
+    return _transfer_managers[key]
+
+
+_download_managers = {}
+
+
+def download_queue(client, user_email):
+    key = (client.base_url, user_email)
+    if key not in _download_managers:
+        _download_managers[key] = download_manager.DownloadManager(client)
+    return _download_managers[key]
+
+
+# ---------------------------------------------------------------------
+# Inbox cache: the last synced inbox per (server, user). FileTab is
+# recreated on every panel switch; starting from the cache means only
+# the changes since are fetched, not the whole listing again
+# ---------------------------------------------------------------------
+class InboxCache:
+    def __init__(self):
+        self.seq = None                 # change-feed position; None = never listed
+        self.files = {}                 # stored_as → item, oldest first
+
+    def replace(self, files, seq):
+        # /list returns newest first
+        self.files = {f["stored_as"]: f for f in reversed(files)}
+        self.seq = seq
+
+    def add(self, f):
+        self.files.setdefault(f["stored_as"], f)
+
+    def remove(self, stored_as):
+        self.files.pop(stored_as, None)
+
+    def newest_first(self):
+        return list(reversed(self.files.values()))
+
+
+_inbox_caches = {}
+
+
+def inbox_cache(server_url, user_email):
+    return _inbox_caches.setdefault((server_url, user_email), InboxCache())
+
+
+# ---------------------------------------------------------------------
+# Inbox push channel: Server-Sent Events from /events/<receiver>
+# ---------------------------------------------------------------------
+# Subscribers outlive their FileTab until their thread has finished
+# (main.py deletes the tab whenever the user switches panels)
+_live_subscribers = set()
+
+
+class InboxSubscriber(QThread):
+    """
+    Holds one streaming GET /events/<email> open on a background thread and
+    emits file_received(item) for each new inbox entry, so FileTab inserts
+    the row without polling. Reconnects with backoff, sending Last-Event-ID
+    so entries that arrived while disconnected are replayed.
+    """
+
+    file_received = pyqtSignal(dict)
+    connected = pyqtSignal()
+
+    def __init__(self, client, user_email):
+        super().__init__()
+        self.client = client
+        self.path = f"/events/{user_email}"
+        self.last_event_id = None
+        self._stopped = False
+
+        _live_subscribers.add(self)
+        self.finished.connect(lambda: _live_subscribers.discard(self))
+
+    def stop(self):
+        # Closing the response from this thread would race the read in run().
+        # The blocked read returns on the next server keepalive (or the read
+        # timeout at the latest) and read_events() then sees _stopped;
+        # _live_subscribers keeps the thread referenced until it exits.
+        self._stopped = True
+
+    def run(self):
+        delay = 1
+        while not self._stopped:
+            headers = {"Accept": "text/event-stream"}
+            if self.last_event_id:
+                headers["Last-Event-ID"] = self.last_event_id
+            try:
+                with self.client.get(self.path, headers=headers, stream=True,
+                                     timeout=(10, EVENTS_READ_TIMEOUT)) as res:
+                    if res.status_code == 200:
+                        delay = 1
+                        self.connected.emit()
+                        self.read_events(res)
+            except (requests.RequestException, OSError, ValueError):
+                pass
+
+            # Server restarted or unreachable (or no /events on an older one)
+            for _ in range(delay * 10):
+                if self._stopped:
+                    return
+                time.sleep(0.1)
+            delay = min(delay * 2, EVENTS_RETRY_MAX)
+
+    def read_events(self, res):
+        event, data = None, []
+        for line in res.iter_lines(decode_unicode=True):
+            if self._stopped:
+                return
+            if line == "":
+                # Blank line ends an event
+                if event == "file" and data:
+                    self.file_received.emit(json.loads("\n".join(data)))
+                event, data = None, []
+            elif line.startswith(":"):
+                continue                    # comment / keepalive
+            else:
+                field, _, value = line.partition(":")
+                value = value[1:] if value.startswith(" ") else value
+                if field == "event":
+                    event = value
+                elif field == "data":
+                    data.append(value)
+                elif field == "id":
+                    self.last_event_id = value
+
+
+# (path, size, mtime) → sha256, so re-sending a known file skips re-hashing
+_hash_cache = {}
+
+
+def sha256_of(path, buffer_size=1024 * 1024, progress=None):
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if key in _hash_cache:
+        return _hash_cache[key]
+
+    digest = hashlib.sha256()
+    done = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(buffer_size), b""):
+            digest.update(block)
+            done += len(block)
+            if progress is not None:
+                progress(done, st.st_size)
+
+    _hash_cache[key] = digest.hexdigest()
+    return _hash_cache[key]
+
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
\ No newline at end of file
@@ -2,22 +2,35 @@
 HistoryTab – Reads history from Flask server instead of local files.
 """
 
-import requests
+from functools import partial
+
 from PyQt5.QtWidgets import (
     QWidget, QVBoxLayout, QLabel, QPushButton,
     QListWidget, QHBoxLayout, QFrame, QMessageBox
 )
 from PyQt5.QtGui import QFont, QColor, QPalette
-from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal
+
+from ui.api_client import shared_client
+from ui.workers import Task
 
 
 class HistoryTab(QWidget):
     back_requested = pyqtSignal()
 
-    def __init__(self, user_email: str):
+    PAGE_SIZE = 50
+
+    def __init__(self, user_email: str, client=None):
         super().__init__()
         self.user_email = user_email
-        self.server_url = "http://127.0.0.1:5000"
+        self.client = client or shared_client()
+
+        # Paging state: server returns newest first, we fetch older pages on scroll
+        self.next_before = None
+        self.has_more = False
+        self.loading = False
+        self.page_task = None
+        self.clear_task = None
 
         self.init_ui()
         self.load_history()
@@ -69,6 +82,7 @@ class HistoryTab(QWidget):
                 font-size: 13px;
             }
         """)
+        self.history_list.verticalScrollBar().valueChanged.connect(self.on_scroll)
         box_layout.addWidget(self.history_list)
 
         # Buttons
@@ -99,34 +113,106 @@ class HistoryTab(QWidget):
         layout.addWidget(box)
 
     # -----------------------------------------------------------
-    # Load History from Flask Server
+    # Load History from Flask Server (first page, newest first)
+    #   Pages are fetched in the background; the list fills in when
+    #   each one arrives
     # -----------------------------------------------------------
     def load_history(self):
-        self.history_list.clear()
+        if self.page_task is not None:
+            self.page_task.cancel()
 
-        try:
-            res = requests.get(f"{self.server_url}/history/{self.user_email}")
+        self.history_list.clear()
+        self.history_list.addItem("Loading…")
+        self.next_before = None
+        self.has_more = False
+        self.start_page_task(None, self.on_first_page, self.on_first_page_error)
 
-            if res.status_code != 200:
-                self.history_list.addItem("Error loading history.")
-                return
+    def on_first_page(self, page):
+        self.history_list.clear()
+        if page is None:
+            self.history_list.addItem("Error loading history.")
+            return
 
-            records = res.json()
+        if not page["items"]:
+            self.history_list.addItem("No history yet.")
+            return
 
-            if not records:
-                self.history_list.addItem("No history yet.")
-                return
+        self.add_page(page)
 
-            # Newest first
-            for rec in reversed(records):
-                line = f"[{rec['timestamp']}] {rec['action'].upper()} | {rec['filename']}"
-                if "sender" in rec and rec["sender"]:
-                    line += f" | from {rec['sender']}"
-                self.history_list.addItem(line)
+    def on_first_page_error(self, error):
+        self.history_list.clear()
+        self.history_list.addItem("Error connecting to server.")
+        print("History load error:", error)
 
-        except Exception as e:
-            self.history_list.addItem("Error connecting to server.")
-            print("History load error:", e)
+    # -----------------------------------------------------------
+    # Lazy paging: fetch the next older page near the bottom
+    # -----------------------------------------------------------
+    def on_scroll(self, value):
+        bar = self.history_list.verticalScrollBar()
+        if self.has_more and not self.loading and value >= bar.maximum() - 2:
+            self.load_more()
+
+    def load_more(self):
+        self.start_page_task(self.next_before, self.on_more_page, self.on_more_page_error)
+
+    def on_more_page(self, page):
+        if page is not None:
+            self.add_page(page)
+
+    def on_more_page_error(self, error):
+        print("History page error:", error)
+
+    def start_page_task(self, before, on_page, on_error):
+        self.loading = True
+        task = self.page_task = Task(self.fetch_page, before)
+        task.signals.result.connect(partial(self.on_page_task_result, task, on_page))
+        task.signals.error.connect(partial(self.on_page_task_result, task, on_error))
+        task.signals.finished.connect(partial(self.on_page_task_finished, task))
+        task.start()
+
+    def on_page_task_result(self, task, handler, value):
+        # A Refresh replaced this task: its page belongs to the old listing
+        if task is self.page_task:
+            handler(value)
+
+    def on_page_task_finished(self, task):
+        if task is self.page_task:
+            self.page_task = None
+            self.loading = False
+            # The scroll range is updated lazily: look once the rows are laid out
+            QTimer.singleShot(0, self.fill_viewport)
+
+    def fetch_page(self, task, before=None):
+        params = {"limit": self.PAGE_SIZE}
+        if before is not None:
+            params["before"] = before
+
+        res = self.client.get(f"/history/{self.user_email}", params=params)
+        if res.status_code != 200:
+            return None
+        return res.json()
+
+    def add_page(self, page):
+        for rec in page["items"]:
+            line = f"[{rec['timestamp']}] {rec['action'].upper()} | {rec['filename']}"
+            if "sender" in rec and rec["sender"]:
+                line += f" | from {rec['sender']}"
+            self.history_list.addItem(line)
+
+        self.next_before = page["next_before"]
+        self.has_more = page["has_more"]
+
+    def fill_viewport(self):
+        # Keep fetching while the list is too short to scroll. Hidden, the
+        # list has no height and every page would look too short
+        if not self.history_list.isVisible() or not self.has_more or self.loading:
+            return
+        if self.history_list.verticalScrollBar().maximum() == 0:
+            self.load_more()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        QTimer.singleShot(0, self.fill_viewport)
 
     # -----------------------------------------------------------
     # Clear History on Server
@@ -137,14 +223,24 @@ class HistoryTab(QWidget):
             QMessageBox.Yes | QMessageBox.No
         ) == QMessageBox.Yes:
 
-            try:
-                res = requests.delete(f"{self.server_url}/history/{self.user_email}/clear")
-                if res.status_code == 200:
-                    self.history_list.clear()
-                    self.history_list.addItem("History cleared.")
-                else:
-                    QMessageBox.warning(self, "Error", "Could not clear history.")
-
-            except Exception as e:
-                QMessageBox.warning(self, "Error", "Server not reachable.")
-                print("Clear history error:", e)
+            if self.page_task is not None:
+                self.page_task.cancel()
+                self.page_task = None
+                self.loading = False
+
+            self.clear_task = Task(lambda task: self.client.delete(f"/history/{self.user_email}/clear"))
+            self.clear_task.signals.result.connect(self.on_history_cleared)
+            self.clear_task.signals.error.connect(self.on_clear_error)
+            self.clear_task.start()
+
+    def on_history_cleared(self, res):
+        if res.status_code == 200:
+            self.history_list.clear()
+            self.has_more = False
+            self.history_list.addItem("History cleared.")
+        else:
+            QMessageBox.warning(self, "Error", "Could not clear history.")
+
+    def on_clear_error(self, error):
+        QMessageBox.warning(self, "Error", "Server not reachable.")
+        print("Clear history error:", error)
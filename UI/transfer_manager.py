@@ -0,0 +1,229 @@
+"""
+Transfer queue for CryptPort uploads.
+
+FileTab used to send one file per click and wait for it. TransferManager
+takes any number of (file, receivers) items and keeps the link busy:
+
+ - Up to max_concurrent transfers run at once, on the manager's own
+   thread pool (so a long queue never delays inbox syncs or history pages)
+ - Small files go first: the queue is ordered by size, so a bulk send
+   delivers most of its files early instead of queueing them behind one
+   large file
+ - Failures that may go away (connection errors, timeouts, 429 and 5xx
+   responses) are retried with exponential backoff and jitter, up to
+   max_attempts; other errors (400, 413 over quota, …) fail the item at once
+ - item_added / item_changed / item_finished signals drive the status table
+
+send(task, path, receiver) does one transfer attempt on a worker thread and
+returns the HTTP response; progress and rate go through task.report().
+"""
+
+import heapq
+import itertools
+import os
+import random
+from functools import partial
+
+from PyQt5.QtCore import QObject, QThreadPool, QTimer, pyqtSignal
+
+from ui.workers import Task
+
+QUEUED = "Queued"
+RUNNING = "Sending"
+RETRYING = "Retrying"
+DONE = "Done"
+FAILED = "Failed"
+CANCELLED = "Cancelled"
+
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+DEFAULT_CONCURRENCY = 4
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1.0              # seconds before the first retry, doubled each time
+BACKOFF_MAX = 60.0
+
+
+class TransferItem:
+    def __init__(self, item_id, path, receiver):
+        self.id = item_id
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.receiver = receiver
+        self.size = os.path.getsize(path)
+
+        self.status = QUEUED
+        self.attempts = 0
+        self.sent = 0
+        self.total = None
+        self.rate = 0.0
+        self.error = ""
+        self.response = None            # last HTTP response, once DONE
+        self.task = None
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+
+class TransferManager(QObject):
+    item_added = pyqtSignal(object)
+    item_changed = pyqtSignal(object)
+    item_finished = pyqtSignal(object)
+
+    def __init__(self, send, max_concurrent=DEFAULT_CONCURRENCY, max_attempts=MAX_ATTEMPTS):
+        super().__init__()
+        self.send = send
+        self.max_attempts = max_attempts
+
+        self.items = []                 # every item, in the order added
+        self._queue = []                # heap of (size, seq, item)
+        self._seq = itertools.count()
+        self._running = set()
+
+        self.pool = QThreadPool()
+        self.set_concurrency(max_concurrent)
+
+    # ----------------------------------------------------
+    # QUEUE
+    # ----------------------------------------------------
+    def add(self, path, receiver):
+        return self.add_many([path], receiver)[0]
+
+    def add_many(self, paths, receiver):
+        # Queue the whole batch before starting any: otherwise the first
+        # files picked start at once, however large they are
+        added = []
+        for path in paths:
+            item = TransferItem(next(self._seq), path, receiver)
+            self.items.append(item)
+            self._push(item)
+            self.item_added.emit(item)
+            added.append(item)
+        self._pump()
+        return added
+
+    def set_concurrency(self, max_concurrent):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.pool.setMaxThreadCount(self.max_concurrent)
+        self._pump()
+
+    def cancel(self, item):
+        if item.finished:
+            return
+        if item.task is not None:
+            item.task.cancel()          # reported back through the task's cancelled signal
+            return
+        # Queued or waiting to retry: never started, so it just leaves the queue
+        self._finish(item, CANCELLED)
+
+    def cancel_all(self):
+        for item in self.items:
+            self.cancel(item)
+
+    def retry(self, item):
+        """Puts a failed or cancelled item back in the queue."""
+        if item.status not in (FAILED, CANCELLED):
+            return
+        item.attempts = 0
+        item.error = ""
+        item.status = QUEUED
+        self._push(item)
+        self.item_changed.emit(item)
+        self._pump()
+
+    def clear_finished(self):
+        self.items = [item for item in self.items if not item.finished]
+
+    def counts(self):
+        counts = {}
+        for item in self.items:
+            counts[item.status] = counts.get(item.status, 0) + 1
+        return counts
+
+    def _push(self, item):
+        heapq.heappush(self._queue, (item.size, item.id, item))
+
+    def _pump(self):
+        while len(self._running) < self.max_concurrent and self._queue:
+            _, _, item = heapq.heappop(self._queue)
+            if item.status == QUEUED:
+                self._start(item)
+
+    # ----------------------------------------------------
+    # ONE ATTEMPT
+    # ----------------------------------------------------
+    def _start(self, item):
+        item.status = RUNNING
+        item.attempts += 1
+        item.sent, item.total, item.rate = 0, None, 0.0
+        self._running.add(item)
+
+        task = item.task = Task(self.send, item.path, item.receiver)
+        task.signals.progress.connect(partial(self._on_progress, item))
+        task.signals.rate.connect(partial(self._on_rate, item))
+        task.signals.result.connect(partial(self._on_result, item))
+        task.signals.error.connect(partial(self._on_error, item))
+        task.signals.cancelled.connect(partial(self._finish, item, CANCELLED))
+        task.signals.finished.connect(partial(self._on_task_finished, item))
+        self.item_changed.emit(item)
+        task.start(self.pool)
+
+    def _on_progress(self, item, done, total):
+        item.sent, item.total = done, total
+        self.item_changed.emit(item)
+
+    def _on_rate(self, item, rate):
+        item.rate = rate
+
+    def _on_result(self, item, res):
+        if res.status_code == 200:
+            item.response = res
+            self._finish(item, DONE)
+        elif res.status_code == 429 or res.status_code >= 500:
+            self._retry_later(item, f"HTTP {res.status_code}")
+        else:
+            self._finish(item, FAILED, f"HTTP {res.status_code}: {res.text[:200]}")
+
+    def _on_error(self, item, error):
+        message = str(error) or type(error).__name__
+        if not os.path.exists(item.path):
+            self._finish(item, FAILED, "File no longer exists")
+        elif isinstance(error, OSError):
+            # Connection errors and timeouts (requests' exceptions are OSErrors)
+            self._retry_later(item, message)
+        else:
+            self._finish(item, FAILED, message)
+
+    def _on_task_finished(self, item):
+        item.task = None
+        self._running.discard(item)
+        self._pump()
+
+    # ----------------------------------------------------
+    # RETRY / FINISH
+    # ----------------------------------------------------
+    def _retry_later(self, item, error):
+        if item.attempts >= self.max_attempts:
+            self._finish(item, FAILED, error)
+            return
+        # 1 s, 2 s, 4 s, … with jitter, so failed items don't all come back at once
+        delay = min(BACKOFF_BASE * 2 ** (item.attempts - 1), BACKOFF_MAX) * random.uniform(0.5, 1.0)
+        item.status = RETRYING
+        item.error = f"{error} — retry {item.attempts}/{self.max_attempts - 1} in {delay:.0f} s"
+        self.item_changed.emit(item)
+        QTimer.singleShot(int(delay * 1000), partial(self._requeue, item))
+
+    def _requeue(self, item):
+        if item.status != RETRYING:
+            return                      # cancelled while waiting
+        item.status = QUEUED
+        self._push(item)
+        self.item_changed.emit(item)
+        self._pump()
+
+    def _finish(self, item, status, error=""):
+        item.status = status
+        item.error = error
+        item.rate = 0.0
+        self.item_changed.emit(item)
+        self.item_finished.emit(item)
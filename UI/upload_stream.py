@@ -0,0 +1,125 @@
+"""
+Streaming multipart/form-data bodies for CryptPort uploads.
+
+requests builds a files= upload entirely in memory: the whole file is read
+into one bytes object before the first byte is sent, so memory grows with
+the file and nothing can report how far the send has got.
+MultipartFileStream produces the same body as it is read instead:
+
+ - The file is read one block at a time, so memory stays at one block
+   whatever the file size
+ - Content-Length is computed up front (the server sees a normal upload,
+   not chunked transfer encoding)
+ - progress(sent, total, rate) is called as the HTTP client pulls the body;
+   raising from it (a cancelled task) aborts the request
+ - The file handle is closed by the with block, even on error
+
+    with MultipartFileStream(path, {"receiver": r}, progress=cb) as body:
+        client.post("/upload", data=body, headers={"Content-Type": body.content_type})
+"""
+
+import os
+import time
+import uuid
+from collections import deque
+
+BLOCK_SIZE = 1024 * 1024
+
+
+class RateMeter:
+    """Bytes per second over roughly the last `window` seconds."""
+
+    def __init__(self, window=1.0):
+        self.window = window
+        self._samples = deque()         # (time, bytes done), ~10 per window
+
+    def update(self, done):
+        now = time.monotonic()
+        if not self._samples or now - self._samples[-1][0] >= self.window / 10:
+            self._samples.append((now, done))
+            while len(self._samples) > 2 and now - self._samples[1][0] >= self.window:
+                self._samples.popleft()
+        started, base = self._samples[0]
+        return (done - base) / (now - started) if now > started else 0.0
+
+
+class MultipartFileStream:
+    def __init__(self, path, fields, file_field="file", filename=None,
+                 file_content_type="application/octet-stream", block_size=BLOCK_SIZE, progress=None):
+        self.path = path
+        self.block_size = block_size
+        self.progress = progress
+
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+
+        filename = filename or os.path.basename(path)
+        head = []
+        for name, value in fields.items():
+            head.append(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{_quote(name)}"\r\n\r\n'
+                f"{value}\r\n".encode("utf-8")
+            )
+        head.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{_quote(file_field)}"; '
+            f'filename="{_quote(filename)}"\r\nContent-Type: {file_content_type}\r\n\r\n'.encode("utf-8")
+        )
+        self._head = b"".join(head)
+        self._tail = f"\r\n--{boundary}--\r\n".encode("ascii")
+
+        self.file_size = os.path.getsize(path)
+        self.total = len(self._head) + self.file_size + len(self._tail)
+        self.sent = 0
+
+        self._file = open(path, "rb")
+        self._buffer = memoryview(self._head)
+        self._stage = "head"            # head → file → tail → done
+        self._meter = RateMeter()
+
+    # requests sends Content-Length from len() and streams anything iterable
+    def __len__(self):
+        return self.total
+
+    def __iter__(self):
+        return iter(lambda: self.read(self.block_size), b"")
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.block_size
+        while not self._buffer and self._stage != "done":
+            self._next_buffer()
+        data = bytes(self._buffer[:size])
+        self._buffer = self._buffer[len(data):]
+
+        self.sent += len(data)
+        if self.progress is not None and data:
+            self.progress(self.sent, self.total, self._meter.update(self.sent))
+        return data
+
+    def _next_buffer(self):
+        if self._stage == "head":
+            self._stage = "file"
+        if self._stage == "file":
+            block = self._file.read(self.block_size)
+            if block:
+                self._buffer = memoryview(block)
+                return
+            self._stage = "tail"
+            self._buffer = memoryview(self._tail)
+            return
+        self._stage = "done"
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _quote(value):
+    # Same escaping as requests/urllib3 use for names in a quoted header parameter
+    return (str(value).replace("\\", "\\\\").replace('"', "%22")
+            .replace("\r", "%0D").replace("\n", "%0A"))
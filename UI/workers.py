@@ -0,0 +1,106 @@
+"""
+Background tasks for the CryptPort UI.
+
+Uploads, listings, connection tests and file encryption used to run on the
+GUI thread, so the window froze until they returned. A Task runs a
+function on the Qt thread pool instead and reports back through signals,
+which Qt delivers on the GUI thread:
+
+ - progress(done, total)  throttled to ~10 per second; total may be None
+ - rate(bytes_per_second) alongside progress, for transfers that measure it
+ - result(value)          the function's return value
+ - error(exception)       anything it raised, other than cancellation
+ - cancelled()            cancel() was called and the function stopped
+ - finished()             always, after one of the three above
+
+The function receives the Task as its first argument. Long loops call
+task.report(done, total), which also raises TaskCancelled once cancel()
+has been called, so cancellation takes effect at the next progress point.
+
+    task = Task(crypto_job, path)               # crypto_job(task, path)
+    task.signals.progress.connect(self.on_progress)
+    task.signals.result.connect(self.on_done)
+    task.start()
+
+Connect the signals before start(): a quick task may finish before the
+next line runs, and signals emitted with nothing connected are lost.
+"""
+
+import time
+import threading
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class TaskSignals(QObject):
+    # object, not int: byte counts of multi-GB files overflow a C int
+    progress = pyqtSignal(object, object)
+    rate = pyqtSignal(float)
+    result = pyqtSignal(object)
+    error = pyqtSignal(object)
+    cancelled = pyqtSignal()
+    finished = pyqtSignal()
+
+
+class Task(QRunnable):
+    PROGRESS_INTERVAL = 0.1
+
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = TaskSignals()
+
+        self._cancel = threading.Event()
+        self._last_report = 0.0
+
+    # ----------------------------------------------------
+    # CALLED FROM THE GUI THREAD
+    # ----------------------------------------------------
+    def start(self, pool=None):
+        (pool or QThreadPool.globalInstance()).start(self)
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def is_cancelled(self):
+        return self._cancel.is_set()
+
+    # ----------------------------------------------------
+    # CALLED FROM THE TASK FUNCTION
+    # ----------------------------------------------------
+    def check(self):
+        if self._cancel.is_set():
+            raise TaskCancelled()
+
+    def report(self, done, total=None, rate=None):
+        self.check()
+        now = time.monotonic()
+        if now - self._last_report >= self.PROGRESS_INTERVAL or (total is not None and done >= total):
+            self._last_report = now
+            self.signals.progress.emit(done, total)
+            if rate is not None:
+                self.signals.rate.emit(rate)
+
+    def run(self):
+        try:
+            value = self.fn(self, *self.args, **self.kwargs)
+        except TaskCancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            # A cancelled socket or file often surfaces as some other error
+            if self._cancel.is_set():
+                self.signals.cancelled.emit()
+            else:
+                self.signals.error.emit(e)
+        else:
+            self.signals.result.emit(value)
+        finally:
+            self.signals.finished.emit()
@@ -0,0 +1,111 @@
+"""
+Bytes transferred when re-sending a slightly edited file.
+
+Compares three upload strategies against a server that already holds the
+original version:
+ - whole file:  any change means uploading everything again
+ - fixed-size:  1 MiB blocks; an insert/delete shifts every later block
+ - FastCDC:     content-defined chunks (UI/chunking.py), what CryptPort sends
+
+Usage:
+    python benchmarks/bench_chunking.py [--size-mb 64] [--file path] [--seed 1]
+"""
+
+import os
+import sys
+import time
+import random
+import hashlib
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "UI"))
+import chunking  # noqa: E402
+
+FIXED_SIZE = chunking.AVG_SIZE
+
+
+def fixed_chunks(data):
+    return [data[i:i + FIXED_SIZE] for i in range(0, len(data), FIXED_SIZE)]
+
+
+def cdc_chunks(data):
+    chunks = []
+    pos = 0
+    while pos < len(data):
+        cut = chunking.cut_point(data, pos, len(data))
+        chunks.append(data[pos:cut])
+        pos = cut
+    return chunks
+
+
+def digests(chunks):
+    return {hashlib.sha256(chunk).digest() for chunk in chunks}
+
+
+def transferred(chunks, known):
+    """Bytes of the chunks the server doesn't have (each distinct chunk once)."""
+    sent = 0
+    seen = set(known)
+    for chunk in chunks:
+        digest = hashlib.sha256(chunk).digest()
+        if digest not in seen:
+            seen.add(digest)
+            sent += len(chunk)
+    return sent
+
+
+def edits(data, rng):
+    middle = len(data) // 2
+    patch = rng.randbytes(100) if hasattr(rng, "randbytes") else os.urandom(100)
+    return [
+        ("insert 100 B in the middle", data[:middle] + patch + data[middle:]),
+        ("overwrite 100 B in the middle", data[:middle] + patch + data[middle + 100:]),
+        ("delete 100 B in the middle", data[:middle] + data[middle + 100:]),
+        ("prepend 100 B", patch + data),
+        ("append 100 B", data + patch),
+        ("3 scattered 10 B inserts", b"".join([
+            data[:len(data) // 4], patch[:10],
+            data[len(data) // 4:middle], patch[10:20],
+            data[middle:3 * len(data) // 4], patch[20:30],
+            data[3 * len(data) // 4:],
+        ])),
+    ]
+
+
+def fmt(size):
+    return f"{size / (1024 * 1024):8.2f} MiB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=64, help="size of the random test file")
+    parser.add_argument("--file", help="use an existing file instead of random data")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.file:
+        with open(args.file, "rb") as f:
+            base = f.read()
+    else:
+        base = rng.getrandbits(args.size_mb * 8 * 1024 * 1024).to_bytes(args.size_mb * 1024 * 1024, "little")
+
+    started = time.perf_counter()
+    base_cdc = cdc_chunks(base)
+    elapsed = time.perf_counter() - started
+    print(f"Original: {fmt(len(base))}, {len(base_cdc)} CDC chunks "
+          f"(avg {len(base) / len(base_cdc) / 1024:.0f} KiB), chunked at {len(base) / elapsed / 1e6:.1f} MB/s")
+    print()
+
+    known_fixed = digests(fixed_chunks(base))
+    known_cdc = digests(base_cdc)
+
+    print(f"{'edit':32} {'whole file':>14} {'fixed 1 MiB':>14} {'FastCDC':>14}")
+    for name, data in edits(base, rng):
+        print(f"{name:32} {fmt(len(data)):>14} "
+              f"{fmt(transferred(fixed_chunks(data), known_fixed)):>14} "
+              f"{fmt(transferred(cdc_chunks(data), known_cdc)):>14}")
+
+
+if __name__ == "__main__":
+    main()
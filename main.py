@@ -13,6 +13,7 @@ from ui.register_window import RegisterWindow
 from ui.login_window import LoginWindow
 from ui.config_window import ConfigWindow
 from ui.connection_tab import ConnectionTab
+from ui.api_client import shared_client
 
 
 class ConnectionWindow(QMainWindow):
@@ -36,8 +37,8 @@ class ConnectionWindow(QMainWindow):
 
         self.setCentralWidget(central_widget)
 
-        # When connect button is clicked
-        self.connection_tab.connect_btn.clicked.connect(self.try_open_file_tab)
+        # When the connection test succeeds (it runs in the background)
+        self.connection_tab.connected.connect(self.try_open_file_tab)
 
         self.file_tab = None
         self.encryption_tab = None
@@ -56,7 +57,8 @@ class ConnectionWindow(QMainWindow):
         user_email = self.config_data.get("email")
         private_key = self.config_data.get("private_key")  # ✔ Important
 
-        self.file_tab = FileTab(user_email, private_key)  # ✔ Correct signature
+        # One pooled client for every tab, pointed at the server saved in config_data
+        self.file_tab = FileTab(user_email, private_key, client=shared_client(self.config_data))
         self.setCentralWidget(self.file_tab)
 
         # Correct signal connections
@@ -86,7 +88,7 @@ class ConnectionWindow(QMainWindow):
 
         user_email = self.config_data.get("email")
 
-        self.history_tab = HistoryTab(user_email)
+        self.history_tab = HistoryTab(user_email, client=shared_client(self.config_data))
         self.setCentralWidget(self.history_tab)
 
         self.history_tab.back_requested.connect(self.open_file_tab)
@@ -0,0 +1,479 @@
+"""
+asyncio (ASGI) variant of the CryptPort server.
+
+The WSGI app in server.py ties up one worker thread per request for the
+whole transfer, so a few hundred slow mobile uploads or downloads exhaust
+every worker. Here each request is a coroutine:
+
+ - request bodies are pulled from the socket chunk by chunk and multipart
+   uploads are parsed incrementally (werkzeug's sans-IO MultipartDecoder)
+   straight into a blob spool, never buffered whole
+ - response bodies are read from disk block by block and sent as they go
+ - every blocking step (file reads/writes, SQLite) runs on a bounded thread
+   pool via run_in_executor, so the event loop only waits on sockets
+
+A slow client therefore costs a coroutine and a few buffers, not a thread.
+
+Stores and route logic (inbox index, blob store, history writer, Range/ETag
+handling) are the ones in server.py and file_response.py, so both servers
+share server_data/ and answer identically.
+
+Routes: /, /upload, /upload/ref, /blobs/<sha256>, /list/<receiver>,
+/files/<receiver>/<stored_as>, /download/<receiver>/<filename>,
+/events/<receiver>, /changes/<receiver>, /history/<email>,
+/history/<email>/clear, /maintenance/report, /metrics. Resumable
+sessions and chunk dedup (/upload/<id>, /chunks/...) stay on the WSGI
+server; clients fall back to plain /upload when those return 404.
+
+    python asgi_server.py [--bind 127.0.0.1:5000] [--workers 1]
+    uvicorn asgi_server:app --host 0.0.0.0 --port 5000
+"""
+
+import os
+import re
+import json
+import time
+import asyncio
+import argparse
+from functools import partial
+from urllib.parse import parse_qsl
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.datastructures import Headers, MultiDict
+from werkzeug.utils import secure_filename
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import server as cryptport
+from file_response import plan_file_response, part_header, closing_boundary, READ_BUFFER
+from metrics import HTTP_REQUESTS, HTTP_LATENCY, HTTP_IN_FLIGHT, HTTP_BYTES_IN, HTTP_BYTES_OUT
+
+IO_THREADS = int(os.environ.get("CRYPTPORT_ASGI_IO_THREADS", "32"))
+MAX_JSON_BODY = 1024 * 1024
+MAX_FORM_FIELD = 64 * 1024
+MAX_FORM_PARTS = 1000
+SPOOL_WRITE_SIZE = 256 * 1024      # batch small multipart Data events per disk write
+
+executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="asgi-io")
+
+
+async def blocking(func, *args, **kwargs):
+    """Runs func on the I/O pool."""
+    return await asyncio.get_running_loop().run_in_executor(executor, partial(func, *args, **kwargs))
+
+
+# ----------------------------------------------------
+# REQUEST / RESPONSE HELPERS
+# ----------------------------------------------------
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Request:
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self.receive = receive
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.headers = Headers([(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"]])
+        self.args = MultiDict(parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True))
+
+    async def stream(self):
+        while True:
+            message = await self.receive()
+            if message["type"] == "http.disconnect":
+                raise HTTPError(499, "Client disconnected")
+            body = message.get("body", b"")
+            if body:
+                yield body
+            if not message.get("more_body", False):
+                return
+
+    async def disconnected(self):
+        """Waits until the client closes the connection (request body is discarded)."""
+        while (await self.receive())["type"] != "http.disconnect":
+            pass
+
+    async def json(self):
+        body = bytearray()
+        async for chunk in self.stream():
+            body += chunk
+            if len(body) > MAX_JSON_BODY:
+                raise HTTPError(413, "Request body too large")
+        try:
+            return json.loads(body) if body else {}
+        except ValueError:
+            return {}
+
+
+async def send_response(send, status, headers=None, body=b""):
+    headers = dict(headers or {})
+    if status != 304 and "Content-Length" not in headers:
+        headers["Content-Length"] = len(body)
+    raw = [(k.lower().encode("latin-1"), str(v).encode("latin-1")) for k, v in headers.items()]
+    await send({"type": "http.response.start", "status": status, "headers": raw})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_json(send, payload, status=200):
+    body = json.dumps(payload).encode()
+    await send_response(send, status, {"Content-Type": "application/json", "Content-Length": len(body)}, body)
+
+
+# ----------------------------------------------------
+# ROUTES
+# ----------------------------------------------------
+async def home(request, send):
+    await send_json(send, {"message": "CryptPort ASGI Server Running"})
+
+
+async def upload(request, send):
+    """Streams a multipart upload into a blob spool; see server.upload."""
+    content_type, options = parse_options_header(request.headers.get("Content-Type", ""))
+    if content_type != "multipart/form-data" or "boundary" not in options:
+        raise HTTPError(400, "No file provided")
+
+    # Events are drained after every chunk, so the decoder's buffer stays small
+    decoder = MultipartDecoder(options["boundary"].encode(), max_parts=MAX_FORM_PARTS)
+    form = MultiDict()
+    state = {"spool": None, "filename": None, "part": None, "field": None, "complete": False}
+    field_value = bytearray()
+    pending = bytearray()
+
+    async def drain():
+        """Handles every event the decoder can produce from the data so far."""
+        while True:
+            try:
+                event = decoder.next_event()
+            except RequestEntityTooLarge:
+                raise HTTPError(413, "Too many form parts")
+            except ValueError:
+                raise HTTPError(400, "Malformed multipart body")
+
+            if isinstance(event, NeedData):
+                return
+            if isinstance(event, Epilogue):
+                state["complete"] = True
+                return
+
+            if isinstance(event, Field):
+                state["part"], state["field"] = "field", event.name
+                field_value.clear()
+            elif isinstance(event, File):
+                # Only the first "file" part is stored, like request.files["file"]
+                state["part"] = None
+                if event.name == "file" and state["spool"] is None:
+                    state["part"], state["filename"] = "file", event.filename
+                    state["spool"] = await blocking(cryptport.blob_store.spool)
+            elif isinstance(event, Data) and state["part"] == "field":
+                field_value.extend(event.data)
+                if len(field_value) > MAX_FORM_FIELD:
+                    raise HTTPError(413, "Form field too large")
+                if not event.more_data:
+                    form.add(state["field"], field_value.decode("utf-8", "replace"))
+            elif isinstance(event, Data) and state["part"] == "file":
+                pending.extend(event.data)
+                if len(pending) >= SPOOL_WRITE_SIZE or not event.more_data:
+                    await blocking(state["spool"].write, bytes(pending))
+                    pending.clear()
+
+    try:
+        async for chunk in request.stream():
+            decoder.receive_data(chunk)
+            await drain()
+        decoder.receive_data(None)
+        await drain()
+
+        spool, filename = state["spool"], state["filename"]
+        if not state["complete"]:
+            raise HTTPError(400, "Malformed multipart body")
+        if spool is None:
+            raise HTTPError(400, "No file provided")
+
+        receivers = cryptport.parse_receivers(form)
+        error = cryptport.receivers_error(receivers)
+        if error:
+            raise HTTPError(400, error)
+
+        file_id, safe_name, stored_as = cryptport.new_stored_name(filename or "")
+        sha256, size = await blocking(cryptport.blob_store.commit_spool, spool, len(receivers))
+        await blocking(cryptport.record_received, receivers, form.get("sender"), safe_name, stored_as, size, sha256)
+    finally:
+        if state["spool"] is not None:
+            await blocking(state["spool"].close)
+
+    await send_json(send, cryptport.upload_payload(file_id, safe_name, stored_as, receivers))
+
+
+async def upload_ref(request, send):
+    data = await request.json()
+    sha256 = str(data.get("sha256") or "").lower()
+    receivers = cryptport.parse_receivers(data)
+
+    error = cryptport.receivers_error(receivers)
+    if error:
+        raise HTTPError(400, error)
+    if not data.get("filename"):
+        raise HTTPError(400, "Missing filename")
+    if not cryptport.valid_sha256(sha256) or not await blocking(cryptport.blob_store.add_refs, sha256, len(receivers)):
+        return await send_json(send, {"error": "Unknown content hash", "exists": False}, 404)
+
+    file_id, filename, stored_as = cryptport.new_stored_name(data["filename"])
+    blob = await blocking(cryptport.blob_store.get, sha256)
+    await blocking(cryptport.record_received, receivers, data.get("sender"), filename, stored_as, blob["size"], sha256)
+    await send_json(send, cryptport.upload_payload(file_id, filename, stored_as, receivers, deduplicated=True))
+
+
+async def blob_exists(request, send, sha256):
+    sha256 = sha256.lower()
+    blob = await blocking(cryptport.blob_store.get, sha256) if cryptport.valid_sha256(sha256) else None
+    if blob is None:
+        return await send_json(send, {"exists": False}, 404)
+    await send_json(send, {"exists": True, "sha256": sha256, "size": blob["size"]})
+
+
+async def list_files(request, send, receiver):
+    payload, status = await blocking(cryptport.list_page, receiver, request.args)
+    await send_json(send, payload, status)
+
+
+async def list_changes(request, send, receiver):
+    payload, status = await blocking(cryptport.changes_page, receiver, request.args)
+    await send_json(send, payload, status)
+
+
+async def delete_file(request, send, receiver, stored_as):
+    payload, status = await blocking(cryptport.remove_received, receiver, stored_as)
+    await send_json(send, payload, status)
+
+
+async def download(request, send, receiver, filename):
+    filename = secure_filename(filename)
+    file_path, etag = await blocking(cryptport.resolve_received, receiver, filename) if filename else (None, None)
+    if file_path is None:
+        raise HTTPError(404, "File not found")
+
+    plan = await blocking(plan_file_response, request.method, request.headers, file_path, filename, etag=etag)
+    await blocking(cryptport.log_download, receiver, filename, request.method, plan.status,
+                   plan.headers.get("Content-Range"))
+
+    if plan.status not in (200, 206) or request.method == "HEAD":
+        return await send_response(send, plan.status, plan.headers)
+
+    raw = [(k.lower().encode("latin-1"), str(v).encode("latin-1")) for k, v in plan.headers.items()]
+    await send({"type": "http.response.start", "status": plan.status, "headers": raw})
+
+    f = await blocking(open, file_path, "rb")
+    try:
+        await send_file_spans(send, f, plan)
+    except OSError:
+        pass    # client went away mid-transfer
+    finally:
+        await blocking(f.close)
+
+
+async def send_file_spans(send, f, plan):
+    for start, end in plan.ranges:
+        if plan.boundary:
+            await send({"type": "http.response.body",
+                        "body": part_header(plan.boundary, plan.content_type, start, end, plan.size),
+                        "more_body": True})
+        await blocking(f.seek, start)
+        remaining = end - start + 1
+        while remaining > 0:
+            block = await blocking(f.read, min(READ_BUFFER, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            # send() waits while the client's socket buffer is full
+            await send({"type": "http.response.body", "body": block, "more_body": True})
+    tail = closing_boundary(plan.boundary) if plan.boundary else b""
+    await send({"type": "http.response.body", "body": tail})
+
+
+async def inbox_events(request, send, receiver):
+    """SSE stream of new inbox entries; see server.inbox_events. Costs no thread while idle."""
+    loop = asyncio.get_running_loop()
+    key = cryptport.sanitize_email(receiver)
+    pending = asyncio.Queue()
+
+    def deliver(item):          # called on the notifier thread
+        loop.call_soon_threadsafe(pending.put_nowait, item)
+
+    cryptport.inbox_notifier.subscribe(key, deliver)
+    try:
+        replay = await blocking(cryptport.events_replay, receiver, request.headers.get("Last-Event-ID"))
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+        ]})
+        await send({"type": "http.response.body", "body": b": connected\n\n", "more_body": True})
+
+        sent = 0
+        for item in replay:
+            sent = item["id"]
+            await send({"type": "http.response.body", "body": cryptport.sse_event(item), "more_body": True})
+
+        disconnected = asyncio.ensure_future(request.disconnected())
+        try:
+            while True:
+                next_item = asyncio.ensure_future(pending.get())
+                done, _ = await asyncio.wait({next_item, disconnected},
+                                             timeout=cryptport.EVENTS_KEEPALIVE,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if disconnected in done:
+                    next_item.cancel()
+                    return
+                if next_item not in done:
+                    next_item.cancel()
+                    body = b": keepalive\n\n"
+                else:
+                    item = next_item.result()
+                    if item["id"] <= sent:
+                        continue
+                    sent = item["id"]
+                    body = cryptport.sse_event(item)
+                await send({"type": "http.response.body", "body": body, "more_body": True})
+        finally:
+            disconnected.cancel()
+    except OSError:
+        pass    # client went away
+    finally:
+        cryptport.inbox_notifier.unsubscribe(key, deliver)
+
+
+async def get_maintenance_report(request, send):
+    await send_json(send, await blocking(cryptport.maintenance_report))
+
+
+async def get_metrics(request, send):
+    body = await blocking(cryptport.metrics_exporter.collect)
+    await send_response(send, 200, {"Content-Type": "text/plain; version=0.0.4"}, body.encode())
+
+
+async def get_history(request, send, email):
+    payload, status = await blocking(cryptport.history_page, email, request.args)
+    await send_json(send, payload, status)
+
+
+async def delete_history(request, send, email):
+    await blocking(cryptport.clear_history, email)
+    await send_json(send, {"status": "cleared"})
+
+
+ROUTES = [
+    ({"GET"}, r"/", home),
+    ({"POST"}, r"/upload", upload),
+    ({"POST"}, r"/upload/ref", upload_ref),
+    ({"GET", "HEAD"}, r"/blobs/(?P<sha256>[^/]+)", blob_exists),
+    ({"GET"}, r"/list/(?P<receiver>[^/]+)", list_files),
+    ({"DELETE"}, r"/files/(?P<receiver>[^/]+)/(?P<stored_as>[^/]+)", delete_file),
+    ({"GET", "HEAD"}, r"/download/(?P<receiver>[^/]+)/(?P<filename>[^/]+)", download),
+    ({"GET"}, r"/events/(?P<receiver>[^/]+)", inbox_events),
+    ({"GET"}, r"/changes/(?P<receiver>[^/]+)", list_changes),
+    ({"GET"}, r"/history/(?P<email>[^/]+)", get_history),
+    ({"DELETE"}, r"/history/(?P<email>[^/]+)/clear", delete_history),
+    ({"GET"}, r"/maintenance/report", get_maintenance_report),
+    ({"GET"}, r"/metrics", get_metrics),
+]
+
+# Metrics label each route like Flask's URL rules: "/list/<receiver>"
+ROUTES = [(methods, re.compile(pattern + r"\Z"), re.sub(r"\(\?P<(\w+)>[^)]*\)", r"<\1>", pattern), handler)
+          for methods, pattern, handler in ROUTES]
+
+
+# ----------------------------------------------------
+# ASGI ENTRY POINT
+# ----------------------------------------------------
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            # Commit queued history events before the process goes away
+            await blocking(cryptport.history_writer.close)
+            executor.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    request = Request(scope, receive)
+    route, handler, params, allowed = "<unmatched>", None, {}, False
+    for methods, pattern, template, func in ROUTES:
+        match = pattern.match(request.path)
+        if match is None:
+            continue
+        if request.method not in methods:
+            allowed = True
+            continue
+        route, handler, params = template, func, match.groupdict()
+        break
+
+    # Latency here covers the whole exchange, body included; bytes out are
+    # counted as they are sent
+    response = {"status": 500, "bytes": 0}
+
+    async def counted_send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["bytes"] += len(message.get("body", b""))
+        await send(message)
+
+    started = time.perf_counter()
+    HTTP_IN_FLIGHT.add(route)
+    content_length = request.headers.get("Content-Length", type=int)
+    if content_length:
+        HTTP_BYTES_IN.inc(route, by=content_length)
+    try:
+        if handler is None:
+            error = ("Method not allowed", 405) if allowed else ("Not found", 404)
+            return await send_json(counted_send, {"error": error[0]}, error[1])
+        try:
+            await handler(request, counted_send, **params)
+        except HTTPError as e:
+            if e.status == 499:
+                response["status"] = 499
+            else:
+                await send_json(counted_send, {"error": str(e)}, e.status)
+        except cryptport.QuotaError as e:
+            await send_json(counted_send, {"error": str(e), **e.extra}, e.status)
+    finally:
+        HTTP_IN_FLIGHT.add(route, by=-1)
+        HTTP_LATENCY.observe(time.perf_counter() - started, route, request.method)
+        HTTP_REQUESTS.inc(route, request.method, str(response["status"]))
+        if response["bytes"]:
+            HTTP_BYTES_OUT.inc(route, by=response["bytes"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the CryptPort asyncio server (uvicorn).")
+    parser.add_argument("--bind", default=os.environ.get("CRYPTPORT_BIND", "127.0.0.1:5000"))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("CRYPTPORT_WORKERS", "1")))
+    parser.add_argument("--keepalive", type=int, default=int(os.environ.get("CRYPTPORT_KEEPALIVE", "5")))
+    parser.add_argument("--limit-concurrency", type=int, default=None,
+                        help="connections above this get 503 (default: unlimited)")
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("uvicorn is not installed: pip install uvicorn")
+
+    host, _, port = args.bind.rpartition(":")
+    # Read by server.py in each worker process uvicorn starts
+    os.environ["CRYPTPORT_WORKERS"] = str(args.workers)
+    print(f"🚀 CryptPort ASGI server on http://{args.bind} — workers={args.workers}")
+    uvicorn.run("asgi_server:app", host=host or "127.0.0.1", port=int(port), workers=args.workers,
+                timeout_keep_alive=args.keepalive, limit_concurrency=args.limit_concurrency)
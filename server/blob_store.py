@@ -0,0 +1,184 @@
+"""
+Content-addressed blob storage for the CryptPort server.
+
+Uploaded bytes are stored once under server_data/blobs/ab/cd/<sha256>,
+keyed by their SHA-256. Inbox entries are lightweight references; the
+blobs table keeps a reference count and a blob is deleted as soon as its
+last reference goes away. Sending the same file to 40 receivers stores
+it once.
+
+Uploads are hashed while they stream in: multipart bodies are spooled
+straight into a BlobSpool in blobs/tmp, which hashes on write, and the
+finished spool is renamed into place (or dropped if the blob exists).
+"""
+
+import os
+import time
+import hashlib
+import tempfile
+from datetime import datetime
+
+from metrics import DISK_WRITE, DISK_WRITE_BYTES
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256     TEXT PRIMARY KEY,
+    size       INTEGER NOT NULL,
+    refcount   INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+"""
+
+COPY_BUFFER = 1024 * 1024
+
+
+class BlobSpool:
+    """Writable temp file that hashes everything written to it."""
+
+    def __init__(self, tmp_dir):
+        self._file = tempfile.NamedTemporaryFile(dir=tmp_dir, prefix="spool-", delete=False)
+        self.path = self._file.name
+        self.size = 0
+        self.committed = False
+        self._digest = hashlib.sha256()
+
+    def write(self, data):
+        self._digest.update(data)
+        self.size += len(data)
+        started = time.perf_counter()
+        written = self._file.write(data)
+        DISK_WRITE.observe(time.perf_counter() - started, "spool")
+        DISK_WRITE_BYTES.inc("spool", by=len(data))
+        return written
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def finish(self):
+        """Closes the file for writing; it must be closed before it is renamed (Windows)."""
+        self._file.close()
+
+    def close(self):
+        self._file.close()
+        if not self.committed and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        # read / readline / seek / flush etc. go to the underlying file
+        return getattr(self._file, name)
+
+
+class BlobStore:
+    def __init__(self, root, db):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        self.db = db
+        self.db.executescript(SCHEMA)
+
+        # Called as hook(conn, sha256) inside the transaction that deletes a blob
+        self.delete_hooks = []
+
+    # ----------------------------------------------------
+    # PATHS / LOOKUP
+    # ----------------------------------------------------
+    def path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def get(self, sha256):
+        row = self.db.connect().execute("SELECT * FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+        return dict(row) if row else None
+
+    # ----------------------------------------------------
+    # INGEST (each returns (sha256, size) and holds `refs` references)
+    # ----------------------------------------------------
+    def spool(self):
+        return BlobSpool(self.tmp_dir)
+
+    def commit_spool(self, spool, refs=1):
+        spool.finish()
+        sha256, size = spool.hexdigest(), spool.size
+        self._adopt(spool.path, sha256, size, refs)
+        spool.committed = True
+        spool.close()
+        return sha256, size
+
+    def ingest_stream(self, stream, refs=1):
+        spool = self.spool()
+        try:
+            for block in iter(lambda: stream.read(COPY_BUFFER), b""):
+                spool.write(block)
+            return self.commit_spool(spool, refs)
+        finally:
+            spool.close()
+
+    def ingest_file(self, path, refs=1, sha256=None):
+        """Moves an existing file (e.g. a finished .part) into the store."""
+        if sha256 is None:
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(COPY_BUFFER), b""):
+                    digest.update(block)
+            sha256 = digest.hexdigest()
+        size = os.path.getsize(path)
+        self._adopt(path, sha256, size, refs)
+        return sha256, size
+
+    def _adopt(self, tmp_path, sha256, size, refs):
+        # The rename happens inside the write transaction, so a concurrent
+        # release() of the same content can't delete the file underneath us
+        with DISK_WRITE.time("blob_commit"), self.db.transaction() as conn:
+            row = conn.execute("SELECT refcount FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE blobs SET refcount = refcount + ? WHERE sha256 = ?", (refs, sha256))
+                os.remove(tmp_path)
+                return
+
+            final_path = self.path(sha256)
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(tmp_path, final_path)
+            conn.execute(
+                "INSERT INTO blobs (sha256, size, refcount, created_at) VALUES (?, ?, ?, ?)",
+                (sha256, size, refs, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            )
+
+    # ----------------------------------------------------
+    # REFERENCE COUNTING
+    # ----------------------------------------------------
+    def add_refs(self, sha256, refs=1):
+        """Adds references to an existing blob; returns False if it isn't stored."""
+        with self.db.transaction() as conn:
+            cur = conn.execute("UPDATE blobs SET refcount = refcount + ? WHERE sha256 = ?", (refs, sha256))
+            return cur.rowcount == 1
+
+    def release(self, sha256, refs=1):
+        """Drops references; the blob is garbage-collected when none are left."""
+        with self.db.transaction() as conn:
+            row = conn.execute("SELECT refcount FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is None:
+                return False
+            if row["refcount"] - refs > 0:
+                conn.execute("UPDATE blobs SET refcount = refcount - ? WHERE sha256 = ?", (refs, sha256))
+                return False
+            self._delete(conn, sha256)
+            return True
+
+    def _delete(self, conn, sha256):
+        conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+        for hook in self.delete_hooks:
+            hook(conn, sha256)
+        self.db.remove_on_commit(self.path(sha256), self.tmp_dir)
+
+    def reconcile(self, counts):
+        """Resets refcounts from {sha256: references}; unreferenced blobs are deleted."""
+        removed = 0
+        with self.db.transaction() as conn:
+            for row in conn.execute("SELECT sha256 FROM blobs").fetchall():
+                refs = counts.get(row["sha256"], 0)
+                if refs:
+                    conn.execute("UPDATE blobs SET refcount = ? WHERE sha256 = ?", (refs, row["sha256"]))
+                else:
+                    self._delete(conn, row["sha256"])
+                    removed += 1
+        return removed
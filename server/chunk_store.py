@@ -0,0 +1,317 @@
+"""
+Content-defined chunk storage for the CryptPort server.
+
+Clients split large files into content-defined chunks (UI/chunking.py,
+FastCDC), ask which chunk hashes the server lacks, upload only those, and
+then send a manifest (the ordered list of chunk hashes). The server
+assembles the manifest into a normal blob (blob_store.py), so downloads,
+ranges and refcounting work exactly as for any other upload.
+
+Re-sending a slightly edited file therefore only transfers the few chunks
+around the edit.
+
+ - Uploaded chunks are spooled to server_data/chunks/ab/<sha256>
+ - blob_chunks records which chunks make up each assembled blob and at
+   which offset, and a chunk's refcount is the number of blob_chunks rows
+   pointing at it
+ - Once a chunk is part of a blob its own file is deleted: its bytes are
+   read back from the blob at that offset, so content is stored once.
+   A chunk has a file exactly while its refcount is 0
+ - When a blob is garbage-collected its chunks are released with it and
+   forgotten once no blob holds them; chunks uploaded for a manifest that
+   never arrived stay at refcount 0 until sweep() removes them
+ - Assembling a large manifest takes longer than a client read timeout,
+   so it runs in the background; assembly_jobs holds each job's outcome
+   where every server worker can read it
+"""
+
+import os
+import json
+import time
+import uuid
+from datetime import datetime
+
+from blob_store import BlobSpool
+from metrics import DISK_WRITE
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    sha256     TEXT PRIMARY KEY,
+    size       INTEGER NOT NULL,
+    refcount   INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blob_chunks (
+    blob_sha256  TEXT NOT NULL,
+    seq          INTEGER NOT NULL,
+    chunk_sha256 TEXT NOT NULL,
+    offset       INTEGER NOT NULL,
+    PRIMARY KEY (blob_sha256, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_chunks_refcount ON chunks (refcount, created_at);
+CREATE INDEX IF NOT EXISTS idx_blob_chunks_chunk ON blob_chunks (chunk_sha256);
+CREATE TABLE IF NOT EXISTS assembly_jobs (
+    id         TEXT PRIMARY KEY,
+    status     INTEGER,             -- NULL while assembling, then the HTTP status
+    result     TEXT,                -- JSON response body once finished
+    created_at TEXT NOT NULL
+);
+"""
+
+COPY_BUFFER = 1024 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024      # client chunks are at most 4 MiB
+
+
+class ChunkError(Exception):
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+
+class ChunkStore:
+    def __init__(self, root, db, blob_store):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        self.db = db
+        self.db.executescript(SCHEMA)
+
+        # Chunks of a blob are released in the same transaction that deletes it
+        self.blob_store = blob_store
+        blob_store.delete_hooks.append(self._release_blob)
+
+    def path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    # ----------------------------------------------------
+    # LOOKUP
+    # ----------------------------------------------------
+    def missing(self, hashes):
+        """Returns the hashes (first-seen order, no duplicates) not stored yet."""
+        conn = self.db.connect()
+        wanted = list(dict.fromkeys(hashes))
+        have = set()
+        # Stay well under SQLite's bound-parameter limit
+        for i in range(0, len(wanted), 500):
+            batch = wanted[i:i + 500]
+            rows = conn.execute(
+                f"SELECT sha256 FROM chunks WHERE sha256 IN ({','.join('?' * len(batch))})", batch
+            )
+            have.update(row["sha256"] for row in rows)
+        return [sha256 for sha256 in wanted if sha256 not in have]
+
+    # ----------------------------------------------------
+    # UPLOAD
+    # ----------------------------------------------------
+    def put(self, sha256, stream, length=None):
+        """
+        Stores one chunk read from stream, verifying its hash.
+        Returns True if it was new, False if the server already had it.
+        """
+        if length is not None and length > MAX_CHUNK_SIZE:
+            raise ChunkError("Chunk too large", 413, max_size=MAX_CHUNK_SIZE)
+
+        spool = BlobSpool(self.tmp_dir)
+        try:
+            remaining = length
+            while remaining is None or remaining > 0:
+                block = stream.read(COPY_BUFFER if remaining is None else min(COPY_BUFFER, remaining))
+                if not block:
+                    break
+                spool.write(block)
+                if remaining is not None:
+                    remaining -= len(block)
+                if spool.size > MAX_CHUNK_SIZE:
+                    raise ChunkError("Chunk too large", 413, max_size=MAX_CHUNK_SIZE)
+
+            if spool.hexdigest() != sha256:
+                raise ChunkError("Chunk content does not match its hash", 400, sha256=spool.hexdigest())
+
+            spool.finish()
+            with DISK_WRITE.time("chunk_commit"), self.db.transaction() as conn:
+                if conn.execute("SELECT 1 FROM chunks WHERE sha256 = ?", (sha256,)).fetchone():
+                    return False
+                final_path = self.path(sha256)
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(spool.path, final_path)
+                spool.committed = True
+                conn.execute(
+                    "INSERT INTO chunks (sha256, size, refcount, created_at) VALUES (?, ?, 0, ?)",
+                    (sha256, spool.size, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                )
+                return True
+        finally:
+            spool.close()
+
+    # ----------------------------------------------------
+    # MANIFEST → BLOB
+    # ----------------------------------------------------
+    def assemble(self, hashes, expected_sha256=None, refs=1):
+        """
+        Concatenates the chunks into a new blob holding `refs` references.
+        Raises ChunkError(409, missing=[...]) if any chunk is not stored, or
+        400 if the result doesn't match expected_sha256.
+        Returns (sha256, size).
+        """
+        missing = self.missing(hashes)
+        if missing:
+            raise ChunkError("Missing chunks", 409, missing=missing)
+
+        spool = self.blob_store.spool()
+        try:
+            for sha256 in hashes:
+                for block in self._read_chunk(sha256, hashes):
+                    spool.write(block)
+
+            if expected_sha256 and spool.hexdigest() != expected_sha256:
+                raise ChunkError("Assembled file does not match its hash", 400, sha256=spool.hexdigest())
+
+            blob_sha256, size = self.blob_store.commit_spool(spool, refs)
+        finally:
+            spool.close()
+
+        self._link(blob_sha256, hashes)
+        return blob_sha256, size
+
+    def _read_chunk(self, sha256, hashes):
+        """Yields a chunk's bytes from its own file or, once linked, from a blob holding it."""
+        try:
+            with open(self.path(sha256), "rb") as f:
+                yield from iter(lambda: f.read(COPY_BUFFER), b"")
+            return
+        except FileNotFoundError:
+            pass            # linked into a blob meanwhile (or swept)
+
+        row = self.db.connect().execute(
+            "SELECT c.size, bc.blob_sha256, bc.offset FROM chunks c "
+            "JOIN blob_chunks bc ON bc.chunk_sha256 = c.sha256 WHERE c.sha256 = ? LIMIT 1",
+            (sha256,)
+        ).fetchone()
+        try:
+            if row is None:
+                raise FileNotFoundError(sha256)
+            with open(self.blob_store.path(row["blob_sha256"]), "rb") as f:
+                f.seek(row["offset"])
+                remaining = row["size"]
+                while remaining > 0:
+                    block = f.read(min(COPY_BUFFER, remaining))
+                    if not block:
+                        break
+                    remaining -= len(block)
+                    yield block
+        except FileNotFoundError:
+            # Swept (or its blob deleted) between the check and the copy
+            raise ChunkError("Missing chunks", 409, missing=self.missing(hashes))
+
+    def _link(self, blob_sha256, hashes):
+        with self.db.transaction() as conn:
+            # Only the first manifest of a blob is recorded, and only while
+            # the blob still exists
+            if conn.execute("SELECT 1 FROM blob_chunks WHERE blob_sha256 = ? LIMIT 1", (blob_sha256,)).fetchone():
+                return
+            if not conn.execute("SELECT 1 FROM blobs WHERE sha256 = ?", (blob_sha256,)).fetchone():
+                return
+
+            sizes, unlinked = {}, set()
+            for sha256 in set(hashes):
+                row = conn.execute("SELECT size, refcount FROM chunks WHERE sha256 = ?", (sha256,)).fetchone()
+                if row is None:
+                    return          # swept meanwhile: the blob stays whole, just not chunk-indexed
+                sizes[sha256] = row["size"]
+                if row["refcount"] <= 0:
+                    unlinked.add(sha256)
+
+            rows, offset = [], 0
+            for seq, sha256 in enumerate(hashes):
+                rows.append((blob_sha256, seq, sha256, offset))
+                offset += sizes[sha256]
+            conn.executemany(
+                "INSERT INTO blob_chunks (blob_sha256, seq, chunk_sha256, offset) VALUES (?, ?, ?, ?)", rows
+            )
+            conn.executemany(
+                "UPDATE chunks SET refcount = refcount + 1 WHERE sha256 = ?",
+                [(sha256,) for sha256 in hashes]
+            )
+            # The blob now holds these bytes; the chunk files are redundant
+            for sha256 in unlinked:
+                self.db.remove_on_commit(self.path(sha256), self.tmp_dir)
+
+    # ----------------------------------------------------
+    # RELEASE / SWEEP
+    # ----------------------------------------------------
+    def _release_blob(self, conn, blob_sha256):
+        rows = conn.execute(
+            "SELECT chunk_sha256 FROM blob_chunks WHERE blob_sha256 = ?", (blob_sha256,)
+        ).fetchall()
+        if not rows:
+            return
+        conn.execute("DELETE FROM blob_chunks WHERE blob_sha256 = ?", (blob_sha256,))
+        conn.executemany(
+            "UPDATE chunks SET refcount = refcount - 1 WHERE sha256 = ?",
+            [(row["chunk_sha256"],) for row in rows]
+        )
+        # A linked chunk has no file of its own: with no blob left holding
+        # its bytes it is gone
+        conn.executemany(
+            "DELETE FROM chunks WHERE sha256 = ? AND refcount <= 0",
+            [(sha256,) for sha256 in {row["chunk_sha256"] for row in rows}]
+        )
+
+    def _delete_if_unreferenced(self, conn, sha256):
+        cur = conn.execute("DELETE FROM chunks WHERE sha256 = ? AND refcount <= 0", (sha256,))
+        if cur.rowcount:
+            self.db.remove_on_commit(self.path(sha256), self.tmp_dir)
+            return True
+        return False
+
+    # ----------------------------------------------------
+    # ASSEMBLY JOBS
+    # ----------------------------------------------------
+    def start_job(self):
+        job_id = uuid.uuid4().hex
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT INTO assembly_jobs (id, created_at) VALUES (?, ?)",
+                (job_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            )
+        return job_id
+
+    def finish_job(self, job_id, status, result):
+        with self.db.transaction() as conn:
+            conn.execute(
+                "UPDATE assembly_jobs SET status = ?, result = ? WHERE id = ?",
+                (status, json.dumps(result), job_id)
+            )
+
+    def job(self, job_id):
+        """(status, result) of a job; status is None while it runs. None if unknown."""
+        row = self.db.connect().execute(
+            "SELECT status, result FROM assembly_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return row["status"], json.loads(row["result"]) if row["result"] else None
+
+    def sweep_jobs(self, max_age_seconds=24 * 3600):
+        """Forgets jobs older than max_age_seconds, finished or not; returns the count."""
+        cutoff = datetime.fromtimestamp(time.time() - max_age_seconds).strftime("%Y-%m-%d %H:%M:%S")
+        with self.db.transaction() as conn:
+            return conn.execute("DELETE FROM assembly_jobs WHERE created_at < ?", (cutoff,)).rowcount
+
+    def sweep(self, max_age_seconds=24 * 3600, limit=None):
+        """
+        Deletes unreferenced chunks older than max_age_seconds; returns the count.
+        limit caps the chunks handled per call (maintenance.py sweeps in slices).
+        """
+        cutoff = datetime.fromtimestamp(time.time() - max_age_seconds).strftime("%Y-%m-%d %H:%M:%S")
+        removed = 0
+        with self.db.transaction() as conn:
+            rows = conn.execute(
+                "SELECT sha256 FROM chunks WHERE refcount <= 0 AND created_at < ? LIMIT ?",
+                (cutoff, -1 if limit is None else limit)
+            ).fetchall()
+            for row in rows:
+                removed += self._delete_if_unreferenced(conn, row["sha256"])
+        return removed
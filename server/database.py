@@ -0,0 +1,82 @@
+"""
+SQLite connection handling shared by the CryptPort server stores.
+
+ - One connection per thread (sqlite3 connections are not thread-safe)
+   and per process: a connection inherited across fork() is never reused
+ - WAL journal so readers never block the writer
+ - Explicit BEGIN IMMEDIATE transactions for writes
+ - Files deleted along with their rows are moved aside inside the
+   transaction and only unlinked once it commits (remove_on_commit)
+"""
+
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+
+
+class Database:
+    def __init__(self, path, synchronous="NORMAL", busy_timeout_ms=5000):
+        self.path = path
+        self.synchronous = synchronous
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def connect(self):
+        if self._pid != os.getpid():
+            # Forked worker: start over with fresh connections
+            self._local = threading.local()
+            self._pid = os.getpid()
+
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            # busy_timeout first, so switching to WAL waits out other workers
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        self._local.removed = []
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            # Still holding the write lock: nothing can have taken the names back
+            for path, trash_path in reversed(self._local.removed):
+                os.replace(trash_path, path)
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            removed, self._local.removed = self._local.removed, None
+        for _, trash_path in removed:
+            try:
+                os.remove(trash_path)
+            except OSError:
+                pass                    # left for the maintenance sweep of trash_dir
+
+    def remove_on_commit(self, path, trash_dir):
+        """
+        Deletes path as part of the current transaction: it is renamed into
+        trash_dir now, unlinked after COMMIT and renamed back on ROLLBACK.
+        A rolled-back delete never leaves a row pointing at a missing file,
+        and a file re-created under path after the commit is left alone.
+        """
+        trash_path = os.path.join(trash_dir, f"deleted-{uuid.uuid4().hex}-{os.path.basename(path)}")
+        try:
+            os.replace(path, trash_path)
+        except FileNotFoundError:
+            return
+        self._local.removed.append((path, trash_path))
+
+    def executescript(self, script):
+        self.connect().executescript(script)
@@ -0,0 +1,270 @@
+"""
+File responses with HTTP Range, ETag and conditional GET support.
+
+ - Strong ETags built from inode, size and mtime
+ - If-None-Match / If-Modified-Since  → 304
+ - If-Match                           → 412
+ - Range (single and multi) + If-Range → 206 / 416
+ - Whole-file bodies go through wsgi.file_wrapper when the server offers
+   one (gunicorn uses os.sendfile there), so bytes skip Python buffers
+
+plan_file_response() holds the protocol decisions and is shared with the
+asyncio server (asgi_server.py); send_file_ranged() turns a plan into a
+Flask response.
+"""
+
+import os
+import uuid
+from urllib.parse import quote
+
+from flask import Response
+from werkzeug.http import http_date, parse_date
+
+READ_BUFFER = 256 * 1024
+MAX_RANGES = 16
+
+
+# ----------------------------------------------------
+# VALIDATORS
+# ----------------------------------------------------
+def make_etag(st):
+    return f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+
+
+def _etag_list(header):
+    return [tag.strip() for tag in header.split(",")] if header else []
+
+
+def _not_modified(headers, etag, mtime):
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match:
+        tags = _etag_list(if_none_match)
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+    since = parse_date(headers.get("If-Modified-Since"))
+    return since is not None and int(mtime) <= since.timestamp()
+
+
+def _precondition_failed(headers, etag):
+    if_match = headers.get("If-Match")
+    if not if_match:
+        return False
+    tags = _etag_list(if_match)
+    return "*" not in tags and etag not in tags
+
+
+def _if_range_allows(headers, etag, mtime):
+    if_range = headers.get("If-Range")
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag             # strong comparison only
+    when = parse_date(if_range)
+    return when is not None and int(mtime) == int(when.timestamp())
+
+
+# ----------------------------------------------------
+# RANGE PARSING
+# ----------------------------------------------------
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_ranges(header, size):
+    """
+    Returns a sorted, coalesced list of inclusive (start, end) pairs, or None
+    when the header is absent/malformed (serve the full body instead).
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+
+    ranges = []
+    for spec in header[len("bytes="):].split(","):
+        spec = spec.strip()
+        if "-" not in spec:
+            return None
+        first, last = spec.split("-", 1)
+        try:
+            if first == "":
+                length = int(last)
+                if length <= 0:
+                    continue
+                start, end = max(size - length, 0), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and end < start:
+                    return None
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+# ----------------------------------------------------
+# BODY ITERATORS
+# ----------------------------------------------------
+def _read_span(f, start, length):
+    f.seek(start)
+    remaining = length
+    while remaining > 0:
+        block = f.read(min(READ_BUFFER, remaining))
+        if not block:
+            break
+        remaining -= len(block)
+        yield block
+
+
+def _file_body(environ, f, start, length):
+    """
+    Uses the server's wsgi.file_wrapper (sendfile on gunicorn) for whole-file
+    bodies, where the end of the file is the end of the body. Ranges go
+    through a bounded read loop: not every server stops a file_wrapper at
+    Content-Length, and a 206 must not run past its range.
+    """
+    file_wrapper = environ.get("wsgi.file_wrapper")
+    if file_wrapper is not None and start == 0 and length == os.fstat(f.fileno()).st_size:
+        return file_wrapper(f, READ_BUFFER)
+
+    def generate():
+        try:
+            yield from _read_span(f, start, length)
+        finally:
+            f.close()
+    return generate()
+
+
+def part_header(boundary, content_type, start, end, size):
+    return (
+        f"\r\n--{boundary}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+    ).encode()
+
+
+def closing_boundary(boundary):
+    return f"\r\n--{boundary}--\r\n".encode()
+
+
+def _multipart_body(f, ranges, size, boundary, content_type):
+    try:
+        for start, end in ranges:
+            yield part_header(boundary, content_type, start, end, size)
+            yield from _read_span(f, start, end - start + 1)
+        yield closing_boundary(boundary)
+    finally:
+        f.close()
+
+
+def _multipart_length(ranges, size, boundary, content_type):
+    total = len(closing_boundary(boundary))
+    for start, end in ranges:
+        total += len(part_header(boundary, content_type, start, end, size))
+        total += end - start + 1
+    return total
+
+
+# ----------------------------------------------------
+# RESPONSE PLANNING
+# ----------------------------------------------------
+class FilePlan:
+    """
+    What to send for a file request:
+      status, headers    — response line and headers (Content-Type included)
+      ranges             — inclusive (start, end) spans to send; empty for no body
+      boundary           — set when the spans go out as multipart/byteranges
+    """
+
+    def __init__(self, status, headers, size, ranges=(), boundary=None, content_type=None):
+        self.status = status
+        self.headers = headers
+        self.size = size
+        self.ranges = list(ranges)
+        self.boundary = boundary
+        self.content_type = content_type
+
+
+def plan_file_response(method, request_headers, path, download_name,
+                       content_type="application/octet-stream", etag=None):
+    """
+    Decides the 200/206/304/412/416 response for path from the request headers.
+    etag: optional strong ETag (e.g. a content hash); defaults to inode/size/mtime.
+    """
+    st = os.stat(path)
+    size = st.st_size
+    etag = etag or make_etag(st)
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Last-Modified": http_date(st.st_mtime),
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(download_name)}",
+    }
+
+    if _precondition_failed(request_headers, etag):
+        return FilePlan(412, headers, size)
+    if _not_modified(request_headers, etag, st.st_mtime):
+        return FilePlan(304, headers, size)
+
+    ranges = None
+    if method == "GET" and _if_range_allows(request_headers, etag, st.st_mtime):
+        try:
+            ranges = parse_ranges(request_headers.get("Range"), size)
+        except RangeNotSatisfiable:
+            headers["Content-Range"] = f"bytes */{size}"
+            return FilePlan(416, headers, size)
+
+    if not ranges:
+        headers["Content-Type"] = content_type
+        headers["Content-Length"] = str(size)
+        return FilePlan(200, headers, size, [(0, size - 1)], content_type=content_type)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers["Content-Type"] = content_type
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return FilePlan(206, headers, size, ranges, content_type=content_type)
+
+    boundary = uuid.uuid4().hex
+    headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+    headers["Content-Length"] = str(_multipart_length(ranges, size, boundary, content_type))
+    return FilePlan(206, headers, size, ranges, boundary, content_type)
+
+
+# ----------------------------------------------------
+# RESPONSE BUILDER (Flask / WSGI)
+# ----------------------------------------------------
+def send_file_ranged(request, path, download_name, content_type="application/octet-stream", etag=None):
+    """
+    Builds a 200/206/304/412/416 response for path honouring the request headers.
+    etag: optional strong ETag (e.g. a content hash); defaults to inode/size/mtime.
+    """
+    plan = plan_file_response(request.method, request.headers, path, download_name, content_type, etag)
+    if plan.status not in (200, 206):
+        return Response(status=plan.status, headers=plan.headers)
+
+    f = open(path, "rb")
+    if plan.boundary:
+        body = _multipart_body(f, plan.ranges, plan.size, plan.boundary, content_type)
+    else:
+        start, end = plan.ranges[0]
+        body = _file_body(request.environ, f, start, end - start + 1)
+    return Response(body, status=plan.status, headers=plan.headers, direct_passthrough=True)
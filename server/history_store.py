@@ -0,0 +1,401 @@
+"""
+SQLite-backed transfer history for the CryptPort server.
+
+Replaces the per-user server_data/history/<user>.json files, which were
+read and rewritten in full on every upload and download. Each event is
+now a single indexed INSERT, and HistoryWriter moves those INSERTs off
+the request path by group-committing queued events on a background thread.
+
+One-shot migration of the old JSON files:
+    python history_store.py migrate [history_dir] [db_path]
+"""
+
+import os
+import sys
+import json
+import queue
+import atexit
+import threading
+import time
+from collections import Counter
+
+from database import Database
+from metrics import HISTORY_COMMIT, HISTORY_EVENTS, HISTORY_WRITE_ERRORS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    receiver  TEXT NOT NULL,            -- sanitized email of the history owner
+    timestamp TEXT NOT NULL,
+    action    TEXT NOT NULL,
+    filename  TEXT,
+    stored_as TEXT,
+    sender    TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_history_receiver  ON history (receiver, id);
+CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history (receiver, timestamp);
+CREATE INDEX IF NOT EXISTS idx_history_action    ON history (receiver, action);
+"""
+
+FIELDS = ("timestamp", "action", "filename", "stored_as", "sender")
+
+
+def row_to_entry(row):
+    # Same shape as the old JSON records: keys without a value are left out
+    return {field: row[field] for field in FIELDS if row[field] is not None}
+
+
+class HistoryStore:
+    def __init__(self, db):
+        self.db = db
+        self.db.executescript(SCHEMA)
+
+    def append(self, receiver, entry):
+        self.append_many([(receiver, entry)])
+
+    def append_many(self, events):
+        """events: iterable of (receiver, entry dict); one transaction."""
+        rows = [(receiver, *(entry.get(field) for field in FIELDS)) for receiver, entry in events]
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO history (receiver, timestamp, action, filename, stored_as, sender) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def list(self, receiver):
+        """All entries for receiver, oldest first (the /history response shape)."""
+        rows = self.db.connect().execute(
+            "SELECT * FROM history WHERE receiver = ? ORDER BY id", (receiver,)
+        )
+        return [row_to_entry(row) for row in rows]
+
+    def page(self, receiver, limit=50, before=None, after=None,
+             action=None, sender=None, since=None, until=None):
+        """
+        Newest-first page of entries, each carrying its "id" cursor.
+          before: only entries older than this id (scrolling back)
+          after:  only entries newer than this id (catching up)
+          action / sender: exact match filters
+          since / until: inclusive timestamp bounds ("YYYY-MM-DD[ HH:MM:SS]")
+        Returns (entries, has_more).
+        """
+        clauses = ["receiver = ?"]
+        params = [receiver]
+        if before is not None:
+            clauses.append("id < ?")
+            params.append(before)
+        if after is not None:
+            clauses.append("id > ?")
+            params.append(after)
+        if action:
+            clauses.append("action = ?")
+            params.append(action)
+        if sender:
+            clauses.append("sender = ?")
+            params.append(sender)
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until:
+            # A bare date means the whole day
+            clauses.append("timestamp <= ?")
+            params.append(until + " 23:59:59" if len(until) == 10 else until)
+
+        # With an "after" cursor walk forward from it, so nothing between the
+        # cursor and the page is skipped; the page is still returned newest-first
+        order = "ASC" if after is not None and before is None else "DESC"
+        rows = self.db.connect().execute(
+            f"SELECT * FROM history WHERE {' AND '.join(clauses)} ORDER BY id {order} LIMIT ?",
+            (*params, limit + 1)
+        ).fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if order == "ASC":
+            rows.reverse()
+        return [{"id": row["id"], **row_to_entry(row)} for row in rows], has_more
+
+    def clear(self, receiver):
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM history WHERE receiver = ?", (receiver,))
+
+    # ----------------------------------------------------
+    # COMPACTION (maintenance.py)
+    # ----------------------------------------------------
+    def delete_older_than(self, timestamp, after_id=0, limit=500):
+        """
+        Looks at the next `limit` entries after id after_id and deletes those
+        older than timestamp. Ids follow time, so the walk stops at the first
+        batch holding newer entries. Returns (deleted, next after_id or None
+        when done). Only the DELETE runs inside a write transaction.
+        """
+        rows = self.db.connect().execute(
+            "SELECT id, timestamp FROM history WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)
+        ).fetchall()
+        old = [(row["id"],) for row in rows if row["timestamp"] < timestamp]
+        if old:
+            with self.db.transaction() as conn:
+                conn.executemany("DELETE FROM history WHERE id = ?", old)
+        done = len(rows) < limit or len(old) < len(rows)
+        return len(old), None if done else rows[-1]["id"]
+
+    def receivers_over(self, max_entries):
+        """{receiver: entry count} for every history longer than max_entries."""
+        rows = self.db.connect().execute(
+            "SELECT receiver, COUNT(*) AS entries FROM history GROUP BY receiver HAVING entries > ?",
+            (max_entries,)
+        )
+        return {row["receiver"]: row["entries"] for row in rows}
+
+    def trim(self, receiver, keep, limit=500):
+        """Deletes up to `limit` of the receiver's oldest entries beyond the newest `keep`."""
+        row = self.db.connect().execute(
+            "SELECT id FROM history WHERE receiver = ? ORDER BY id DESC LIMIT 1 OFFSET ?", (receiver, keep)
+        ).fetchone()
+        if row is None:
+            return 0
+        with self.db.transaction() as conn:
+            cur = conn.execute(
+                "DELETE FROM history WHERE id IN "
+                "(SELECT id FROM history WHERE receiver = ? AND id <= ? ORDER BY id LIMIT ?)",
+                (receiver, row["id"], limit)
+            )
+        return cur.rowcount
+
+
+# ----------------------------------------------------
+# ASYNC BATCHED WRITER
+#   Request handlers call submit() and return immediately; a writer thread
+#   commits everything queued within flush_interval in one transaction.
+#   fsync policy maps to the writer connection's PRAGMA synchronous:
+#     "always" → FULL (fsync every batch), "batch" → NORMAL (WAL default),
+#     "off" → OFF (leave it to the OS)
+#   A batch that fails to commit stays queued and is retried every
+#   RETRY_INTERVAL; it only counts as committed once it is in the table.
+#   With several worker processes pass pending_dir: while a worker holds
+#   queued events for a receiver it keeps a marker file
+#   pending_dir/<receiver>/<pid>, and sync() on any worker waits until the
+#   other workers' markers are gone. submit() itself never waits.
+# ----------------------------------------------------
+FSYNC_POLICIES = {"always": "FULL", "batch": "NORMAL", "off": "OFF"}
+RETRY_INTERVAL = 1.0
+PENDING_POLL = 0.01
+PENDING_STALE = 60          # older markers are left by a worker that died
+
+
+class HistoryWriter:
+    def __init__(self, store, flush_interval=0.05, max_batch=500, fsync="batch", pending_dir=None):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+
+        self.store = store
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.fsync = fsync
+        self.pending_dir = pending_dir
+
+        self._queue = queue.Queue()
+        self._cond = threading.Condition()
+        self._submitted = 0
+        self._committed = 0
+        self._pending = Counter()        # receiver → queued, not yet committed
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ----------------------------------------------------
+    # PRODUCER SIDE
+    # ----------------------------------------------------
+    def submit(self, receiver, entry):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("History writer is closed")
+            self._submitted += 1
+            self._pending[receiver] += 1
+            if self._pending[receiver] == 1:
+                self._mark(receiver)
+        self._queue.put((receiver, entry))
+
+    def flush(self, timeout=None):
+        """
+        Blocks until everything submitted before the call is committed.
+        Returns False on timeout, e.g. while a failed batch is being retried.
+        """
+        with self._cond:
+            target = self._submitted
+            return self._cond.wait_for(lambda: self._committed >= target, timeout)
+
+    def sync(self, receiver, timeout=5.0):
+        """Read-your-writes: waits only if receiver has queued events, here or (pending_dir) in another worker."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            queued = self._pending.get(receiver)
+        if queued and not self.flush(timeout):
+            return False
+
+        while self._pending_elsewhere(receiver):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(PENDING_POLL)
+        return True
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    # ----------------------------------------------------
+    # CROSS-PROCESS PENDING MARKERS
+    #   Created and removed under _cond, so a marker exists exactly while
+    #   this process has queued events for the receiver
+    # ----------------------------------------------------
+    def _marker(self, receiver):
+        return os.path.join(self.pending_dir, receiver, str(os.getpid()))
+
+    def _mark(self, receiver):
+        if self.pending_dir is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self._marker(receiver)), exist_ok=True)
+            open(self._marker(receiver), "a").close()
+        except OSError as e:
+            print("History pending marker not written:", e)
+
+    def _unmark(self, receiver):
+        if self.pending_dir is None:
+            return
+        try:
+            os.remove(self._marker(receiver))
+        except OSError:
+            pass
+
+    def _pending_elsewhere(self, receiver):
+        if self.pending_dir is None:
+            return False
+        directory = os.path.join(self.pending_dir, receiver)
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return False
+        stale = time.time() - PENDING_STALE
+        for name in names:
+            if name == str(os.getpid()):
+                continue
+            try:
+                if os.path.getmtime(os.path.join(directory, name)) >= stale:
+                    return True
+            except OSError:
+                continue
+        return False
+
+    # ----------------------------------------------------
+    # WRITER THREAD
+    # ----------------------------------------------------
+    def _run(self):
+        self.store.db.connect().execute(f"PRAGMA synchronous={FSYNC_POLICIES[self.fsync]}")
+
+        failed = []                     # batch that didn't commit, retried first
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=RETRY_INTERVAL if failed else None)
+            except queue.Empty:
+                failed = [] if self._commit(failed) else failed
+                continue
+            if item is None:
+                break
+
+            # Group commit: gather whatever arrives within the flush window
+            batch = failed + [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            failed = [] if self._commit(batch) else batch
+
+        # Drain anything left behind the shutdown marker
+        leftover = failed
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                leftover.append(item)
+        if leftover and not self._commit(leftover):
+            print(f"ERROR: history writer closed with {len(leftover)} events not written")
+
+    def _commit(self, batch):
+        """True once batch is in the table; False leaves it pending for a retry."""
+        try:
+            with HISTORY_COMMIT.time():
+                self.store.append_many(batch)
+        except Exception as e:
+            HISTORY_WRITE_ERRORS.inc()
+            print(f"ERROR: history batch of {len(batch)} events not written, will retry:", e)
+            return False
+        HISTORY_EVENTS.inc(by=len(batch))
+
+        with self._cond:
+            self._committed += len(batch)
+            for receiver, _ in batch:
+                self._pending[receiver] -= 1
+                if self._pending[receiver] <= 0:
+                    del self._pending[receiver]
+                    self._unmark(receiver)
+            self._cond.notify_all()
+        return True
+
+
+# ----------------------------------------------------
+# JSON → SQLITE MIGRATION
+# ----------------------------------------------------
+def migrate_json_dir(history_dir, store):
+    """
+    Imports every <receiver>.json under history_dir, then renames it to
+    .json.migrated so a second run (or a restart) never imports it twice.
+    Returns the number of entries imported.
+    """
+    if not os.path.isdir(history_dir):
+        return 0
+
+    imported = 0
+    for name in sorted(os.listdir(history_dir)):
+        if not name.endswith(".json"):
+            continue
+
+        path = os.path.join(history_dir, name)
+        receiver = name[:-len(".json")]
+        with open(path, "r") as f:
+            entries = json.load(f)
+
+        store.append_many((receiver, entry) for entry in entries)
+        os.replace(path, path + ".migrated")
+        imported += len(entries)
+
+    return imported
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("Usage: python history_store.py migrate [history_dir] [db_path]")
+        sys.exit(1)
+
+    history_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.join("server_data", "history")
+    db_path = sys.argv[3] if len(sys.argv) > 3 else os.path.join("server_data", "cryptport.db")
+
+    count = migrate_json_dir(history_dir, HistoryStore(Database(db_path)))
+    print(f"Migrated {count} history entries into {db_path}")
@@ -0,0 +1,100 @@
+"""
+Push notifications for new inbox arrivals (GET /events/<receiver>, SSE).
+
+One notifier thread per server process watches the inbox table for rows
+with an id above the last one it has seen and hands each new row to the
+subscribers of that receiver. Inbox ids only grow and every insert commits
+in its own write transaction, so "id > last seen" never misses a row.
+
+ - Uploads handled by this process call notify(), so their receivers hear
+   about the file as soon as the inbox row is committed
+ - Uploads handled by other worker processes (serve.py) are picked up on
+   the next check, at most poll_interval later
+ - With no subscribers the thread sleeps and does not touch the database
+
+Subscribers pass a callback that is invoked on the notifier thread with
+each item; Flask streams hand it a queue.Queue.put, the asyncio server a
+call_soon_threadsafe wrapper.
+"""
+
+import threading
+from collections import defaultdict
+
+
+class InboxNotifier:
+    def __init__(self, inbox_index, poll_interval=0.5):
+        self.inbox_index = inbox_index
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)     # receiver → {callback}
+        self._wake = threading.Event()
+        self._last_id = None
+        self._thread = None
+
+    # ----------------------------------------------------
+    # SUBSCRIPTIONS
+    # ----------------------------------------------------
+    def subscribe(self, receiver, callback):
+        """callback(item) receives every inbox row added for receiver from now on."""
+        with self._lock:
+            if self._last_id is None:
+                self._last_id = self.inbox_index.last_id()
+            self._subscribers[receiver].add(callback)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="inbox-notifier", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def unsubscribe(self, receiver, callback):
+        with self._lock:
+            callbacks = self._subscribers.get(receiver)
+            if callbacks is not None:
+                callbacks.discard(callback)
+                if not callbacks:
+                    del self._subscribers[receiver]
+            if not self._subscribers:
+                # Nobody listening: the next subscriber starts from the current end
+                self._last_id = None
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(callbacks) for callbacks in self._subscribers.values())
+
+    def notify(self):
+        """Called after this process commits inbox rows; wakes the notifier now."""
+        self._wake.set()
+
+    # ----------------------------------------------------
+    # NOTIFIER THREAD
+    # ----------------------------------------------------
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+            with self._lock:
+                if not self._subscribers:
+                    continue
+                last_id = self._last_id
+
+            try:
+                items = self.inbox_index.after(last_id)
+            except Exception as e:
+                print("Inbox notifier query failed:", e)
+                continue
+            if not items:
+                continue
+
+            with self._lock:
+                if self._last_id != last_id:
+                    continue        # everyone left (and maybe came back) meanwhile
+                self._last_id = items[-1]["id"]
+                targets = [(item, list(self._subscribers.get(item["receiver"], ()))) for item in items]
+            for item, callbacks in targets:
+                for callback in callbacks:
+                    callback(item)
+
+            # A full page means more rows may be waiting
+            if len(items) >= 500:
+                self._wake.set()
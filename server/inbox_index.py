@@ -0,0 +1,341 @@
+"""
+Per-receiver inbox index for the CryptPort server.
+
+/list used to os.listdir() the receiver folder on every request and
+return bare "uuid_filename" strings. The index keeps one row per received
+file (size, sender, received time, SHA-256) and is updated by upload and
+delete, so listing is an indexed query that never touches the directory.
+
+Rows with blob = 1 reference content in the blob store (blob_store.py)
+by their sha256; rows with blob = 0 are legacy files stored directly in
+server_data/received/<receiver>/.
+
+Every insert and delete also appends to inbox_changes, a change feed with
+one global, increasing sequence number. Clients remember the sequence
+/list returned and later ask for changes since it (/changes/<receiver>),
+so a refresh costs O(changes) instead of O(inbox size).
+
+Rebuild from what is on disk (e.g. after restoring a backup):
+    python inbox_index.py rebuild [data_dir]
+"""
+
+import os
+import sys
+import hashlib
+from datetime import datetime
+
+from database import Database
+from blob_store import BlobStore
+from chunk_store import ChunkStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inbox (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    receiver    TEXT NOT NULL,          -- sanitized email
+    stored_as   TEXT NOT NULL,
+    filename    TEXT,
+    sender      TEXT,
+    size        INTEGER NOT NULL,
+    sha256      TEXT,
+    received_at TEXT NOT NULL,
+    blob        INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (receiver, stored_as)
+);
+CREATE INDEX IF NOT EXISTS idx_inbox_received ON inbox (receiver, received_at);
+CREATE INDEX IF NOT EXISTS idx_inbox_size     ON inbox (receiver, size);
+CREATE INDEX IF NOT EXISTS idx_inbox_filename ON inbox (receiver, filename);
+CREATE INDEX IF NOT EXISTS idx_inbox_sender   ON inbox (receiver, sender);
+CREATE INDEX IF NOT EXISTS idx_inbox_sha256   ON inbox (sha256);
+CREATE INDEX IF NOT EXISTS idx_inbox_age      ON inbox (received_at);
+
+CREATE TABLE IF NOT EXISTS inbox_changes (
+    seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+    receiver    TEXT NOT NULL,          -- sanitized email; '*' = every receiver
+    op          TEXT NOT NULL,          -- 'add' | 'remove' | 'reset'
+    stored_as   TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_inbox_changes_receiver ON inbox_changes (receiver, seq);
+
+CREATE TABLE IF NOT EXISTS inbox_meta (
+    key         TEXT PRIMARY KEY,
+    value       INTEGER NOT NULL
+);
+"""
+
+SORT_COLUMNS = {
+    "received_at": "received_at",
+    "size": "size",
+    "filename": "filename",
+    "sender": "sender",
+}
+FIELDS = ("stored_as", "filename", "sender", "size", "sha256", "received_at")
+HASH_BUFFER = 1024 * 1024
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BUFFER), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def row_to_item(row):
+    return {field: row[field] for field in FIELDS}
+
+
+class InboxIndex:
+    def __init__(self, db):
+        self.db = db
+        self.db.executescript(SCHEMA)
+
+    def add(self, receiver, stored_as, filename, sender, size, sha256, received_at, blob=True):
+        self.add_many([receiver], stored_as, filename, sender, size, sha256, received_at, blob)
+
+    def add_many(self, receivers, stored_as, filename, sender, size, sha256, received_at, blob=True):
+        """Same entry in several inboxes (multi-recipient upload), one transaction."""
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO inbox "
+                "(receiver, stored_as, filename, sender, size, sha256, received_at, blob) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(receiver, stored_as, filename, sender, size, sha256, received_at, int(blob))
+                 for receiver in receivers]
+            )
+            conn.executemany(
+                "INSERT INTO inbox_changes (receiver, op, stored_as) VALUES (?, 'add', ?)",
+                [(receiver, stored_as) for receiver in receivers]
+            )
+
+    def get(self, receiver, stored_as):
+        """Full row, including the blob flag, or None."""
+        row = self.db.connect().execute(
+            "SELECT * FROM inbox WHERE receiver = ? AND stored_as = ?", (receiver, stored_as)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def remove(self, receiver, stored_as):
+        """Deletes the row and returns it (or None if it wasn't indexed)."""
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "SELECT * FROM inbox WHERE receiver = ? AND stored_as = ?", (receiver, stored_as)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM inbox WHERE id = ?", (row["id"],))
+            conn.execute(
+                "INSERT INTO inbox_changes (receiver, op, stored_as) VALUES (?, 'remove', ?)",
+                (receiver, stored_as)
+            )
+        return dict(row)
+
+    def list(self, receiver, sort="received_at", descending=True, limit=100, offset=0):
+        """Returns (items, total) for one page of the receiver's inbox."""
+        column = SORT_COLUMNS.get(sort)
+        if column is None:
+            raise ValueError(f"Unknown sort field: {sort}")
+        direction = "DESC" if descending else "ASC"
+
+        conn = self.db.connect()
+        total = conn.execute("SELECT COUNT(*) FROM inbox WHERE receiver = ?", (receiver,)).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT * FROM inbox WHERE receiver = ? ORDER BY {column} {direction}, id {direction} "
+            "LIMIT ? OFFSET ?",
+            (receiver, limit, offset)
+        )
+        return [row_to_item(row) for row in rows], total
+
+    def after(self, last_id, receiver=None, limit=500):
+        """
+        Rows added after inbox id last_id, oldest first, as items carrying
+        "id" and "receiver" (push notifications; see inbox_events.py).
+        """
+        sql = "SELECT * FROM inbox WHERE id > ?"
+        params = [last_id]
+        if receiver is not None:
+            sql += " AND receiver = ?"
+            params.append(receiver)
+        rows = self.db.connect().execute(sql + " ORDER BY id LIMIT ?", (*params, limit))
+        return [{"id": row["id"], "receiver": row["receiver"], **row_to_item(row)} for row in rows]
+
+    def last_id(self):
+        return self.db.connect().execute("SELECT COALESCE(MAX(id), 0) FROM inbox").fetchone()[0]
+
+    # ----------------------------------------------------
+    # CHANGE FEED
+    # ----------------------------------------------------
+    def change_seq(self):
+        """Current end of the change feed (0 before the first change)."""
+        # AUTOINCREMENT's counter survives pruning, unlike MAX(seq)
+        row = self.db.connect().execute(
+            "SELECT seq FROM sqlite_sequence WHERE name = 'inbox_changes'"
+        ).fetchone()
+        return row[0] if row else 0
+
+    def changes(self, receiver, since, limit=500):
+        """
+        Returns (changes, seq, has_more, reset) for the receiver since sequence
+        number since, oldest first:
+            {"seq", "op": "add", "file": item}  /  {"seq", "op": "remove", "stored_as"}
+        seq is where the next call should continue from. reset = True means
+        since is no longer covered by the feed (pruned, or from another
+        database) and the client has to reload the full list.
+        """
+        conn = self.db.connect()
+        latest = self.change_seq()
+        if since < self.changes_horizon() or since > latest:
+            return [], latest, False, True
+
+        rows = conn.execute(
+            "SELECT c.seq, c.op, c.stored_as, i.* FROM inbox_changes c "
+            "LEFT JOIN inbox i ON i.receiver = c.receiver AND i.stored_as = c.stored_as "
+            "WHERE c.receiver IN (?, '*') AND c.seq > ? ORDER BY c.seq LIMIT ?",
+            (receiver, since, limit + 1)
+        ).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        changes = []
+        for row in rows:
+            seq, op = row[0], row[1]
+            if op == "reset":
+                return [], latest, False, True
+            if op == "add":
+                # Rows removed since are skipped; their remove follows
+                if row["id"] is not None:
+                    changes.append({"seq": seq, "op": "add", "file": row_to_item(row)})
+            else:
+                changes.append({"seq": seq, "op": "remove", "stored_as": row[2]})
+
+        # Nothing newer for this receiver: continue from the end of the feed
+        next_seq = rows[-1][0] if has_more else max(latest, rows[-1][0] if rows else since)
+        return changes, next_seq, has_more, False
+
+    def changes_horizon(self):
+        """Sequence numbers below this have been pruned from the feed."""
+        row = self.db.connect().execute(
+            "SELECT value FROM inbox_meta WHERE key = 'changes_horizon'"
+        ).fetchone()
+        return row[0] if row else 0
+
+    def prune_changes(self, before_seq):
+        """Drops feed entries below before_seq; clients behind it get reset."""
+        before_seq = min(before_seq, self.change_seq() + 1)
+        with self.db.transaction() as conn:
+            cursor = conn.execute("DELETE FROM inbox_changes WHERE seq < ?", (before_seq,))
+            conn.execute(
+                "INSERT INTO inbox_meta (key, value) VALUES ('changes_horizon', ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)",
+                (before_seq - 1,)
+            )
+        return cursor.rowcount
+
+    # ----------------------------------------------------
+    # USAGE / RETENTION (quotas and maintenance.py)
+    # ----------------------------------------------------
+    def usage(self, receiver):
+        """Total bytes in the receiver's inbox."""
+        return self.db.connect().execute(
+            "SELECT COALESCE(SUM(size), 0) FROM inbox WHERE receiver = ?", (receiver,)
+        ).fetchone()[0]
+
+    def received_before(self, timestamp, limit=100):
+        """Oldest rows (all receivers) received before timestamp, as full rows."""
+        rows = self.db.connect().execute(
+            "SELECT * FROM inbox WHERE received_at < ? ORDER BY received_at, id LIMIT ?",
+            (timestamp, limit)
+        )
+        return [dict(row) for row in rows]
+
+    def receivers_over(self, max_bytes):
+        """{receiver: total bytes} for every inbox holding more than max_bytes."""
+        rows = self.db.connect().execute(
+            "SELECT receiver, SUM(size) AS total FROM inbox GROUP BY receiver HAVING total > ?",
+            (max_bytes,)
+        )
+        return {row["receiver"]: row["total"] for row in rows}
+
+    def oldest(self, receiver, limit=100):
+        """The receiver's oldest rows first, as full rows."""
+        rows = self.db.connect().execute(
+            "SELECT * FROM inbox WHERE receiver = ? ORDER BY received_at, id LIMIT ?",
+            (receiver, limit)
+        )
+        return [dict(row) for row in rows]
+
+    def is_empty(self):
+        return self.db.connect().execute("SELECT 1 FROM inbox LIMIT 1").fetchone() is None
+
+    def blob_ref_counts(self):
+        """{sha256: number of inbox rows referencing it} for blob-backed rows."""
+        rows = self.db.connect().execute(
+            "SELECT sha256, COUNT(*) AS refs FROM inbox WHERE blob = 1 GROUP BY sha256"
+        )
+        return {row["sha256"]: row["refs"] for row in rows}
+
+    # ----------------------------------------------------
+    # REBUILD FROM DISK
+    # ----------------------------------------------------
+    def rebuild(self, received_dir, senders=None):
+        """
+        Re-creates the legacy (blob = 0) rows from the files under
+        received_dir/<receiver>/. Blob references are the only record of who
+        received blob-stored content, so they are kept as they are.
+        senders: optional {(receiver, stored_as): sender} recovered from history.
+        Returns the number of files indexed.
+        """
+        senders = senders or {}
+        rows = []
+        if os.path.isdir(received_dir):
+            for receiver in sorted(os.listdir(received_dir)):
+                folder = os.path.join(received_dir, receiver)
+                if not os.path.isdir(folder):
+                    continue
+                for stored_as in sorted(os.listdir(folder)):
+                    path = os.path.join(folder, stored_as)
+                    if not os.path.isfile(path):
+                        continue
+                    st = os.stat(path)
+                    rows.append((
+                        receiver, stored_as, stored_as.split("_", 1)[-1],
+                        senders.get((receiver, stored_as)), st.st_size, sha256_file(path),
+                        datetime.fromtimestamp(st.st_mtime).strftime("%Y-%m-%d %H:%M:%S"),
+                    ))
+
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM inbox WHERE blob = 0")
+            conn.executemany(
+                "INSERT OR REPLACE INTO inbox "
+                "(receiver, stored_as, filename, sender, size, sha256, received_at, blob) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                rows
+            )
+            # Legacy rows were replaced wholesale: every client reloads
+            conn.execute("INSERT INTO inbox_changes (receiver, op) VALUES ('*', 'reset')")
+        return len(rows)
+
+
+def senders_from_history(db):
+    """Maps (receiver, stored_as) → sender using "received file" history rows."""
+    try:
+        rows = db.connect().execute(
+            "SELECT receiver, stored_as, sender FROM history WHERE action = 'received file'"
+        )
+    except Exception:
+        return {}
+    return {(row["receiver"], row["stored_as"]): row["sender"] for row in rows}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        print("Usage: python inbox_index.py rebuild [data_dir]")
+        sys.exit(1)
+
+    data_dir = sys.argv[2] if len(sys.argv) > 2 else "server_data"
+    db = Database(os.path.join(data_dir, "cryptport.db"))
+    index = InboxIndex(db)
+    count = index.rebuild(os.path.join(data_dir, "received"), senders_from_history(db))
+    blob_store = BlobStore(os.path.join(data_dir, "blobs"), db)
+    ChunkStore(os.path.join(data_dir, "chunks"), db, blob_store)   # releases chunks of removed blobs
+    removed = blob_store.reconcile(index.blob_ref_counts())
+    print(f"Indexed {count} received files, removed {removed} unreferenced blobs")
@@ -0,0 +1,223 @@
+"""
+Load test for the CryptPort server: requests/second vs. worker count.
+
+For each worker count, starts serve.py against a fresh temporary data
+directory, seeds one inbox, then drives it from several client processes
+(each with keep-alive connections on a few threads) with a mix of:
+    GET  /list/<user>?limit=50          (inbox index)
+    GET  /history/<user>?limit=50       (history page)
+    GET  /download/<user>/<file>        (4 KiB range)
+    POST /upload                        (small file, 1 in 10 requests)
+
+    python loadtest.py [--workers 1,2,4,8] [--duration 10] [--clients 4]
+                       [--threads 8] [--backend gunicorn]
+    python loadtest.py --url http://host:5000     (an already running server)
+
+Client processes are separate from the server, but on one machine they share
+the CPUs; use --url from another host for numbers that reflect the server alone.
+
+Reference run on a 1-CPU VM, --duration 10 --clients 2 --threads 8:
+
+    backend     workers   req/s   p50 ms   p99 ms
+    werkzeug       1       380     36.9    107.3
+    gunicorn       1       467     25.6     93.1
+    gunicorn       2       456     23.4    141.6
+    gunicorn       3       476     20.1    164.8
+    gunicorn       4       431     22.1    185.0
+
+With one CPU (shared with the clients) extra workers can only trade p99 for
+p50; worker scaling has to be measured on a multi-core host.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import http.client
+import threading
+import multiprocessing
+from urllib.parse import urlsplit
+
+SERVE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve.py")
+USER = "load@test.io"
+SEED_FILES = 20
+
+
+# ----------------------------------------------------
+# HTTP HELPERS (stdlib only, one keep-alive connection per thread)
+# ----------------------------------------------------
+def multipart(fields, filename, content):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b"\r\n"
+    )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def request(conn, method, path, body=None, headers=None):
+    conn.request(method, path, body=body, headers=headers or {})
+    response = conn.getresponse()
+    data = response.read()
+    return response.status, data
+
+
+def upload(conn, size=2048):
+    body, content_type = multipart(
+        {"receiver": USER, "sender": "loadtest@test.io"}, "load.bin", os.urandom(size)
+    )
+    return request(conn, "POST", "/upload", body, {"Content-Type": content_type})
+
+
+def wait_for(url, timeout=30):
+    parts = urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=2)
+            if request(conn, "GET", "/")[0] == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not come up")
+
+
+def seed(url):
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port)
+    for _ in range(SEED_FILES):
+        upload(conn, 64 * 1024)
+    _, data = request(conn, "GET", f"/list/{USER}?limit={SEED_FILES}")
+    return [f["stored_as"] for f in json.loads(data)["files"]]
+
+
+# ----------------------------------------------------
+# LOAD GENERATOR (runs in client processes)
+# ----------------------------------------------------
+def client_thread(url, files, deadline, latencies, errors):
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+    rng = random.Random()
+    while time.monotonic() < deadline:
+        pick = rng.random()
+        started = time.perf_counter()
+        try:
+            if pick < 0.35:
+                status, _ = request(conn, "GET", f"/list/{USER}?limit=50")
+            elif pick < 0.65:
+                status, _ = request(conn, "GET", f"/history/{USER}?limit=50")
+            elif pick < 0.9:
+                offset = rng.randrange(0, 60 * 1024)
+                status, _ = request(conn, "GET", f"/download/{USER}/{rng.choice(files)}",
+                                    headers={"Range": f"bytes={offset}-{offset + 4095}"})
+            else:
+                status, _ = upload(conn)
+        except (OSError, http.client.HTTPException):
+            status = None
+            conn.close()
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+
+        latencies.append(time.perf_counter() - started)
+        if status not in (200, 206):
+            errors.append(status)
+
+
+def client_process(url, files, duration, threads):
+    deadline = time.monotonic() + duration
+    latencies, errors = [], []
+    pool = [threading.Thread(target=client_thread, args=(url, files, deadline, latencies, errors))
+            for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return latencies, len(errors)
+
+
+def run_load(url, files, duration, clients, threads):
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.starmap(client_process, [(url, files, duration, threads)] * clients)
+
+    latencies = sorted(l for lats, _ in results for l in lats)
+    errors = sum(e for _, e in results)
+    if not latencies:
+        return {"requests": 0, "rps": 0.0, "p50_ms": 0.0, "p99_ms": 0.0, "errors": errors}
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / duration,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "errors": errors,
+    }
+
+
+# ----------------------------------------------------
+# SERVER LIFECYCLE
+# ----------------------------------------------------
+def start_server(workers, threads, backend, port):
+    data_root = tempfile.mkdtemp(prefix="cryptport-load-")
+    env = dict(os.environ, CRYPTPORT_BACKEND=backend)
+    proc = subprocess.Popen(
+        [sys.executable, SERVE, "--bind", f"127.0.0.1:{port}",
+         "--workers", str(workers), "--threads", str(threads)],
+        cwd=data_root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return proc, data_root
+
+
+def stop_server(proc, data_root):
+    proc.terminate()
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+    shutil.rmtree(data_root, ignore_errors=True)
+
+
+def report(label, result):
+    print(f"{label:>10} {result['requests']:>9} {result['rps']:>9.0f} "
+          f"{result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f} {result['errors']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4,8", help="comma-separated worker counts")
+    parser.add_argument("--threads", type=int, default=8, help="server threads per worker")
+    parser.add_argument("--backend", default="gunicorn", choices=("gunicorn", "waitress", "werkzeug"))
+    parser.add_argument("--duration", type=float, default=10, help="seconds per run")
+    parser.add_argument("--clients", type=int, default=4, help="client processes")
+    parser.add_argument("--client-threads", type=int, default=8, help="connections per client process")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--url", help="load an already running server instead")
+    args = parser.parse_args()
+
+    print(f"{'workers':>10} {'requests':>9} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+
+    if args.url:
+        files = seed(args.url)
+        report("external", run_load(args.url, files, args.duration, args.clients, args.client_threads))
+        return
+
+    for workers in [int(w) for w in args.workers.split(",")]:
+        proc, data_root = start_server(workers, args.threads, args.backend, args.port)
+        url = f"http://127.0.0.1:{args.port}"
+        try:
+            wait_for(url)
+            files = seed(url)
+            report(str(workers), run_load(url, files, args.duration, args.clients, args.client_threads))
+        finally:
+            stop_server(proc, data_root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+"""
+Background maintenance for server_data: retention, quotas, orphan sweeping
+and history compaction.
+
+Without it nothing ever expires: inboxes, history and the change feed grow
+forever, and files left behind by crashed or abandoned uploads stay on disk.
+A pass runs these steps:
+
+ - retention by age       inbox entries older than retention_days expire
+ - retention by size      inboxes above retention_bytes lose their oldest entries
+ - orphan sweeping        stale upload sessions, leftover spool files, chunks
+                          no manifest claimed, blob files without a blobs row,
+                          old manifest assembly jobs
+ - history compaction     entries older than history_days are dropped, each
+                          user keeps at most history_max_entries; the inbox
+                          change feed keeps its newest changes_keep entries
+
+Expired entries go through the inbox index like a delete: the blob loses a
+reference (and goes when it was the last), the change feed records the
+removal and the owner's history gets an "expired file" entry.
+
+Per-user quotas (quota_bytes) are enforced at upload time by check_quota();
+retention_bytes is the softer limit maintenance trims inboxes back to.
+
+Work is done in small steps (one batch of at most BATCH rows or one
+directory). The background thread runs steps for slice_seconds, then sleeps
+pause_seconds, so it never holds the database or a CPU for long. One
+process at a time runs a pass (maintenance.lock); the report of the last
+pass is written to maintenance.json for GET /maintenance/report.
+
+One full pass from the command line (no slicing):
+    python maintenance.py run [data_dir]
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+
+from locks import try_file_lock
+
+BATCH = 100
+DAY = 24 * 3600
+HISTORY_FLUSH_TIMEOUT = 30       # seconds to wait for queued history events
+
+
+class QuotaError(Exception):
+    def __init__(self, message, status=413, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+
+class MaintenancePolicy:
+    """Limits applied by Maintenance; 0 (or None) switches a limit off."""
+
+    def __init__(self, quota_bytes=0, retention_days=0, retention_bytes=0,
+                 history_days=0, history_max_entries=0, changes_keep=100000,
+                 orphan_age_seconds=DAY, upload_max_age_seconds=7 * DAY):
+        self.quota_bytes = quota_bytes
+        self.retention_days = retention_days
+        self.retention_bytes = retention_bytes
+        self.history_days = history_days
+        self.history_max_entries = history_max_entries
+        self.changes_keep = changes_keep
+        self.orphan_age_seconds = orphan_age_seconds
+        self.upload_max_age_seconds = upload_max_age_seconds
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        mb = 1024 * 1024
+        return cls(
+            quota_bytes=int(float(environ.get("CRYPTPORT_QUOTA_MB", "0")) * mb),
+            retention_days=float(environ.get("CRYPTPORT_RETENTION_DAYS", "0")),
+            retention_bytes=int(float(environ.get("CRYPTPORT_RETENTION_MB", "0")) * mb),
+            history_days=float(environ.get("CRYPTPORT_HISTORY_DAYS", "0")),
+            history_max_entries=int(environ.get("CRYPTPORT_HISTORY_MAX_ENTRIES", "0")),
+            changes_keep=int(environ.get("CRYPTPORT_CHANGES_KEEP", "100000")),
+            orphan_age_seconds=float(environ.get("CRYPTPORT_ORPHAN_AGE_HOURS", "24")) * 3600,
+            upload_max_age_seconds=float(environ.get("CRYPTPORT_UPLOAD_MAX_AGE_DAYS", "7")) * DAY,
+        )
+
+
+def timestamp_before(seconds):
+    return (datetime.now() - timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def new_report():
+    return {
+        "started": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "finished": None,
+        "busy_seconds": 0.0,
+        "expired_files": 0,         # retention by age
+        "evicted_files": 0,         # retention by size
+        "blobs_deleted": 0,
+        "stale_uploads": 0,
+        "spool_files": 0,
+        "chunks": 0,
+        "assembly_jobs": 0,
+        "orphan_blobs": 0,
+        "history_entries": 0,
+        "changes_entries": 0,
+        "bytes_reclaimed": 0,
+    }
+
+
+class Maintenance:
+    def __init__(self, data_dir, inbox_index, blob_store, chunk_store, upload_sessions,
+                 history_store, history_writer, received_dir, policy=None,
+                 interval_seconds=3600, slice_seconds=0.05, pause_seconds=0.5):
+        self.data_dir = data_dir
+        self.inbox_index = inbox_index
+        self.blob_store = blob_store
+        self.chunk_store = chunk_store
+        self.upload_sessions = upload_sessions
+        self.history_store = history_store
+        self.history_writer = history_writer
+        self.received_dir = received_dir
+        self.policy = policy or MaintenancePolicy()
+
+        self.interval_seconds = interval_seconds
+        self.slice_seconds = slice_seconds
+        self.pause_seconds = pause_seconds
+
+        self.lock_path = os.path.join(data_dir, "maintenance.lock")
+        self.report_path = os.path.join(data_dir, "maintenance.json")
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ----------------------------------------------------
+    # QUOTAS (checked on upload)
+    # ----------------------------------------------------
+    def check_quota(self, receivers, size):
+        """Raises QuotaError if size more bytes would put any receiver (sanitized) over quota."""
+        quota = self.policy.quota_bytes
+        if not quota:
+            return
+        over = [r for r in receivers if self.inbox_index.usage(r) + size > quota]
+        if over:
+            raise QuotaError("Receiver inbox quota exceeded", over_quota=over, quota_bytes=quota)
+
+    # ----------------------------------------------------
+    # BACKGROUND THREAD
+    # ----------------------------------------------------
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="maintenance", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        # Don't compete with startup; then one pass per interval
+        while not self._stop.wait(min(60, self.interval_seconds)):
+            if time.time() - self._last_finished() >= self.interval_seconds:
+                try:
+                    self.run_pass(self.slice_seconds, self.pause_seconds)
+                except Exception as e:
+                    print("Maintenance pass failed:", e)
+
+    def _last_finished(self):
+        try:
+            return os.path.getmtime(self.report_path)
+        except OSError:
+            return 0
+
+    def run_pass(self, slice_seconds=None, pause_seconds=0.0):
+        """
+        Runs every step once; with slice_seconds, sleeps pause_seconds after
+        each slice of work. Returns the report, or None if another process
+        is already running a pass.
+        """
+        with try_file_lock(self.lock_path) as locked:
+            if not locked:
+                return None
+            report = new_report()
+            slice_started = time.monotonic()
+            for _ in self._steps(report):
+                elapsed = time.monotonic() - slice_started
+                if slice_seconds is not None and elapsed >= slice_seconds:
+                    report["busy_seconds"] += elapsed
+                    if self._stop.wait(pause_seconds):
+                        break
+                    slice_started = time.monotonic()
+            report["busy_seconds"] = round(report["busy_seconds"] + time.monotonic() - slice_started, 3)
+            report["finished"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self._save_report(report)
+            return report
+
+    def _save_report(self, report):
+        tmp = self.report_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(report, f)
+        os.replace(tmp, self.report_path)
+
+    def last_report(self):
+        try:
+            with open(self.report_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # ----------------------------------------------------
+    # STEPS (each yield ends one small unit of work)
+    # ----------------------------------------------------
+    def _steps(self, report):
+        yield from self._expire_by_age(report)
+        yield from self._expire_by_size(report)
+        yield from self._sweep_uploads(report)
+        yield from self._sweep_spools(report)
+        yield from self._sweep_chunks(report)
+        yield from self._sweep_blob_files(report)
+        yield from self._compact_history(report)
+        yield from self._prune_changes(report)
+
+    def _expire(self, item, action, report):
+        """Removes one inbox entry the way a delete does; logs it for the owner."""
+        receiver, stored_as = item["receiver"], item["stored_as"]
+        if self.inbox_index.remove(receiver, stored_as) is None:
+            return False        # deleted meanwhile
+        if item["blob"]:
+            if self.blob_store.release(item["sha256"]):
+                report["blobs_deleted"] += 1
+                report["bytes_reclaimed"] += item["size"]
+        else:
+            path = os.path.join(self.received_dir, receiver, stored_as)
+            if os.path.exists(path):
+                os.remove(path)
+                report["bytes_reclaimed"] += item["size"]
+
+        self.history_writer.submit(receiver, {
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "action": action,
+            "filename": item["filename"],
+            "stored_as": stored_as,
+            "sender": item["sender"],
+        })
+        return True
+
+    def _expire_by_age(self, report):
+        if not self.policy.retention_days:
+            return
+        cutoff = timestamp_before(self.policy.retention_days * DAY)
+        while True:
+            items = self.inbox_index.received_before(cutoff, BATCH)
+            for item in items:
+                report["expired_files"] += self._expire(item, "expired file", report)
+            yield
+            if len(items) < BATCH:
+                return
+
+    def _expire_by_size(self, report):
+        limit = self.policy.retention_bytes
+        if not limit:
+            return
+        for receiver, total in self.inbox_index.receivers_over(limit).items():
+            while total > limit:
+                items = self.inbox_index.oldest(receiver, BATCH)
+                if not items:
+                    break
+                for item in items:
+                    if total <= limit:
+                        break
+                    if self._expire(item, "expired file (inbox size limit)", report):
+                        report["evicted_files"] += 1
+                        total -= item["size"]
+                yield
+
+    def _sweep_uploads(self, report):
+        sessions, freed = self.upload_sessions.sweep(self.policy.upload_max_age_seconds)
+        report["stale_uploads"] += sessions
+        report["bytes_reclaimed"] += freed
+        yield
+
+    def _sweep_spools(self, report):
+        """Spool files of uploads that died mid-request (blobs/tmp, chunks/tmp)."""
+        cutoff = time.time() - self.policy.orphan_age_seconds
+        for tmp_dir in (self.blob_store.tmp_dir, self.chunk_store.tmp_dir):
+            with os.scandir(tmp_dir) as entries:
+                for count, entry in enumerate(entries, 1):
+                    try:
+                        st = entry.stat()
+                        if entry.is_file() and st.st_mtime < cutoff:
+                            os.remove(entry.path)
+                            report["spool_files"] += 1
+                            report["bytes_reclaimed"] += st.st_size
+                    except OSError:
+                        pass
+                    if count % BATCH == 0:
+                        yield
+            yield
+
+    def _sweep_chunks(self, report):
+        while True:
+            removed = self.chunk_store.sweep(self.policy.orphan_age_seconds, limit=BATCH)
+            report["chunks"] += removed
+            yield
+            if removed < BATCH:
+                break
+        # Clients poll a job for minutes at most; a day-old one is long forgotten
+        report["assembly_jobs"] += self.chunk_store.sweep_jobs(DAY)
+        yield
+
+    def _sweep_blob_files(self, report):
+        """
+        Files under blobs/ab/cd/ with no blobs row (a crash between the
+        rename and the commit in BlobStore._adopt). One directory per step.
+        """
+        cutoff = time.time() - self.policy.orphan_age_seconds
+        root = self.blob_store.root
+        conn = self.blob_store.db.connect()
+        for top in sorted(os.listdir(root)):
+            if len(top) != 2 or not os.path.isdir(os.path.join(root, top)):
+                continue
+            for sub in sorted(os.listdir(os.path.join(root, top))):
+                folder = os.path.join(root, top, sub)
+                if not os.path.isdir(folder):
+                    continue
+                names = [name for name in os.listdir(folder) if len(name) == 64]
+                known = set()
+                for i in range(0, len(names), 500):
+                    batch = names[i:i + 500]
+                    rows = conn.execute(
+                        f"SELECT sha256 FROM blobs WHERE sha256 IN ({','.join('?' * len(batch))})", batch
+                    )
+                    known.update(row["sha256"] for row in rows)
+                for name in names:
+                    if name in known:
+                        continue
+                    path = os.path.join(folder, name)
+                    try:
+                        st = os.stat(path)
+                        # ctime: the rename into place, even for an old .part
+                        if max(st.st_mtime, st.st_ctime) < cutoff:
+                            os.remove(path)
+                            report["orphan_blobs"] += 1
+                            report["bytes_reclaimed"] += st.st_size
+                    except OSError:
+                        pass
+                yield
+
+    def _compact_history(self, report):
+        # Queued events must be in the table before anything is counted
+        if not self.history_writer.flush(timeout=HISTORY_FLUSH_TIMEOUT):
+            print("Maintenance: history writer is behind, skipping history compaction")
+            return
+
+        if self.policy.history_days:
+            cutoff = timestamp_before(self.policy.history_days * DAY)
+            after_id = 0
+            while after_id is not None:
+                deleted, after_id = self.history_store.delete_older_than(cutoff, after_id, BATCH * 5)
+                report["history_entries"] += deleted
+                yield
+
+        keep = self.policy.history_max_entries
+        if keep:
+            for receiver in self.history_store.receivers_over(keep):
+                while True:
+                    deleted = self.history_store.trim(receiver, keep, BATCH * 5)
+                    report["history_entries"] += deleted
+                    yield
+                    if deleted < BATCH * 5:
+                        break
+
+    def _prune_changes(self, report):
+        if not self.policy.changes_keep:
+            return
+        target = self.inbox_index.change_seq() - self.policy.changes_keep + 1
+        horizon = self.inbox_index.changes_horizon()
+        while horizon + 1 < target:
+            before = min(target, horizon + 1 + BATCH * 50)
+            report["changes_entries"] += self.inbox_index.prune_changes(before)
+            horizon = before - 1
+            yield
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "run":
+        print("Usage: python maintenance.py run [data_dir]")
+        sys.exit(1)
+
+    from database import Database
+    from history_store import HistoryStore, HistoryWriter
+    from inbox_index import InboxIndex
+    from blob_store import BlobStore
+    from chunk_store import ChunkStore
+    from upload_sessions import UploadSessions
+
+    data_dir = sys.argv[2] if len(sys.argv) > 2 else "server_data"
+    db = Database(os.path.join(data_dir, "cryptport.db"))
+    history_store = HistoryStore(db)
+    history_writer = HistoryWriter(history_store)
+    blob_store = BlobStore(os.path.join(data_dir, "blobs"), db)
+    maintenance = Maintenance(
+        data_dir, InboxIndex(db), blob_store, ChunkStore(os.path.join(data_dir, "chunks"), db, blob_store),
+        UploadSessions(os.path.join(data_dir, "uploads")), history_store, history_writer,
+        os.path.join(data_dir, "received"), MaintenancePolicy.from_env(),
+    )
+    report = maintenance.run_pass()
+    history_writer.close()
+    if report is None:
+        print("Another process is running maintenance")
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,303 @@
+"""
+In-process metrics for the CryptPort server, exposed as Prometheus text
+on GET /metrics.
+
+Counters, gauges and histograms are plain dicts keyed by label values,
+guarded by one lock per metric: an observation is a bisect and a few
+additions (about a microsecond), cheap enough to stay on in production.
+
+Under a multi-worker runner (serve.py) every process has its own numbers.
+MetricsExporter writes each process's snapshot to server_data/metrics/
+<pid>.json every few seconds; /metrics merges the live snapshot of the
+answering process with the others' files, so a scrape sees the whole
+server whichever worker it lands on. A file that has not been rewritten for
+a few intervals belongs to a worker that has exited: its counters and
+histograms are folded into retired.json and the file is removed, so
+counters never go backwards and the directory holds only live workers.
+
+    from metrics import Histogram
+    LATENCY = Histogram("cryptport_x_seconds", "Time spent on x", ("op",))
+    with LATENCY.time("read"):
+        ...
+"""
+
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from locks import file_lock
+
+# Request latencies: 1 ms … 30 s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Disk writes and commits: 10 µs … 1 s
+FAST_BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 0.25, 1)
+
+REGISTRY = []
+
+
+# ----------------------------------------------------
+# METRIC TYPES
+# ----------------------------------------------------
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}           # label values → value
+        REGISTRY.append(self)
+
+    def snapshot(self):
+        with self._lock:
+            values = [[list(labels), value] for labels, value in self._values.items()]
+        return {"kind": self.kind, "help": self.help, "labels": list(self.label_names), "values": values}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, by=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + by
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def add(self, *labels, by=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + by
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # Per-bucket (not cumulative) counts, +Inf last; then sum
+                entry = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[index] += 1
+            entry[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def snapshot(self):
+        with self._lock:
+            values = [[list(labels), list(entry)] for labels, entry in self._values.items()]
+        return {"kind": self.kind, "help": self.help, "labels": list(self.label_names),
+                "buckets": list(self.buckets), "values": values}
+
+
+# ----------------------------------------------------
+# SNAPSHOTS / MERGING / TEXT FORMAT
+# ----------------------------------------------------
+def snapshot():
+    return {metric.name: metric.snapshot() for metric in REGISTRY}
+
+
+def merge(snapshots):
+    """Sums several processes' snapshots metric by metric, label set by label set."""
+    merged = {}
+    for snap in snapshots:
+        for name, metric in snap.items():
+            target = merged.setdefault(name, {**metric, "values": {}})
+            for labels, value in metric["values"]:
+                key = tuple(labels)
+                current = target["values"].get(key)
+                if current is None:
+                    target["values"][key] = value
+                elif isinstance(value, list):
+                    target["values"][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target["values"][key] = current + value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(merged):
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        names = metric["labels"]
+        for labels in sorted(metric["values"], key=lambda key: [str(v) for v in key]):
+            value = metric["values"][labels]
+            if metric["kind"] != "histogram":
+                lines.append(f"{name}{_label_text(names, labels)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric["buckets"]) + [float("inf")], value[:-1]):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{name}_bucket{_label_text(names, labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_label_text(names, labels)} {_number(value[-1])}")
+            lines.append(f"{name}_count{_label_text(names, labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+# ----------------------------------------------------
+# MULTI-PROCESS EXPORT
+# ----------------------------------------------------
+RETIRED = "retired.json"
+
+
+def _as_snapshot(merged):
+    """merge() output back to the snapshot() layout, for writing to a file."""
+    return {name: {**metric, "values": [[list(labels), value] for labels, value in metric["values"].items()]}
+            for name, metric in merged.items()}
+
+
+class MetricsExporter:
+    def __init__(self, directory, interval=5.0):
+        self.directory = directory
+        self.interval = interval
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, "metrics.lock")
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            # A file under our pid is from an earlier process that had it
+            path = self._path(os.getpid())
+            with file_lock(self._lock_path):
+                if os.path.exists(path):
+                    self._retire([path])
+            self._thread = threading.Thread(target=self._run, name="metrics-exporter", daemon=True)
+            self._thread.start()
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.write()
+            except OSError as e:
+                print("Metrics snapshot write failed:", e)
+
+    def write(self):
+        path = self._path(os.getpid())
+        with open(path + ".tmp", "w") as f:
+            json.dump(snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+    def _load(self, path):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _retire(self, paths):
+        """Folds exited workers' files into retired.json (without gauges), then removes them."""
+        retired_path = os.path.join(self.directory, RETIRED)
+        snapshots = [self._load(retired_path) or {}]
+        for path in paths:
+            snap = self._load(path) or {}
+            snapshots.append({name: metric for name, metric in snap.items() if metric["kind"] != "gauge"})
+        with open(retired_path + ".tmp", "w") as f:
+            json.dump(_as_snapshot(merge(snapshots)), f)
+        os.replace(retired_path + ".tmp", retired_path)
+        for path in paths:
+            os.remove(path)
+
+    def collect(self):
+        """Prometheus text for this process plus every other live worker."""
+        pid = os.getpid()
+        stale = time.time() - self.interval * 6
+        snapshots = [snapshot()]
+        # Held so a file is never counted both on its own and in retired.json
+        with file_lock(self._lock_path):
+            exited = []
+            for name in os.listdir(self.directory):
+                if not name.endswith(".json") or name in (f"{pid}.json", RETIRED):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    if os.path.getmtime(path) < stale:
+                        exited.append(path)
+                        continue
+                except OSError:
+                    continue
+                snap = self._load(path)
+                if snap is not None:
+                    snapshots.append(snap)
+            if exited:
+                try:
+                    self._retire(exited)
+                except OSError as e:
+                    print("Retiring metrics of exited workers failed:", e)
+            snapshots.append(self._load(os.path.join(self.directory, RETIRED)) or {})
+        return render(merge(snapshots))
+
+
+# ----------------------------------------------------
+# CRYPTPORT METRICS
+#   Request metrics are recorded by server.py (Flask hooks) and
+#   asgi_server.py (dispatcher); route is the URL rule, not the raw path
+# ----------------------------------------------------
+HTTP_REQUESTS = Counter(
+    "cryptport_http_requests_total", "Requests handled", ("route", "method", "status"))
+HTTP_LATENCY = Histogram(
+    "cryptport_http_request_duration_seconds",
+    "Time until the response starts (WSGI) or is fully sent (ASGI)", ("route", "method"))
+HTTP_IN_FLIGHT = Gauge(
+    "cryptport_http_requests_in_flight", "Requests being handled; open /events streams count until they close", ("route",))
+HTTP_BYTES_IN = Counter(
+    "cryptport_http_request_bytes_total", "Request body bytes (Content-Length)", ("route",))
+HTTP_BYTES_OUT = Counter(
+    "cryptport_http_response_bytes_total", "Response body bytes (Content-Length)", ("route",))
+
+HISTORY_LOAD = Histogram(
+    "cryptport_history_load_seconds", "History reads (full list or one page)", ("kind",))
+HISTORY_COMMIT = Histogram(
+    "cryptport_history_commit_seconds", "HistoryWriter batch commits", buckets=FAST_BUCKETS)
+HISTORY_EVENTS = Counter(
+    "cryptport_history_events_total", "History events committed")
+HISTORY_WRITE_ERRORS = Counter(
+    "cryptport_history_write_errors_total", "HistoryWriter batch commits that failed (and are retried)")
+
+DISK_WRITE = Histogram(
+    "cryptport_disk_write_seconds", "Disk writes and commits of stored content", ("op",), buckets=FAST_BUCKETS)
+DISK_WRITE_BYTES = Counter(
+    "cryptport_disk_write_bytes_total", "Bytes written to disk", ("op",))
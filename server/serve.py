@@ -0,0 +1,135 @@
+"""
+Production entry point for the CryptPort server.
+
+server.py's app.run(debug=True) is the single-process Werkzeug development
+server. This runs the same Flask app under a real WSGI server:
+
+ - gunicorn (Linux/macOS): N worker processes × T threads each
+ - waitress (Windows, no fork): one process with T threads
+
+    python serve.py [--bind 0.0.0.0:5000] [--workers 4] [--threads 8]
+                    [--keepalive 5] [--timeout 120] [--backend gunicorn]
+
+Every option can also come from the environment (CRYPTPORT_BIND,
+CRYPTPORT_WORKERS, CRYPTPORT_THREADS, CRYPTPORT_KEEPALIVE, CRYPTPORT_TIMEOUT,
+CRYPTPORT_BACKEND). Install the backend you use: pip install gunicorn / waitress.
+
+Shared state across workers:
+ - history, inbox index, blobs and chunks live in SQLite (WAL, BEGIN
+   IMMEDIATE write transactions, busy timeout), so any worker can serve
+   any request
+ - upload sessions are files guarded by a per-session lock file (locks.py)
+ - startup migrations run under server_data/startup.lock
+ - each worker has its own HistoryWriter; with more than one worker a
+   history read waits for events other workers still hold for that user
+   (marker files in server_data/history_pending/; CRYPTPORT_WORKERS is
+   exported for server.py to tell)
+
+The app is imported after fork (no preload), so every worker starts its own
+SQLite connections and history writer thread.
+"""
+
+import os
+import sys
+import argparse
+
+BACKENDS = ("gunicorn", "waitress", "werkzeug")
+
+
+def default_workers():
+    return (os.cpu_count() or 1) * 2 + 1
+
+
+def parse_args(argv=None):
+    env = os.environ.get
+    parser = argparse.ArgumentParser(description="Run the CryptPort server with a production WSGI server.")
+    parser.add_argument("--bind", default=env("CRYPTPORT_BIND", "127.0.0.1:5000"),
+                        help="host:port to listen on")
+    parser.add_argument("--workers", type=int, default=int(env("CRYPTPORT_WORKERS", default_workers())),
+                        help="worker processes (gunicorn only)")
+    parser.add_argument("--threads", type=int, default=int(env("CRYPTPORT_THREADS", "8")),
+                        help="request threads per worker")
+    parser.add_argument("--keepalive", type=int, default=int(env("CRYPTPORT_KEEPALIVE", "5")),
+                        help="seconds an idle keep-alive connection stays open (gunicorn)")
+    parser.add_argument("--timeout", type=int, default=int(env("CRYPTPORT_TIMEOUT", "120")),
+                        help="seconds before a silent worker (gunicorn) or idle channel (waitress) is dropped")
+    parser.add_argument("--backend", choices=BACKENDS,
+                        default=env("CRYPTPORT_BACKEND", "waitress" if os.name == "nt" else "gunicorn"),
+                        help="werkzeug is the threaded dev server, for comparison only")
+    return parser.parse_args(argv)
+
+
+def split_bind(bind):
+    host, _, port = bind.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+# ----------------------------------------------------
+# BACKENDS
+# ----------------------------------------------------
+def run_gunicorn(args):
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        sys.exit("gunicorn is not installed: pip install gunicorn")
+
+    def worker_exit(server, worker):
+        # Commit this worker's queued history events before it goes away
+        cryptport = sys.modules.get("server")
+        if cryptport is not None:
+            cryptport.history_writer.close()
+
+    class CryptPortApplication(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from server import app
+            return app
+
+    CryptPortApplication({
+        "bind": args.bind,
+        "workers": args.workers,
+        "threads": args.threads,
+        "worker_class": "gthread",
+        "keepalive": args.keepalive,
+        "timeout": args.timeout,
+        "graceful_timeout": 30,
+        "preload_app": False,
+        "worker_exit": worker_exit,
+    }).run()
+
+
+def run_waitress(args):
+    try:
+        from waitress import serve
+    except ImportError:
+        sys.exit("waitress is not installed: pip install waitress")
+
+    from server import app
+    if args.workers > 1:
+        print("waitress runs a single process; use --threads to scale")
+    host, port = split_bind(args.bind)
+    serve(app, host=host, port=port, threads=args.threads, channel_timeout=args.timeout,
+          connection_limit=max(100, args.threads * 16))
+
+
+def run_werkzeug(args):
+    from werkzeug.serving import run_simple
+    from server import app
+    host, port = split_bind(args.bind)
+    run_simple(host, port, app, threaded=True)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # Read by server.py in every worker, after fork
+    os.environ["CRYPTPORT_WORKERS"] = str(args.workers if args.backend == "gunicorn" else 1)
+    print(f"🚀 CryptPort server ({args.backend}) on http://{args.bind} — "
+          f"workers={args.workers if args.backend == 'gunicorn' else 1} threads={args.threads}")
+    {"gunicorn": run_gunicorn, "waitress": run_waitress, "werkzeug": run_werkzeug}[args.backend](args)
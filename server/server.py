@@ -1,11 +1,37 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Request, Response, request, jsonify, g
 from werkzeug.utils import secure_filename
 import os
+import json
+import time
 import uuid
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import json
+
+from database import Database
+from history_store import HistoryStore, HistoryWriter, migrate_json_dir
+from inbox_index import InboxIndex, senders_from_history
+from blob_store import BlobStore, BlobSpool
+from chunk_store import ChunkStore, ChunkError
+from upload_sessions import UploadSessions, UploadError
+from file_response import send_file_ranged
+from locks import file_lock
+from inbox_events import InboxNotifier
+from maintenance import Maintenance, MaintenancePolicy, QuotaError
+from metrics import (
+    MetricsExporter, HTTP_REQUESTS, HTTP_LATENCY, HTTP_IN_FLIGHT, HTTP_BYTES_IN, HTTP_BYTES_OUT, HISTORY_LOAD
+)
+
+
+class CryptPortRequest(Request):
+    """Spools multipart file parts straight into the blob store, hashing on write."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return blob_store.spool()
+
 
 app = Flask(__name__)
+app.request_class = CryptPortRequest
 
 # ----------------------------------------------------
 # DIRECTORIES
@@ -13,10 +39,68 @@ app = Flask(__name__)
 DATA_DIR = "server_data"
 RECEIVED_DIR = os.path.join(DATA_DIR, "received")
 HISTORY_DIR = os.path.join(DATA_DIR, "history")
+UPLOADS_DIR = os.path.join(DATA_DIR, "uploads")
+BLOBS_DIR = os.path.join(DATA_DIR, "blobs")
+CHUNKS_DIR = os.path.join(DATA_DIR, "chunks")
+METRICS_DIR = os.path.join(DATA_DIR, "metrics")
+DB_PATH = os.path.join(DATA_DIR, "cryptport.db")
+
+# History writer tuning (group-commit window, batch cap, fsync policy)
+HISTORY_FLUSH_INTERVAL = float(os.environ.get("CRYPTPORT_HISTORY_FLUSH_MS", "50")) / 1000
+HISTORY_MAX_BATCH = int(os.environ.get("CRYPTPORT_HISTORY_MAX_BATCH", "500"))
+HISTORY_FSYNC = os.environ.get("CRYPTPORT_HISTORY_FSYNC", "batch")
+
+# Set by serve.py / asgi_server.py. With several worker processes a history
+# read can land on a worker that never queued the caller's events, so the
+# writers share pending markers and a read waits for the other workers' commits
+MULTI_PROCESS = int(os.environ.get("CRYPTPORT_WORKERS", "1")) > 1
+HISTORY_PENDING_DIR = os.path.join(DATA_DIR, "history_pending")
+
+# Background maintenance (maintenance.py): minutes between passes, off switch;
+# quota / retention limits are read by MaintenancePolicy.from_env()
+MAINTENANCE_INTERVAL = float(os.environ.get("CRYPTPORT_MAINTENANCE_INTERVAL_MIN", "60")) * 60
+MAINTENANCE_ENABLED = os.environ.get("CRYPTPORT_MAINTENANCE", "on") != "off"
 
 os.makedirs(RECEIVED_DIR, exist_ok=True)
 os.makedirs(HISTORY_DIR, exist_ok=True)
 
+# Every worker process of serve.py imports this module; schema creation and
+# the one-shot migrations below run in one process at a time
+with file_lock(os.path.join(DATA_DIR, "startup.lock")):
+    db = Database(DB_PATH)
+    history_store = HistoryStore(db)
+    history_writer = HistoryWriter(
+        history_store,
+        flush_interval=HISTORY_FLUSH_INTERVAL,
+        max_batch=HISTORY_MAX_BATCH,
+        fsync=HISTORY_FSYNC,
+        pending_dir=HISTORY_PENDING_DIR if MULTI_PROCESS else None,
+    )
+    inbox_index = InboxIndex(db)
+    blob_store = BlobStore(BLOBS_DIR, db)
+    chunk_store = ChunkStore(CHUNKS_DIR, db, blob_store)
+    upload_sessions = UploadSessions(UPLOADS_DIR)
+    inbox_notifier = InboxNotifier(inbox_index)
+
+    # One-shot import of any pre-SQLite <user>.json history files
+    migrate_json_dir(HISTORY_DIR, history_store)
+
+    # Index files received before the inbox index existed
+    if inbox_index.is_empty() and any(os.scandir(RECEIVED_DIR)):
+        inbox_index.rebuild(RECEIVED_DIR, senders_from_history(db))
+
+maintenance = Maintenance(
+    DATA_DIR, inbox_index, blob_store, chunk_store, upload_sessions,
+    history_store, history_writer, RECEIVED_DIR,
+    policy=MaintenancePolicy.from_env(),
+    interval_seconds=MAINTENANCE_INTERVAL,
+)
+if MAINTENANCE_ENABLED:
+    maintenance.start()
+
+metrics_exporter = MetricsExporter(METRICS_DIR)
+metrics_exporter.start()
+
 
 # ----------------------------------------------------
 # HELPERS
@@ -33,28 +117,149 @@ def now_ts():
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
 
+def new_stored_name(filename):
+    """Returns (file_id, safe filename, stored_as)."""
+    file_id = str(uuid.uuid4())
+    filename = secure_filename(filename)
+    return file_id, filename, f"{file_id}_{filename}"
+
+
+# A multi-recipient upload names every receiver at once, either as repeated
+# "receiver" fields / a JSON list, or as one comma-separated string
+MAX_RECEIVERS = 1000
+
+
+def parse_receivers(data):
+    """Returns the de-duplicated receiver emails of a form or JSON body."""
+    if hasattr(data, "getlist"):
+        values = data.getlist("receiver") + data.getlist("receivers")
+    else:
+        values = [data.get("receiver"), data.get("receivers")]
+
+    receivers, seen = [], set()
+    for value in values:
+        for email in (value if isinstance(value, list) else str(value or "").split(",")):
+            email = str(email).strip()
+            if email and sanitize_email(email) not in seen:
+                seen.add(sanitize_email(email))
+                receivers.append(email)
+    return receivers
+
+
+def receivers_error(receivers):
+    """Error message for a bad receiver list, or None."""
+    if not receivers:
+        return "Missing receiver"
+    if len(receivers) > MAX_RECEIVERS:
+        return f"Too many receivers (max {MAX_RECEIVERS})"
+    return None
+
+
+def resolve_received(receiver, stored_as):
+    """
+    Returns (path, etag) for a received file, or (None, None).
+    Blob-backed entries use the content hash as a strong ETag.
+    """
+    item = inbox_index.get(sanitize_email(receiver), stored_as)
+    if item and item["blob"]:
+        return blob_store.path(item["sha256"]), f'"{item["sha256"]}"'
+
+    path = os.path.join(RECEIVED_DIR, sanitize_email(receiver), stored_as)
+    if os.path.exists(path):
+        return path, None
+    return None, None
+
+
 # ----------------------------------------------------
 # HISTORY UTILS
+#   Backed by SQLite (history_store.py). Writes are queued to the background
+#   HistoryWriter; reads first flush the caller's own queued events.
 # ----------------------------------------------------
-def history_file(email):
-    safe_email = sanitize_email(email)
-    return os.path.join(HISTORY_DIR, f"{safe_email}.json")
+def load_user_history(email):
+    receiver = sanitize_email(email)
+    history_writer.sync(receiver)
+    with HISTORY_LOAD.time("full"):
+        return history_store.list(receiver)
 
 
-def load_user_history(email):
-    safe_email = sanitize_email(email)
-    path = history_file(email)
-    if not os.path.exists(path):
-        return []
-    with open(path, "r") as f:
-        return json.load(f)
+def append_history(email, entry):
+    history_writer.submit(sanitize_email(email), entry)
 
 
-def save_user_history(email, history_list):
-    safe_email = sanitize_email(email)
-    path = history_file(email)
-    with open(path, "w") as f:
-        json.dump(history_list, f, indent=4)
+def record_received(receivers, sender, filename, stored_as, size, sha256):
+    """
+    Adds a blob reference to each receiver's inbox and logs it. The caller
+    holds one blob reference per receiver; all inbox rows share stored_as.
+    Over quota, those references are dropped and QuotaError is raised.
+    """
+    keys = [sanitize_email(receiver) for receiver in receivers]
+    try:
+        maintenance.check_quota(keys, size)
+    except QuotaError:
+        blob_store.release(sha256, refs=len(receivers))
+        raise
+
+    timestamp = now_ts()
+    inbox_index.add_many(keys, stored_as, filename, sender, size, sha256, timestamp)
+    inbox_notifier.notify()
+    for receiver in receivers:
+        append_history(receiver, {
+            "timestamp": timestamp,
+            "action": "received file",
+            "filename": filename,
+            "stored_as": stored_as,
+            "sender": sender
+        })
+
+
+def upload_payload(file_id, filename, stored_as, receivers, **extra):
+    return {
+        "status": "success",
+        "file_id": file_id,
+        "stored_as": stored_as,
+        "original_filename": filename,
+        "receivers": receivers,
+        **extra
+    }
+
+
+def upload_result(file_id, filename, stored_as, receivers, **extra):
+    return jsonify(upload_payload(file_id, filename, stored_as, receivers, **extra)), 200
+
+
+# ----------------------------------------------------
+# REQUEST METRICS (see metrics.py, GET /metrics)
+#   Labelled by URL rule ("/download/<receiver>/<filename>"), so the
+#   number of series stays fixed; unmatched paths share one label
+# ----------------------------------------------------
+@app.before_request
+def metrics_start():
+    g.metrics_route = request.url_rule.rule if request.url_rule else "<unmatched>"
+    g.metrics_started = time.perf_counter()
+    HTTP_IN_FLIGHT.add(g.metrics_route)
+    if request.content_length:
+        HTTP_BYTES_IN.inc(g.metrics_route, by=request.content_length)
+
+
+@app.after_request
+def metrics_response(response):
+    route = g.get("metrics_route", "<unmatched>")
+    HTTP_REQUESTS.inc(route, request.method, str(response.status_code))
+    if response.content_length:
+        HTTP_BYTES_OUT.inc(route, by=response.content_length)
+    return response
+
+
+@app.teardown_request
+def metrics_finish(exc):
+    # An unhandled exception's 500 response already went through
+    # metrics_response, so only latency and in-flight are settled here
+    started = g.pop("metrics_started", None)
+    if started is None:
+        return
+    route = g.metrics_route
+    HTTP_IN_FLIGHT.add(route, by=-1)
+    HTTP_LATENCY.observe(time.perf_counter() - started, route, request.method)
 
 
 # ----------------------------------------------------
@@ -67,6 +272,8 @@ def home():
 
 # ----------------------------------------------------
 # 1️⃣ FILE UPLOAD
+#   receiver may list several emails (repeated field or comma-separated):
+#   the body is stored once and delivered to every inbox
 # ----------------------------------------------------
 @app.route("/upload", methods=["POST"])
 def upload():
@@ -74,105 +281,536 @@ def upload():
         return jsonify({"error": "No file provided"}), 400
 
     file = request.files["file"]
-    receiver = request.form.get("receiver")
+    receivers = parse_receivers(request.form)
     sender = request.form.get("sender")
 
-    if not receiver:
-        return jsonify({"error": "Missing receiver"}), 400
+    error = receivers_error(receivers)
+    if error:
+        return jsonify({"error": error}), 400
 
-    # Safe folder name
-    safe_receiver = sanitize_email(receiver)
-    receiver_dir = os.path.join(RECEIVED_DIR, safe_receiver)
-    os.makedirs(receiver_dir, exist_ok=True)
+    file_id, filename, stored_as = new_stored_name(file.filename)
 
-    file_id = str(uuid.uuid4())
-    filename = secure_filename(file.filename)
-    stored_as = f"{file_id}_{filename}"
+    # The body was hashed while it streamed into the spool; identical content
+    # already in the store just gains references instead of a second copy
+    if isinstance(file.stream, BlobSpool):
+        sha256, size = blob_store.commit_spool(file.stream, refs=len(receivers))
+    else:
+        sha256, size = blob_store.ingest_stream(file.stream, refs=len(receivers))
 
-    save_path = os.path.join(receiver_dir, stored_as)
-    file.save(save_path)
+    # Save inbox index + history
+    record_received(receivers, sender, filename, stored_as, size, sha256)
 
-    # Save history
-    history = load_user_history(receiver)
-    history.append({
-        "timestamp": now_ts(),
-        "action": "received file",
-        "filename": filename,
-        "stored_as": stored_as,
-        "sender": sender
-    })
-    save_user_history(receiver, history)
+    return upload_result(file_id, filename, stored_as, receivers)
+
+
+# ----------------------------------------------------
+# 1️⃣a DEDUP PRE-CHECK
+#   GET/HEAD /blobs/<sha256> → 200 if the server already stores that content
+#   POST /upload/ref         → new inbox entry pointing at an existing blob
+# Note: anyone who knows a content hash can reference that content, which is
+# why clients upload encrypted (.enc) files.
+# ----------------------------------------------------
+def valid_sha256(value):
+    return len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+
+@app.route("/blobs/<sha256>", methods=["GET"])
+def blob_exists(sha256):
+    sha256 = sha256.lower()
+    blob = blob_store.get(sha256) if valid_sha256(sha256) else None
+    if blob is None:
+        return jsonify({"exists": False}), 404
+    return jsonify({"exists": True, "sha256": sha256, "size": blob["size"]})
+
+
+@app.route("/upload/ref", methods=["POST"])
+def upload_ref():
+    data = request.get_json(silent=True) or request.form
+    sha256 = (data.get("sha256") or "").lower()
+    receivers = parse_receivers(data)
+
+    error = receivers_error(receivers)
+    if error:
+        return jsonify({"error": error}), 400
+    if not data.get("filename"):
+        return jsonify({"error": "Missing filename"}), 400
+    if not valid_sha256(sha256) or not blob_store.add_refs(sha256, len(receivers)):
+        return jsonify({"error": "Unknown content hash", "exists": False}), 404
+
+    file_id, filename, stored_as = new_stored_name(data["filename"])
+    record_received(receivers, data.get("sender"), filename, stored_as, blob_store.get(sha256)["size"], sha256)
+
+    return upload_result(file_id, filename, stored_as, receivers, deduplicated=True)
+
+
+# ----------------------------------------------------
+# 1️⃣b RESUMABLE CHUNKED UPLOAD
+#   POST   /upload/init               → upload_id
+#   GET    /upload/<id>               → bytes received so far
+#   PUT    /upload/<id>?offset=N      → raw chunk body, written at offset
+#   POST   /upload/<id>/complete      → finalise + history entry
+#   DELETE /upload/<id>               → abort
+# ----------------------------------------------------
+@app.errorhandler(UploadError)
+@app.errorhandler(QuotaError)
+def upload_error(e):
+    return jsonify({"error": str(e), **e.extra}), e.status
+
+
+@app.route("/upload/init", methods=["POST"])
+def upload_init():
+    data = request.get_json(silent=True) or request.form
+    receivers = parse_receivers(data)
+    filename = data.get("filename")
+    size = data.get("size")
+
+    error = receivers_error(receivers)
+    if error:
+        return jsonify({"error": error}), 400
+    if not filename:
+        return jsonify({"error": "Missing filename"}), 400
+    if size is not None:
+        try:
+            size = int(str(size))         # str(): 1.5 and true are not sizes
+        except ValueError:
+            size = -1
+        if size < 0:
+            return jsonify({"error": "size must be a non-negative integer"}), 400
+        # Fail before any bytes are sent; /complete checks again
+        maintenance.check_quota([sanitize_email(r) for r in receivers], size)
+
+    session = upload_sessions.create(receivers, data.get("sender"), filename, size)
+    return jsonify(session), 201
+
+
+@app.route("/upload/<upload_id>", methods=["GET"])
+def upload_status(upload_id):
+    return jsonify(upload_sessions.status(upload_id))
+
+
+@app.route("/upload/<upload_id>", methods=["PUT"])
+def upload_chunk(upload_id):
+    offset = request.args.get("offset", type=int)
+    if offset is None:
+        return jsonify({"error": "Missing offset"}), 400
+
+    # request.stream reads from the socket; the body is never buffered whole
+    received = upload_sessions.write_chunk(upload_id, offset, request.stream, request.content_length)
+    return jsonify({"upload_id": upload_id, "received": received})
+
+
+@app.route("/upload/<upload_id>/complete", methods=["POST"])
+def upload_complete(upload_id):
+    # Locked so a retried /complete in another worker can't ingest twice;
+    # the loser finds the session gone (404)
+    with upload_sessions.lock(upload_id):
+        meta, part_path = upload_sessions.complete(upload_id)
+        receivers = meta["receivers"]
+
+        file_id, filename, stored_as = new_stored_name(meta["filename"])
+        sha256, size = blob_store.ingest_file(part_path, refs=len(receivers))
+        upload_sessions.discard(upload_id)
+
+    record_received(receivers, meta["sender"], filename, stored_as, size, sha256)
+
+    return upload_result(file_id, filename, stored_as, receivers)
+
+
+@app.route("/upload/<upload_id>", methods=["DELETE"])
+def upload_abort(upload_id):
+    with upload_sessions.lock(upload_id):
+        upload_sessions.get(upload_id)
+        upload_sessions.discard(upload_id)
+    return jsonify({"status": "aborted"})
+
+
+# ----------------------------------------------------
+# 1️⃣c CHUNK-LEVEL DEDUP (content-defined chunks, see UI/chunking.py)
+#   POST /chunks/missing    {"chunks": [sha256...]} → {"missing": [...]}
+#   PUT  /chunks/<sha256>   raw chunk body, verified against the hash
+#   POST /upload/manifest   {"receiver(s)", "sender", "filename", "chunks",
+#                            "sha256"} → 202 {"job"}: assembled into a blob +
+#                            inbox entry in the background
+#   GET  /upload/manifest/<job> → 202 while assembling, then the upload
+#                            result (200) or its error (400/409/413)
+# ----------------------------------------------------
+MANIFEST_MAX_CHUNKS = 100000
+MANIFEST_WORKERS = int(os.environ.get("CRYPTPORT_MANIFEST_WORKERS", "2"))
+
+# Concatenating a multi-GB manifest outlasts any client read timeout, so
+# it never runs on the request thread
+assembly_executor = ThreadPoolExecutor(max_workers=MANIFEST_WORKERS, thread_name_prefix="assemble")
+
+
+@app.errorhandler(ChunkError)
+def chunk_error(e):
+    return jsonify({"error": str(e), **e.extra}), e.status
+
+
+def chunk_list(data):
+    hashes = data.get("chunks") if isinstance(data, dict) else None
+    if not isinstance(hashes, list) or len(hashes) > MANIFEST_MAX_CHUNKS:
+        raise ChunkError("chunks must be a list of SHA-256 hashes")
+    hashes = [str(sha256).lower() for sha256 in hashes]
+    if not all(valid_sha256(sha256) for sha256 in hashes):
+        raise ChunkError("chunks must be a list of SHA-256 hashes")
+    return hashes
+
+
+@app.route("/chunks/missing", methods=["POST"])
+def chunks_missing():
+    hashes = chunk_list(request.get_json(silent=True))
+    return jsonify({"missing": chunk_store.missing(hashes)})
+
+
+@app.route("/chunks/<sha256>", methods=["PUT"])
+def chunk_put(sha256):
+    sha256 = sha256.lower()
+    if not valid_sha256(sha256):
+        return jsonify({"error": "Invalid chunk hash"}), 400
+
+    created = chunk_store.put(sha256, request.stream, request.content_length)
+    return jsonify({"sha256": sha256, "created": created}), 201 if created else 200
+
+
+@app.route("/upload/manifest", methods=["POST"])
+def upload_manifest():
+    data = request.get_json(silent=True) or {}
+    receivers = parse_receivers(data)
+
+    error = receivers_error(receivers)
+    if error:
+        return jsonify({"error": error}), 400
+    if not data.get("filename"):
+        return jsonify({"error": "Missing filename"}), 400
+
+    expected = (data.get("sha256") or "").lower() or None
+    if expected is not None and not valid_sha256(expected):
+        return jsonify({"error": "Invalid sha256"}), 400
+
+    # 409 {"missing": [...]} tells the client which chunks to (re)send
+    hashes = chunk_list(data)
+    missing = chunk_store.missing(hashes)
+    if missing:
+        raise ChunkError("Missing chunks", 409, missing=missing)
+
+    job_id = chunk_store.start_job()
+    assembly_executor.submit(assemble_manifest, job_id, hashes, expected, receivers,
+                             data.get("sender"), data["filename"])
+    return jsonify({"job": job_id, "status": "assembling"}), 202, {"Location": f"/upload/manifest/{job_id}"}
+
+
+@app.route("/upload/manifest/<job_id>", methods=["GET"])
+def upload_manifest_status(job_id):
+    job = chunk_store.job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    status, result = job
+    if status is None:
+        return jsonify({"job": job_id, "status": "assembling"}), 202
+    return jsonify(result), status
 
-    return jsonify({
-        "status": "success",
-        "file_id": file_id,
-        "stored_as": stored_as,
-        "original_filename": filename
-    }), 200
+
+def assemble_manifest(job_id, hashes, expected, receivers, sender, filename):
+    try:
+        sha256, size = chunk_store.assemble(hashes, expected, refs=len(receivers))
+        file_id, filename, stored_as = new_stored_name(filename)
+        record_received(receivers, sender, filename, stored_as, size, sha256)
+    except (ChunkError, QuotaError) as e:
+        chunk_store.finish_job(job_id, e.status, {"error": str(e), **e.extra})
+    except Exception as e:
+        print("Manifest assembly failed:", e)
+        chunk_store.finish_job(job_id, 500, {"error": "Assembly failed"})
+    else:
+        chunk_store.finish_job(job_id, 200, upload_payload(file_id, filename, stored_as, receivers))
 
 
 # ----------------------------------------------------
 # 2️⃣ LIST FILES
+#   Served from the inbox index, never from os.listdir
+#   ?sort=received_at|size|filename|sender&order=desc|asc&limit=&offset=
+#   "seq" in the reply is where /changes/<receiver>?since= picks up
 # ----------------------------------------------------
+LIST_MAX_PAGE = 1000
+
+
+def list_page(receiver, args):
+    """(payload, status) for /list; args is a MultiDict (shared with asgi_server)."""
+    sort = args.get("sort", "received_at")
+    descending = args.get("order", "desc").lower() != "asc"
+    limit = min(args.get("limit", 100, type=int), LIST_MAX_PAGE)
+    if limit <= 0:
+        return {"error": "limit must be positive"}, 400
+    offset = max(args.get("offset", 0, type=int), 0)
+
+    # Read before listing: a change landing in between is replayed, not lost
+    seq = inbox_index.change_seq()
+    try:
+        files, total = inbox_index.list(sanitize_email(receiver), sort, descending, limit, offset)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    return {"files": files, "total": total, "limit": limit, "offset": offset, "seq": seq}, 200
+
+
 @app.route("/list/<receiver>", methods=["GET"])
 def list_files(receiver):
-    safe_receiver = sanitize_email(receiver)
-    receiver_dir = os.path.join(RECEIVED_DIR, safe_receiver)
+    payload, status = list_page(receiver, request.args)
+    return jsonify(payload), status
+
+
+# ----------------------------------------------------
+# 2️⃣b DELETE RECEIVED FILE
+# ----------------------------------------------------
+def remove_received(receiver, stored_as):
+    """(payload, status) for deleting a received file (shared with asgi_server)."""
+    stored_as = secure_filename(stored_as)
+    item = inbox_index.remove(sanitize_email(receiver), stored_as)
+
+    # Blob references drop a refcount (the blob goes with the last one);
+    # legacy entries still own a file in the receiver folder
+    path = os.path.join(RECEIVED_DIR, sanitize_email(receiver), stored_as)
+    if item and item["blob"]:
+        blob_store.release(item["sha256"])
+    elif os.path.exists(path):
+        os.remove(path)
+    elif item is None:
+        return {"error": "File not found"}, 404
+
+    append_history(receiver, {
+        "timestamp": now_ts(),
+        "action": "deleted file",
+        "filename": stored_as.split("_", 1)[-1],
+        "stored_as": stored_as
+    })
+    return {"status": "deleted", "stored_as": stored_as}, 200
+
+
+@app.route("/files/<receiver>/<stored_as>", methods=["DELETE"])
+def delete_file(receiver, stored_as):
+    payload, status = remove_received(receiver, stored_as)
+    return jsonify(payload), status
+
+
+# ----------------------------------------------------
+# 2️⃣c INBOX EVENTS (Server-Sent Events)
+#   GET /events/<receiver> → text/event-stream, one "file" event per new
+#   inbox entry:  id: <inbox id>  event: file  data: <list item JSON>
+#   Reconnecting clients send Last-Event-ID and get what they missed.
+#   Each open stream holds one server thread; asgi_server.py holds none.
+# ----------------------------------------------------
+EVENTS_KEEPALIVE = 15         # seconds between ": keepalive" comments
+EVENTS_REPLAY_MAX = 500
+EVENTS_ROUTE = "/events/<receiver>"
+
+
+def sse_event(item):
+    """One SSE frame for an inbox item (item carries "id" and "receiver")."""
+    data = {key: value for key, value in item.items() if key not in ("id", "receiver")}
+    return f"id: {item['id']}\nevent: file\ndata: {json.dumps(data)}\n\n".encode()
+
+
+def events_replay(receiver, last_event_id):
+    """Items the client missed since last_event_id (empty for a fresh stream)."""
+    try:
+        last_id = int(last_event_id)
+    except (TypeError, ValueError):
+        return []
+    return inbox_index.after(last_id, sanitize_email(receiver), EVENTS_REPLAY_MAX)
+
+
+@app.route(EVENTS_ROUTE, methods=["GET"])
+def inbox_events(receiver):
+    key = sanitize_email(receiver)
+    last_event_id = request.headers.get("Last-Event-ID")
+
+    def stream():
+        # Runs after the request's own teardown: the open stream is counted
+        # here, and only a stream that started has a subscription to drop
+        HTTP_IN_FLIGHT.add(EVENTS_ROUTE)
+        pending = queue.Queue()
+        # Subscribe before the replay query so nothing falls in between;
+        # the id check below drops anything delivered twice
+        inbox_notifier.subscribe(key, pending.put)
+        sent = 0
+        try:
+            yield b": connected\n\n"
+            for item in events_replay(receiver, last_event_id):
+                sent = item["id"]
+                yield sse_event(item)
+            while True:
+                try:
+                    item = pending.get(timeout=EVENTS_KEEPALIVE)
+                except queue.Empty:
+                    yield b": keepalive\n\n"
+                    continue
+                if item["id"] > sent:
+                    sent = item["id"]
+                    yield sse_event(item)
+        finally:
+            inbox_notifier.unsubscribe(key, pending.put)
+            HTTP_IN_FLIGHT.add(EVENTS_ROUTE, by=-1)
+
+    return Response(stream(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",       # nginx: don't buffer the stream
+    })
+
+
+# ----------------------------------------------------
+# 2️⃣d CHANGE FEED (incremental inbox sync)
+#   GET /changes/<receiver>?since=<seq>&limit=
+#     → {"changes": [{"seq", "op": "add", "file"} | {"seq", "op": "remove",
+#        "stored_as"}], "seq", "has_more", "reset"}
+#   reset: since is older than the feed keeps; reload /list instead
+# ----------------------------------------------------
+CHANGES_MAX_PAGE = 1000
+
+
+def changes_page(receiver, args):
+    """(payload, status) for /changes; args is a MultiDict (shared with asgi_server)."""
+    since = args.get("since", type=int)
+    if since is None or since < 0:
+        return {"error": "since must be a sequence number from /list or /changes"}, 400
+    limit = min(args.get("limit", 500, type=int), CHANGES_MAX_PAGE)
+    if limit <= 0:
+        return {"error": "limit must be positive"}, 400
+
+    changes, seq, has_more, reset = inbox_index.changes(sanitize_email(receiver), since, limit)
+    return {"changes": changes, "seq": seq, "has_more": has_more, "reset": reset}, 200
 
-    if not os.path.exists(receiver_dir):
-        return jsonify({"files": []})
 
-    return jsonify({"files": os.listdir(receiver_dir)})
+@app.route("/changes/<receiver>", methods=["GET"])
+def list_changes(receiver):
+    payload, status = changes_page(receiver, request.args)
+    return jsonify(payload), status
 
 
 # ----------------------------------------------------
 # 3️⃣ DOWNLOAD FILE
+#   Supports Range / If-Range (206, multi-range), ETag and conditional GET
 # ----------------------------------------------------
+def log_download(receiver, filename, method, status, content_range):
+    """
+    Logs once per download: full body or the segment that starts at byte 0,
+    not for HEAD probes, 304s or the remaining segments of a resumed fetch.
+    """
+    starts_at_zero = status == 200 or (status == 206 and (content_range or "").startswith("bytes 0-"))
+    if method == "GET" and starts_at_zero:
+        original_name = filename.split("_", 1)[-1]
+        append_history(receiver, {
+            "timestamp": now_ts(),
+            "action": "downloaded file",
+            "filename": original_name,
+            "stored_as": filename
+        })
+
+
 @app.route("/download/<receiver>/<filename>", methods=["GET"])
 def download(receiver, filename):
-    safe_receiver = sanitize_email(receiver)
-    folder = os.path.join(RECEIVED_DIR, safe_receiver)
-
-    file_path = os.path.join(folder, filename)
-    if not os.path.exists(file_path):
+    filename = secure_filename(filename)
+    file_path, etag = resolve_received(receiver, filename) if filename else (None, None)
+    if file_path is None:
         return jsonify({"error": "File not found"}), 404
 
-    # Add history log
-    original_name = filename.split("_", 1)[-1]
-    history = load_user_history(receiver)
-    history.append({
-        "timestamp": now_ts(),
-        "action": "downloaded file",
-        "filename": original_name,
-        "stored_as": filename
-    })
-    save_user_history(receiver, history)
-
-    return send_from_directory(folder, filename, as_attachment=True)
+    response = send_file_ranged(request, file_path, filename, etag=etag)
+    log_download(receiver, filename, request.method, response.status_code,
+                 response.headers.get("Content-Range"))
+    return response
 
 
 # ----------------------------------------------------
 # 4️⃣ READ HISTORY
+#   No query string → full array, oldest first (original shape)
+#   ?limit=&before=&after=&action=&sender=&since=&until=
+#     → {"items": [...newest first...], "has_more", "next_before", "latest"}
 # ----------------------------------------------------
+HISTORY_PAGE_PARAMS = ("limit", "before", "after", "action", "sender", "since", "until")
+HISTORY_MAX_PAGE = 500
+
+
+def history_page(email, args):
+    """(payload, status) for /history; args is a MultiDict (shared with asgi_server)."""
+    if not any(param in args for param in HISTORY_PAGE_PARAMS):
+        return load_user_history(email), 200
+
+    limit = min(args.get("limit", 50, type=int), HISTORY_MAX_PAGE)
+    if limit <= 0:
+        return {"error": "limit must be positive"}, 400
+
+    receiver = sanitize_email(email)
+    history_writer.sync(receiver)
+    with HISTORY_LOAD.time("page"):
+        items, has_more = history_store.page(
+            receiver,
+            limit=limit,
+            before=args.get("before", type=int),
+            after=args.get("after", type=int),
+            action=args.get("action"),
+            sender=args.get("sender"),
+            since=args.get("since"),
+            until=args.get("until"),
+        )
+
+    return {
+        "items": items,
+        "has_more": has_more,
+        "next_before": items[-1]["id"] if items else None,
+        "latest": items[0]["id"] if items else None,
+    }, 200
+
+
 @app.route("/history/<email>", methods=["GET"])
 def get_history(email):
-    return jsonify(load_user_history(email))
+    payload, status = history_page(email, request.args)
+    return jsonify(payload), status
 
 
 # ----------------------------------------------------
 # 5️⃣ CLEAR HISTORY
 # ----------------------------------------------------
+def clear_history(email):
+    receiver = sanitize_email(email)
+    history_writer.sync(receiver)
+    history_store.clear(receiver)
+
+
 @app.route("/history/<email>/clear", methods=["DELETE"])
 def delete_history(email):
-    path = history_file(email)
-    if os.path.exists(path):
-        os.remove(path)
+    clear_history(email)
     return jsonify({"status": "cleared"})
 
 
+# ----------------------------------------------------
+# 6️⃣ MAINTENANCE REPORT
+#   Last pass of retention / quota / orphan sweep / history compaction
+# ----------------------------------------------------
+def maintenance_report():
+    return {
+        "enabled": MAINTENANCE_ENABLED,
+        "interval_seconds": MAINTENANCE_INTERVAL,
+        "policy": vars(maintenance.policy),
+        "last_pass": maintenance.last_report(),
+    }
+
+
+@app.route("/maintenance/report", methods=["GET"])
+def get_maintenance_report():
+    return jsonify(maintenance_report())
+
+
+# ----------------------------------------------------
+# 7️⃣ METRICS (Prometheus text format, all worker processes merged)
+# ----------------------------------------------------
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(metrics_exporter.collect(), mimetype="text/plain; version=0.0.4")
+
+
 # ----------------------------------------------------
 # RUN SERVER
 # ----------------------------------------------------
+# Development server only; for production use serve.py (multi-worker WSGI)
 if __name__ == "__main__":
     print("🚀 CryptPort Flask Server running at http://127.0.0.1:5000")
     app.run(host="127.0.0.1", port=5000, debug=True)
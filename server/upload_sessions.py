@@ -0,0 +1,192 @@
+"""
+Resumable chunked upload sessions for the CryptPort server.
+
+Each session lives on disk as two files under the uploads directory:
+ - <upload_id>.json   session metadata (receivers, sender, filename, size)
+ - <upload_id>.part   bytes received so far
+
+Because both are plain files, partial uploads survive a server restart.
+The contiguous byte count is simply the size of the .part file.
+
+A third file, <upload_id>.lock, serialises writers to one session across
+worker processes (see serve.py).
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+from datetime import datetime
+
+from locks import file_lock
+from metrics import DISK_WRITE, DISK_WRITE_BYTES
+
+CHUNK_SIZE = 8 * 1024 * 1024     # size clients are told to send per PUT
+COPY_BUFFER = 64 * 1024          # bytes moved from the socket to disk at a time
+
+_UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+
+class UploadSessions:
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    # ----------------------------------------------------
+    # PATHS
+    # ----------------------------------------------------
+    def _paths(self, upload_id):
+        if not _UPLOAD_ID_RE.match(upload_id or ""):
+            raise UploadError("Invalid upload id", 404)
+        base = os.path.join(self.root, upload_id)
+        return base + ".json", base + ".part"
+
+    def lock(self, upload_id):
+        """Cross-process lock for one session (chunk writes, completion)."""
+        self._paths(upload_id)
+        return file_lock(os.path.join(self.root, upload_id + ".lock"))
+
+    def _write_meta(self, meta_path, meta):
+        tmp = meta_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, meta_path)
+
+    # ----------------------------------------------------
+    # SESSION LIFECYCLE
+    # ----------------------------------------------------
+    def create(self, receivers, sender, filename, size=None):
+        """receivers: one email or a list of them."""
+        if isinstance(receivers, str):
+            receivers = [receivers]
+        upload_id = uuid.uuid4().hex
+        meta_path, part_path = self._paths(upload_id)
+
+        meta = {
+            "upload_id": upload_id,
+            "receivers": list(receivers),
+            "sender": sender,
+            "filename": filename,
+            "size": size,
+            "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        open(part_path, "wb").close()
+        self._write_meta(meta_path, meta)
+        return self.status(upload_id)
+
+    def get(self, upload_id):
+        meta_path, part_path = self._paths(upload_id)
+        if not os.path.exists(meta_path) or not os.path.exists(part_path):
+            raise UploadError("Upload session not found", 404)
+        with open(meta_path, "r") as f:
+            return json.load(f)
+
+    def status(self, upload_id):
+        meta = self.get(upload_id)
+        _, part_path = self._paths(upload_id)
+        meta["received"] = os.path.getsize(part_path)
+        meta["chunk_size"] = CHUNK_SIZE
+        return meta
+
+    def write_chunk(self, upload_id, offset, stream, length=None):
+        """
+        Copies the request body straight from the socket into the .part file
+        at offset. Offsets past the received prefix are rejected so the file
+        never has holes; re-sending an already received range is allowed.
+        """
+        with self.lock(upload_id):
+            meta = self.get(upload_id)
+            _, part_path = self._paths(upload_id)
+            received = os.path.getsize(part_path)
+
+            if offset < 0 or offset > received:
+                raise UploadError("Chunk offset out of order", 409, received=received)
+            if meta["size"] is not None and length is not None and offset + length > meta["size"]:
+                raise UploadError("Chunk exceeds declared upload size", 416, received=received)
+
+            remaining = length
+            with open(part_path, "r+b") as f:
+                f.seek(offset)
+                while remaining is None or remaining > 0:
+                    block = stream.read(COPY_BUFFER if remaining is None else min(COPY_BUFFER, remaining))
+                    if not block:
+                        break
+                    started = time.perf_counter()
+                    f.write(block)
+                    DISK_WRITE.observe(time.perf_counter() - started, "upload_part")
+                    DISK_WRITE_BYTES.inc("upload_part", by=len(block))
+                    if remaining is not None:
+                        remaining -= len(block)
+
+            return os.path.getsize(part_path)
+
+    def complete(self, upload_id):
+        """Validates the session and returns (meta, part_path); caller moves the file."""
+        meta = self.status(upload_id)
+        if meta["size"] is not None and meta["received"] != meta["size"]:
+            raise UploadError("Upload incomplete", 409, received=meta["received"])
+        _, part_path = self._paths(upload_id)
+        return meta, part_path
+
+    def discard(self, upload_id):
+        for path in self._paths(upload_id):
+            if os.path.exists(path):
+                os.remove(path)
+        try:
+            os.remove(os.path.join(self.root, upload_id + ".lock"))
+        except OSError:
+            pass    # still open by the caller's lock on Windows
+
+    # ----------------------------------------------------
+    # CLEANUP (maintenance.py)
+    # ----------------------------------------------------
+    def sweep(self, max_age_seconds=7 * 24 * 3600):
+        """
+        Discards sessions whose .part hasn't been written for max_age_seconds
+        and removes leftovers of finished ones (.lock and .tmp files, a .part
+        without its .json). Returns (sessions discarded, bytes freed).
+        """
+        cutoff = time.time() - max_age_seconds
+        names = set(os.listdir(self.root))
+        sessions, freed = 0, 0
+
+        for name in sorted(names):
+            upload_id, _, ext = name.partition(".")
+            if not _UPLOAD_ID_RE.match(upload_id):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if st.st_mtime >= cutoff:
+                continue
+
+            if ext == "json":
+                with self.lock(upload_id):
+                    _, part_path = self._paths(upload_id)
+                    try:
+                        if os.path.getmtime(part_path) >= cutoff:
+                            continue        # written to while we waited for the lock
+                        freed += os.path.getsize(part_path)
+                    except OSError:
+                        pass
+                    self.discard(upload_id)
+                sessions += 1
+            elif ext == "json.tmp" or (ext in ("part", "lock") and upload_id + ".json" not in names):
+                # A live session's .lock stays: removing it would let two
+                # processes lock different files
+                try:
+                    os.remove(path)
+                    freed += st.st_size
+                except OSError:
+                    pass
+        return sessions, freed